@@ -0,0 +1,16 @@
+# asyncio application is imported so that we can pass it to an asgi server.
+
+from src import app as flask_app
+from src.asgi import app
+from src.main import evict_catalog, seat_events, timetable
+from src.models import Show
+from src.seats import start_hold_sweeper
+
+if flask_app.config['SEAT_HOLD_SWEEP_INTERVAL'] > 0:
+    start_hold_sweeper(flask_app, flask_app.config['SEAT_HOLD_SWEEP_INTERVAL'],
+                       flask_app.config['SEAT_HOLD_SWEEP_BATCH'])
+
+seat_events.add_listener(evict_catalog)
+
+if flask_app.config['TIMETABLE_DAYS'] > 0:
+    timetable.start(flask_app, Show.timetable, seat_events)
@@ -0,0 +1,13 @@
+"""
+Benchmarks and load tests, see the docstring of each module for usage.
+Only the data generator needs the app and its database, the load
+generator uses nothing but the standard library.
+"""
+import os
+
+# dataset manifest shared by the data and load generators
+MANIFEST = os.path.join(os.path.dirname(__file__), "dataset.json")
+
+
+def phone_number(user_id):
+    return "9{0:09d}".format(user_id)
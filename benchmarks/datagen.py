@@ -0,0 +1,226 @@
+"""
+Synthetic dataset for the load tests.
+
+Fills cities, cinemas, movies, shows, users and tickets at the requested
+scale with Postgres ``COPY`` and writes a manifest describing it, which
+the load generator reads to build valid requests. Every user has the same
+password, hashed once. One extra "premiere" movie plays a single show
+today, which the premiere scenario books out.
+
+    python -m benchmarks.datagen --reset --cities 10 --users 10000
+
+The database is the one the app is configured for. ``--reset`` empties
+the tables first and is required when they already hold data.
+"""
+import argparse
+import csv
+import io
+import json
+import random
+import time
+import uuid
+from datetime import date, timedelta
+
+from benchmarks import MANIFEST, phone_number
+from src.main import app, db, hashing_pool
+
+PASSWORD = "benchmark-password"
+SHOW_TIMES = ("09:30", "12:45", "16:00", "19:15", "22:30")
+TABLES = ("tickets", "seat_holds", "shows", "movie_runs", "cinemas",
+          "movies", "cities", "users")
+
+
+class RowReader:
+    """
+    File-like object which renders rows as CSV only as fast as COPY reads
+    them, so the dataset never has to fit in memory.
+    """
+    def __init__(self, rows):
+        self._rows = iter(rows)
+        self._buffer = ""
+        self._output = io.StringIO()
+        self._writer = csv.writer(self._output)
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            row = next(self._rows, None)
+            if row is None:
+                break
+            self._writer.writerow(row)
+            self._buffer += self._output.getvalue()
+            self._output.seek(0)
+            self._output.truncate()
+        if size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
+def generate(args, rng, today):
+    """
+    Returns the rows of every table, as generators, and the manifest.
+    """
+    cinemas = args.cities * args.cinemas_per_city
+    premiere_movie = args.movies + 1
+    show_times = SHOW_TIMES[:args.show_times]
+    days = [today + timedelta(days=day) for day in range(args.days)]
+    # movies each cinema plays, the premiere only at the first cinema
+    programme = {
+        cinema: rng.sample(range(1, args.movies + 1),
+                           min(args.movies_per_cinema, args.movies))
+        for cinema in range(1, cinemas + 1)
+    }
+
+    # cinemas are spread up to about 15 km around their city's centre
+    centres = [(rng.uniform(8, 30), rng.uniform(70, 88))
+               for _ in range(args.cities)]
+    cinema_cities = [(cinema, (cinema - 1) // args.cinemas_per_city + 1)
+                     for cinema in range(1, cinemas + 1)]
+
+    def shows():
+        for cinema, movies in programme.items():
+            for movie in movies:
+                for day in days:
+                    for show_time in show_times:
+                        yield (movie, cinema, show_time, day, args.seats,
+                               "0" * args.seats)
+        yield (premiere_movie, 1, show_times[0], today, args.premiere_seats,
+               "0" * args.premiere_seats)
+
+    def tickets():
+        ticket_id = 0
+        for user in range(1, args.users + 1):
+            for _ in range(args.tickets_per_user):
+                ticket_id += 1
+                cinema = rng.randint(1, cinemas)
+                booked = today - timedelta(days=rng.randint(0, 365))
+                yield (ticket_id, str(uuid.uuid4()),
+                       rng.choice(programme[cinema]), cinema,
+                       rng.choice(show_times), rng.randint(1, 4),
+                       booked + timedelta(days=rng.randint(0, 14)), booked,
+                       user)
+
+    password = hashing_pool.hash(PASSWORD)
+    rows = {
+        "cities": (("id", "city_name"),
+                   ((city, "City {0}".format(city))
+                    for city in range(1, args.cities + 1))),
+        "movies": (("id", "name", "release_date"),
+                   [(movie, "Movie {0}".format(movie),
+                     today - timedelta(days=rng.randint(0, 90)))
+                    for movie in range(1, args.movies + 1)] +
+                   [(premiere_movie, "Premiere", today)]),
+        "cinemas": (("id", "name", "show_times", "city", "latitude",
+                     "longitude"),
+                    ((cinema, "Cinema {0}".format(cinema),
+                      "{" + ",".join(show_times) + "}", city,
+                      centres[city - 1][0] + rng.uniform(-0.15, 0.15),
+                      centres[city - 1][1] + rng.uniform(-0.15, 0.15))
+                     for cinema, city in cinema_cities)),
+        "shows": (("movie_id", "cinema_id", "show_times", "show_date",
+                   "no_of_seats", "seat_map"), shows()),
+        "users": (("id", "phone_number", "password"),
+                  ((user, phone_number(user), password)
+                   for user in range(1, args.users + 1))),
+        "tickets": (("id", "transaction_id", "movie", "cinema", "show_time",
+                     "no_of_seats", "ticket_date", "transaction_date",
+                     "user"), tickets()),
+    }
+    manifest = {
+        "generated": today.isoformat(),
+        "seed": args.seed,
+        "cities": args.cities,
+        "city_centres": centres,
+        "cinemas": cinemas,
+        "movies": args.movies,
+        "days": args.days,
+        "show_times": list(show_times),
+        "users": args.users,
+        "password": PASSWORD,
+        "premiere": {
+            "movie_id": premiere_movie,
+            "cinema_id": 1,
+            "show_time": show_times[0],
+            "ticket_date": today.strftime("%d-%m-%Y"),
+            "seats": args.premiere_seats
+        }
+    }
+    return rows, manifest
+
+
+def load(rows, reset):
+    """
+    Copies every table in one transaction and returns the rows per table.
+    """
+    counts = {}
+    connection = db.engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute("SET LOCAL statement_timeout = 0")
+        if reset:
+            cursor.execute("TRUNCATE {0} RESTART IDENTITY CASCADE".format(
+                ", ".join(TABLES)))
+        else:
+            cursor.execute("SELECT EXISTS (SELECT 1 FROM users) "
+                           "OR EXISTS (SELECT 1 FROM shows)")
+            if cursor.fetchone()[0]:
+                raise SystemExit("Database already holds data, pass --reset "
+                                 "to replace it")
+        for table in ("cities", "movies", "cinemas", "shows", "users",
+                      "tickets"):
+            columns, table_rows = rows[table]
+            cursor.copy_expert(
+                'COPY {0} ({1}) FROM STDIN WITH (FORMAT csv)'.format(
+                    table, ", ".join('"{0}"'.format(column)
+                                     for column in columns)),
+                RowReader(table_rows))
+            counts[table] = cursor.rowcount
+            if "id" in columns:
+                cursor.execute(
+                    "SELECT setval(pg_get_serial_sequence('{0}', 'id'), "
+                    "(SELECT max(id) FROM {0}))".format(table))
+        # fresh statistics, so the first benchmark run gets good plans
+        cursor.execute("ANALYZE")
+        connection.commit()
+    except BaseException:
+        connection.rollback()
+        raise
+    finally:
+        connection.close()
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("--cities", type=int, default=10)
+    parser.add_argument("--cinemas-per-city", type=int, default=10)
+    parser.add_argument("--movies", type=int, default=200)
+    parser.add_argument("--movies-per-cinema", type=int, default=8)
+    parser.add_argument("--show-times",
+                        type=int,
+                        default=4,
+                        choices=range(1, len(SHOW_TIMES) + 1))
+    parser.add_argument("--days", type=int, default=7)
+    parser.add_argument("--seats", type=int, default=200)
+    parser.add_argument("--premiere-seats", type=int, default=500)
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--tickets-per-user", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--reset", action="store_true")
+    parser.add_argument("--manifest", default=MANIFEST)
+    args = parser.parse_args()
+
+    started = time.monotonic()
+    with app.app_context():
+        rows, manifest = generate(args, random.Random(args.seed),
+                                  date.today())
+        manifest["rows"] = load(rows, args.reset)
+    manifest["seconds"] = round(time.monotonic() - started, 2)
+    with open(args.manifest, "w") as file:
+        json.dump(manifest, file, indent=2)
+    print(json.dumps(manifest["rows"]))
+
+
+if __name__ == "__main__":
+    main()
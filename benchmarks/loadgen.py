@@ -0,0 +1,348 @@
+"""
+Load generator for a running API server.
+
+Drives the real routes of src/urls.py with one of the scenarios below from
+``--workers`` threads, each on its own keep-alive connection, and prints
+throughput and p50/p95/p99 latency per endpoint as JSON:
+
+* ``browse``: catalog reads, cities, movies of a city and shows of a movie
+* ``login``: a login storm of random users, some with a wrong password
+* ``premiere``: logged in users all booking the single premiere show
+* ``storm``: the browse reads of part of the workers while the others run
+  the login storm, whose catalog latency ``all`` compares with ``browse``
+
+The dataset manifest written by ``benchmarks.datagen`` says which ids,
+users and show exist.
+
+    python -m benchmarks.loadgen --url http://localhost:7000 \\
+        --scenario browse --duration 30 --workers 32 --output browse.json
+"""
+import argparse
+import http.client
+import json
+import random
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import date, timedelta
+from urllib.parse import urlencode, urlsplit
+
+from benchmarks import MANIFEST, phone_number
+from benchmarks.stats import summarize
+
+
+class Client:
+    """
+    Keep-alive HTTP client of a single worker thread.
+    """
+    def __init__(self, url, timeout):
+        parts = urlsplit(url)
+        connection_class = (http.client.HTTPSConnection if parts.scheme
+                            == "https" else http.client.HTTPConnection)
+        self._connect = lambda: connection_class(parts.netloc,
+                                                 timeout=timeout)
+        self._connection = self._connect()
+        self.token = None
+
+    def request(self, method, path, body=None):
+        """
+        Returns (status, decoded JSON body). Status is 0 when the request
+        failed without a response.
+        """
+        headers = {"Content-Type": "application/json"}
+        if self.token:
+            headers["Authorization"] = "Bearer " + self.token
+        payload = json.dumps(body) if body is not None else None
+        try:
+            self._connection.request(method, path, payload, headers)
+            response = self._connection.getresponse()
+            data = response.read()
+        except (OSError, http.client.HTTPException):
+            self._connection.close()
+            self._connection = self._connect()
+            return 0, None
+        try:
+            return response.status, json.loads(data) if data else None
+        except ValueError:
+            return response.status, None
+
+
+class Browse:
+    """
+    Catalog reads, weighted the way a listing page is browsed.
+    """
+    def __init__(self, manifest, rng):
+        self.manifest = manifest
+        self.rng = rng
+        generated = date.fromisoformat(manifest["generated"])
+        self.dates = [(generated + timedelta(days=day)).strftime("%d-%m-%Y")
+                      for day in range(manifest["days"])]
+
+    def setup(self, client):
+        pass
+
+    def step(self, client):
+        roll = self.rng.random()
+        if roll < 0.1:
+            return "GET /cities/", client.request("GET", "/cities/")
+        if roll < 0.5:
+            query = {"city_id": self.rng.randint(1, self.manifest["cities"])}
+            if self.rng.random() < 0.5:
+                query["show_date"] = self.rng.choice(self.dates)
+            return "GET /movies/", client.request(
+                "GET", "/movies/?" + urlencode(query))
+        query = {
+            "movie_id": self.rng.randint(1, self.manifest["movies"]),
+            "show_date": self.rng.choice(self.dates)
+        }
+        return "GET /shows/", client.request("GET",
+                                             "/shows/?" + urlencode(query))
+
+
+class LoginStorm:
+    """
+    Logins of random users, ``bad_password_rate`` of them failing.
+    """
+    def __init__(self, manifest, rng, bad_password_rate):
+        self.manifest = manifest
+        self.rng = rng
+        self.bad_password_rate = bad_password_rate
+
+    def setup(self, client):
+        pass
+
+    def step(self, client):
+        password = self.manifest["password"]
+        if self.rng.random() < self.bad_password_rate:
+            password += "-wrong"
+        return "POST /user/login/", client.request(
+            "POST", "/user/login/", {
+                "phone_number":
+                phone_number(self.rng.randint(1, self.manifest["users"])),
+                "password": password
+            })
+
+
+class BrowseDuringLogins:
+    """
+    Catalog reads from ``browse_share`` of the workers while the others
+    log in, so slow password hashing shows up as catalog latency.
+    """
+    def __init__(self, manifest, rng, bad_password_rate, browse_share):
+        self.browse = Browse(manifest, rng)
+        self.login = LoginStorm(manifest, rng, bad_password_rate)
+        self.browse_share = browse_share
+        self._roles = {}
+        self._lock = threading.Lock()
+
+    def setup(self, client):
+        with self._lock:
+            workers = len(self._roles)
+            # spreads the browsing workers evenly over the start order
+            browsing = (int((workers + 1) * self.browse_share) !=
+                        int(workers * self.browse_share))
+            self._roles[client] = self.browse if browsing else self.login
+
+    def step(self, client):
+        return self._roles[client].step(client)
+
+
+class Premiere:
+    """
+    Every worker logs in as its own user before the clock starts and then
+    books one to four seats of the premiere show until time runs out.
+    """
+    def __init__(self, manifest, rng):
+        self.manifest = manifest
+        self.rng = rng
+        self._users = iter(range(1, manifest["users"] + 1))
+        self._lock = threading.Lock()
+        self.booked = 0
+
+    def setup(self, client):
+        with self._lock:
+            user = next(self._users)
+        status, body = client.request(
+            "POST", "/user/login/", {
+                "phone_number": phone_number(user),
+                "password": self.manifest["password"]
+            })
+        if status != 200:
+            raise RuntimeError("Login of user {0} failed with {1}".format(
+                user, status))
+        client.token = body["refresh_token"]
+
+    def step(self, client):
+        premiere = self.manifest["premiere"]
+        seats = self.rng.randint(1, 4)
+        status, body = client.request(
+            "POST", "/tickets/", {
+                "movie_id": premiere["movie_id"],
+                "cinema_id": premiere["cinema_id"],
+                "show_time": premiere["show_time"],
+                "ticket_date": premiere["ticket_date"],
+                "no_of_seats": seats
+            })
+        if status == 200:
+            with self._lock:
+                self.booked += seats
+        return "POST /tickets/", (status, body)
+
+    def report(self):
+        seats = self.manifest["premiere"]["seats"]
+        return {
+            "seats": seats,
+            "booked": self.booked,
+            "oversold": self.booked > seats
+        }
+
+
+def run(scenario, url, workers, duration, timeout):
+    """
+    Runs the scenario and returns its results per endpoint.
+    """
+    samples = defaultdict(list)
+    statuses = defaultdict(Counter)
+    lock = threading.Lock()
+    state = {}
+
+    def start_clock():
+        state["deadline"] = time.monotonic() + duration
+        state["started"] = time.monotonic()
+
+    # the clock starts once every worker finished its setup
+    ready = threading.Barrier(workers + 1, action=start_clock)
+
+    def worker():
+        client = Client(url, timeout)
+        local_samples = defaultdict(list)
+        local_statuses = defaultdict(Counter)
+        try:
+            scenario.setup(client)
+        finally:
+            ready.wait()
+        while time.monotonic() < state["deadline"]:
+            started = time.monotonic()
+            endpoint, (status, _) = scenario.step(client)
+            local_samples[endpoint].append(time.monotonic() - started)
+            local_statuses[endpoint][status] += 1
+        with lock:
+            for endpoint, values in local_samples.items():
+                samples[endpoint].extend(values)
+                statuses[endpoint].update(local_statuses[endpoint])
+
+    threads = [
+        threading.Thread(target=worker, daemon=True) for _ in range(workers)
+    ]
+    for thread in threads:
+        thread.start()
+    ready.wait()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - state["started"]
+
+    endpoints = {}
+    for endpoint, values in sorted(samples.items()):
+        errors = sum(count for status, count in statuses[endpoint].items()
+                     if status == 0 or status >= 500)
+        endpoints[endpoint] = {
+            "requests": len(values),
+            "errors": errors,
+            "throughput": round(len(values) / elapsed, 2),
+            "latency_ms": summarize(values),
+            "statuses": {
+                str(status): count
+                for status, count in sorted(statuses[endpoint].items())
+            }
+        }
+    total = sum(len(values) for values in samples.values())
+    return {
+        "seconds": round(elapsed, 2),
+        "requests": total,
+        "throughput": round(total / elapsed, 2),
+        "latency_ms": summarize(
+            [value for values in samples.values() for value in values]),
+        "endpoints": endpoints
+    }
+
+
+def compare_catalog(browse, storm):
+    """
+    Latency of each catalog endpoint alone and during the login storm.
+    """
+    return {
+        endpoint: {
+            "alone_ms": browse["endpoints"][endpoint]["latency_ms"],
+            "during_logins_ms": result["latency_ms"]
+        }
+        for endpoint, result in storm["endpoints"].items()
+        if endpoint in browse["endpoints"]
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:7000")
+    parser.add_argument("--scenario",
+                        choices=("browse", "login", "premiere", "storm",
+                                 "all"),
+                        default="all")
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=30,
+                        help="seconds each scenario runs")
+    parser.add_argument("--timeout", type=float, default=10)
+    parser.add_argument("--bad-password-rate", type=float, default=0.1)
+    parser.add_argument("--browse-share",
+                        type=float,
+                        default=0.5,
+                        help="share of the storm workers browsing")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--manifest", default=MANIFEST)
+    parser.add_argument("--output", help="file written instead of stdout")
+    args = parser.parse_args()
+
+    with open(args.manifest) as file:
+        manifest = json.load(file)
+    rng = random.Random(args.seed)
+    scenarios = {
+        "browse": lambda: Browse(manifest, rng),
+        "login": lambda: LoginStorm(manifest, rng, args.bad_password_rate),
+        "premiere": lambda: Premiere(manifest, rng),
+        "storm": lambda: BrowseDuringLogins(
+            manifest, rng, args.bad_password_rate, args.browse_share),
+    }
+    names = list(scenarios) if args.scenario == "all" else [args.scenario]
+
+    results = {
+        "url": args.url,
+        "workers": args.workers,
+        "duration": args.duration,
+        "dataset": {
+            key: manifest.get(key)
+            for key in ("cities", "cinemas", "movies", "users", "rows")
+        },
+        "scenarios": {}
+    }
+    for name in names:
+        scenario = scenarios[name]()
+        result = run(scenario, args.url, args.workers, args.duration,
+                     args.timeout)
+        if hasattr(scenario, "report"):
+            result["report"] = scenario.report()
+        results["scenarios"][name] = result
+    if "browse" in results["scenarios"] and "storm" in results["scenarios"]:
+        results["scenarios"]["storm"]["report"] = compare_catalog(
+            results["scenarios"]["browse"], results["scenarios"]["storm"])
+
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output + "\n")
+    else:
+        sys.stdout.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
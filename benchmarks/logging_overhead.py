@@ -0,0 +1,94 @@
+"""
+Logging overhead per request, as seen by the request thread.
+
+"before" replays the old access log: strftime plus an eager str.format
+written synchronously by a StreamHandler. "after" logs the same line with
+lazy arguments through the queue handler of src/logs.py. The output stream
+sleeps ``--write-delay`` microseconds per write to model a slow or
+contended stderr pipe.
+
+    python -m benchmarks.logging_overhead --requests 20000
+"""
+import argparse
+import json
+import logging
+import time
+from time import strftime
+
+from benchmarks.stats import summarize
+from src.logs import configure_logging
+
+
+class SlowStream:
+    def __init__(self, delay):
+        self.delay = delay
+
+    def write(self, data):
+        if self.delay:
+            time.sleep(self.delay)
+        return len(data)
+
+    def flush(self):
+        pass
+
+
+def before(logger, requests):
+    samples = []
+    for i in range(requests):
+        started = time.perf_counter()
+        timestamp = strftime('[%Y-%b-%d %H:%M]')
+        logger.info('{0} {1} {2} {3} {4} {5}'.format(
+            timestamp, '127.0.0.1', 'GET', 'http',
+            '/shows/?movie_id={0}'.format(i), '200 OK'))
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def after(logger, requests):
+    samples = []
+    for i in range(requests):
+        started = time.perf_counter()
+        logger.info('%s %s %s %s %s', '127.0.0.1', 'GET', 'http',
+                    '/shows/?movie_id={0}'.format(i), '200 OK')
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=20000)
+    parser.add_argument('--write-delay', type=float, default=50,
+                        help='microseconds each write blocks')
+    args = parser.parse_args()
+    stream = SlowStream(args.write_delay / 1e6)
+    root = logging.getLogger()
+    logger = logging.getLogger('benchmark')
+
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(
+        logging.Formatter(
+            '[%(asctime)s] %(levelname)s in %(module)s: %(message)s'))
+    root.addHandler(handler)
+    root.setLevel(logging.INFO)
+    sync_samples = before(logger, args.requests)
+
+    queue_handler = configure_logging(stream=stream,
+                                      queue_size=args.requests)
+    queued_samples = after(logger, args.requests)
+    queue_handler.listener.stop()
+
+    print(
+        json.dumps(
+            {
+                "unit": "microseconds per request",
+                "requests": args.requests,
+                "write_delay_us": args.write_delay,
+                "before": summarize(sync_samples, scale=1e6, digits=2),
+                "after": summarize(queued_samples, scale=1e6, digits=2),
+                "dropped": queue_handler.dropped
+            },
+            indent=2))
+
+
+if __name__ == '__main__':
+    main()
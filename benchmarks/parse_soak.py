@@ -0,0 +1,125 @@
+"""
+Soak benchmark of request validation, src/validators.py.
+
+Parses ``--requests`` requests (a million by default) with
+``validators.parse``, cycling through the query strings and bodies of the
+catalog, booking and login endpoints, every tenth one invalid. Only the
+parse is timed, inside a request context built beforehand. Every
+``--window`` requests it reports the parse latency of the window, the
+live Python objects and the peak RSS, which stay flat when nothing grows
+per request. Needs the app's settings to import the validators but not
+its database.
+
+    python -m benchmarks.parse_soak --requests 1000000
+"""
+import argparse
+import gc
+import json
+import random
+import resource
+import time
+from datetime import date, timedelta
+
+from werkzeug.exceptions import HTTPException
+
+from benchmarks import phone_number
+from benchmarks.stats import summarize
+from src import validators
+from src.main import app
+
+
+def generate_requests(rng):
+    """
+    Yields (schema, location, request context arguments) forever.
+    """
+    dates = [(date.today() + timedelta(days=day)).strftime("%d-%m-%Y")
+             for day in range(7)]
+    while True:
+        invalid = rng.random() < 0.1
+        yield validators.movie_query, "args", {
+            "path": "/movies/",
+            "query_string": {
+                "city_id": "x" if invalid else rng.randint(1, 100),
+                "show_date": rng.choice(dates),
+                "limit": 20
+            }
+        }
+        yield validators.show_query, "args", {
+            "path": "/shows/",
+            "query_string": {
+                "movie_id": rng.randint(1, 10000),
+                "show_date": "31-02-2020" if invalid else rng.choice(dates)
+            }
+        }
+        yield validators.ticket, "json", {
+            "path": "/tickets/",
+            "method": "POST",
+            "json": {
+                "movie_id": rng.randint(1, 10000),
+                "cinema_id": rng.randint(1, 5000),
+                "show_time": "19:15",
+                "ticket_date": rng.choice(dates),
+                "no_of_seats": 0 if invalid else rng.randint(1, 4)
+            }
+        }
+        yield validators.user_credentials, "json", {
+            "path": "/user/login/",
+            "method": "POST",
+            "json": {
+                "phone_number": phone_number(rng.randint(1, 100000)),
+                "password": "" if invalid else "benchmark-password"
+            }
+        }
+
+
+def parse(schema, location):
+    try:
+        validators.parse(schema, location)
+    except HTTPException:
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=1000000)
+    parser.add_argument('--window', type=int, default=100000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    windows = []
+    samples = []
+    started = time.perf_counter()
+    generated = generate_requests(random.Random(args.seed))
+    for count in range(1, args.requests + 1):
+        schema, location, request_args = next(generated)
+        with app.test_request_context(**request_args):
+            parse_started = time.perf_counter()
+            parse(schema, location)
+            samples.append(time.perf_counter() - parse_started)
+        if count % args.window == 0 or count == args.requests:
+            gc.collect()
+            windows.append({
+                "requests": count,
+                "parse_us": summarize(samples, scale=1e6, digits=1),
+                "objects": len(gc.get_objects()),
+                "max_rss_kb": resource.getrusage(
+                    resource.RUSAGE_SELF).ru_maxrss
+            })
+            samples = []
+
+    first, last = windows[0], windows[-1]
+    print(
+        json.dumps(
+            {
+                "requests": args.requests,
+                "seconds": round(time.perf_counter() - started, 2),
+                "windows": windows,
+                "p50_drift": round(
+                    last["parse_us"]["p50"] / first["parse_us"]["p50"], 3),
+                "object_growth": last["objects"] - first["objects"]
+            },
+            indent=2))
+
+
+if __name__ == '__main__':
+    main()
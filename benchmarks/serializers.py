@@ -0,0 +1,75 @@
+"""
+Response serialization of /movies/ for a city playing ``--movies`` movies
+(10k by default).
+
+"marshmallow" is the old path: a new ``MovieSchema(many=True)`` dumping
+the city's ``Movie`` objects, encoded with ``json.dumps`` as flask_restful
+did by default. "rows" is the current one: ``serialize_movies`` over the
+(id, name) rows the query selects, encoded with ``encode_json`` of
+src/main.py (orjson when installed). Both the dump and the encoding are
+timed, ``--repeat`` times each. Needs the app's settings to import the
+models but not its database.
+
+    python -m benchmarks.serializers --movies 10000
+"""
+import argparse
+import json
+import time
+
+from benchmarks.stats import summarize
+from src.main import encode_json
+from src.models import Movie
+from src.schemas import MovieSchema, serialize_movies
+
+
+def measure(serialize, encode, data, repeat):
+    serialize_samples = []
+    encode_samples = []
+    size = 0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        serialized = {"data": serialize(data), "next": None}
+        serialized_at = time.perf_counter()
+        body = encode(serialized)
+        encode_samples.append(time.perf_counter() - serialized_at)
+        serialize_samples.append(serialized_at - started)
+        size = len(body)
+    return {
+        "serialize_ms": summarize(serialize_samples),
+        "encode_ms": summarize(encode_samples),
+        "total_ms": summarize([
+            serialized + encoded
+            for serialized, encoded in zip(serialize_samples, encode_samples)
+        ]),
+        "bytes": size
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--movies', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    rows = [(movie_id, "Movie {0}".format(movie_id))
+            for movie_id in range(1, args.movies + 1)]
+    movies = [Movie(id=movie_id, name=name) for movie_id, name in rows]
+
+    marshmallow = measure(lambda data: MovieSchema(many=True).dump(data),
+                          json.dumps, movies, args.repeat)
+    row_path = measure(serialize_movies, encode_json, rows, args.repeat)
+    print(
+        json.dumps(
+            {
+                "movies": args.movies,
+                "marshmallow": marshmallow,
+                "rows": row_path,
+                "speedup_p50": round(
+                    marshmallow["total_ms"]["p50"] /
+                    row_path["total_ms"]["p50"], 1)
+            },
+            indent=2))
+
+
+if __name__ == '__main__':
+    main()
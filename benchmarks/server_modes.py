@@ -0,0 +1,143 @@
+"""
+Waitress against the ASGI server at ``--workers`` concurrent connections
+(1000 by default).
+
+Starts each deployment of the Procfile in turn, waitress with ``wsgi:app``
+and uvicorn with ``asgi:app``, on ``--port``, waits for its health check
+and runs a load generator scenario against it (see benchmarks/loadgen.py),
+then prints both results and their throughput and p99 latency side by
+side as JSON. Waitress keeps its defaults unless ``--waitress-threads`` is
+given, so connections beyond its connection limit wait in the listen
+backlog, as they would in production. Both servers use the app's settings
+and database, loaded with ``benchmarks.datagen`` beforehand. Every
+connection is a file descriptor, so raise ``ulimit -n`` first.
+
+    python -m benchmarks.server_modes --workers 1000 --duration 60 \\
+        --output server_modes.json
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+
+from benchmarks import MANIFEST
+from benchmarks.loadgen import Browse, BrowseDuringLogins, LoginStorm, run
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def server_command(mode, port, waitress_threads):
+    if mode == "asgi":
+        return [
+            sys.executable, "-m", "uvicorn", "asgi:app", "--host",
+            "127.0.0.1", "--port",
+            str(port)
+        ]
+    command = [
+        sys.executable, "-m", "waitress", "--host=127.0.0.1",
+        "--port={0}".format(port)
+    ]
+    if waitress_threads:
+        command.append("--threads={0}".format(waitress_threads))
+    return command + ["wsgi:app"]
+
+
+def wait_until_ready(port, process, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("Server exited with {0}".format(
+                process.returncode))
+        connection = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+        try:
+            connection.request("GET", "/health-check/")
+            if connection.getresponse().status == 200:
+                return
+        except OSError:
+            pass
+        finally:
+            connection.close()
+        time.sleep(0.5)
+    raise RuntimeError("Server did not answer within {0}s".format(timeout))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("--scenario",
+                        choices=("browse", "login", "storm"),
+                        default="browse")
+    parser.add_argument("--workers", type=int, default=1000)
+    parser.add_argument("--duration", type=float, default=60,
+                        help="seconds each server is loaded")
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--port", type=int, default=7100)
+    parser.add_argument("--waitress-threads", type=int)
+    parser.add_argument("--bad-password-rate", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--manifest", default=MANIFEST)
+    parser.add_argument("--output", help="file written instead of stdout")
+    args = parser.parse_args()
+
+    with open(args.manifest) as file:
+        manifest = json.load(file)
+    scenarios = {
+        "browse": lambda rng: Browse(manifest, rng),
+        "login": lambda rng: LoginStorm(manifest, rng,
+                                        args.bad_password_rate),
+        "storm": lambda rng: BrowseDuringLogins(
+            manifest, rng, args.bad_password_rate, 0.5),
+    }
+    url = "http://127.0.0.1:{0}".format(args.port)
+
+    results = {
+        "scenario": args.scenario,
+        "workers": args.workers,
+        "duration": args.duration,
+        "servers": {}
+    }
+    for mode in ("wsgi", "asgi"):
+        process = subprocess.Popen(server_command(mode, args.port,
+                                                  args.waitress_threads),
+                                   cwd=ROOT)
+        try:
+            wait_until_ready(args.port, process)
+            # the same requests against both servers
+            scenario = scenarios[args.scenario](random.Random(args.seed))
+            results["servers"][mode] = run(scenario, url, args.workers,
+                                           args.duration, args.timeout)
+        finally:
+            process.terminate()
+            process.wait()
+
+    servers = results["servers"]
+    results["comparison"] = {
+        "throughput": {
+            mode: result["throughput"]
+            for mode, result in servers.items()
+        },
+        "p99_ms": {
+            mode: result["latency_ms"]["p99"]
+            for mode, result in servers.items()
+        },
+        "errors": {
+            mode: sum(endpoint["errors"]
+                      for endpoint in result["endpoints"].values())
+            for mode, result in servers.items()
+        }
+    }
+
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output + "\n")
+    else:
+        sys.stdout.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,28 @@
+"""
+Latency summaries shared by the benchmarks.
+"""
+
+
+def percentile(samples, p):
+    """
+    Nearest-rank percentile of already sorted samples.
+    """
+    if not samples:
+        return None
+    return samples[min(len(samples) - 1, len(samples) * p // 100)]
+
+
+def summarize(samples, scale=1e3, digits=3):
+    """
+    Returns p50/p95/p99/max of seconds, scaled (milliseconds by default).
+    """
+    samples = sorted(samples)
+    summary = {
+        "p{0}".format(p): percentile(samples, p)
+        for p in (50, 95, 99)
+    }
+    summary["max"] = samples[-1] if samples else None
+    return {
+        key: round(value * scale, digits) if value is not None else None
+        for key, value in summary.items()
+    }
@@ -0,0 +1,148 @@
+"""
+Memory and lookup latency of the timetable of src/timetable.py against the
+same shows held as ORM objects.
+
+Generates ``--shows`` shows spread over ``--cities`` cities and the
+timetable's days, loads them into a ``Timetable`` and, separately, builds
+one transient ``Show`` instance per show, measuring the memory each keeps
+with tracemalloc. Lookups compare ``Timetable.schedule`` with filtering
+the ORM objects of the movie, as a cache of plain objects would. Needs the
+app's settings to import the models but not its database.
+
+    python -m benchmarks.timetable_memory --shows 1000000
+"""
+import argparse
+import gc
+import json
+import random
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from benchmarks.stats import summarize
+from src.models import Show
+from src.timetable import Timetable
+
+SHOW_TIMES = ["10:00", "13:15", "16:30", "19:45", "22:30"]
+
+
+def generate(args, start, days, rng):
+    """
+    Yields timetable rows sorted the way ``Show.timetable`` returns them.
+    """
+    cinemas_per_city = args.cinemas // args.cities
+    per_day = args.shows // (args.cities * days)
+    for city_id in range(1, args.cities + 1):
+        for offset in range(days):
+            show_date = datetime.combine(start + timedelta(days=offset),
+                                         datetime.min.time())
+            rows = []
+            for _ in range(per_day):
+                cinema_id = ((city_id - 1) * cinemas_per_city +
+                             rng.randrange(cinemas_per_city) + 1)
+                movie_id = rng.randrange(1, args.movies + 1)
+                rows.append(
+                    (city_id, show_date, movie_id,
+                     "Movie {0}".format(movie_id), cinema_id,
+                     "Cinema {0}".format(cinema_id), rng.choice(SHOW_TIMES),
+                     200))
+            rows.sort(key=lambda row: (row[2], row[5], row[6]))
+            yield from rows
+
+
+def measure(build):
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    built = build()
+    seconds = time.perf_counter() - started
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return built, size, seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--shows', type=int, default=1000000)
+    parser.add_argument('--cities', type=int, default=100)
+    parser.add_argument('--cinemas', type=int, default=5000)
+    parser.add_argument('--movies', type=int, default=2000)
+    parser.add_argument('--days', type=int, default=2)
+    parser.add_argument('--lookups', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    timetable = Timetable(args.days)
+    start, _ = timetable.window()
+
+    def load(from_date, to_date, city_id=None):
+        return generate(args, start, args.days, random.Random(args.seed))
+
+    _, timetable_bytes, timetable_seconds = measure(
+        lambda: timetable.refresh(load))
+    shows = timetable.stats()["shows"]
+
+    def orm_objects():
+        by_movie = {}
+        for (_, show_date, movie_id, _, cinema_id, _, show_time,
+             seats) in load(None, None):
+            by_movie.setdefault(movie_id, []).append(
+                Show(movie_id=movie_id,
+                     cinema_id=cinema_id,
+                     show_times=show_time,
+                     show_date=show_date,
+                     no_of_seats=seats))
+        return by_movie
+
+    by_movie, orm_bytes, orm_seconds = measure(orm_objects)
+
+    rng = random.Random(args.seed)
+    timetable_samples = []
+    movies_samples = []
+    orm_samples = []
+    for _ in range(args.lookups):
+        movie_id = rng.randrange(1, args.movies + 1)
+        show_date = start + timedelta(days=rng.randrange(args.days))
+        started = time.perf_counter()
+        timetable.movies(rng.randrange(1, args.cities + 1),
+                         show_date,
+                         limit=20)
+        movies_samples.append(time.perf_counter() - started)
+        started = time.perf_counter()
+        timetable.schedule(movie_id, show_date)
+        timetable_samples.append(time.perf_counter() - started)
+        started = time.perf_counter()
+        sorted((show.cinema_id, show.show_times, show.no_of_seats)
+               for show in by_movie.get(movie_id, ())
+               if show.show_date.date() == show_date)
+        orm_samples.append(time.perf_counter() - started)
+
+    print(
+        json.dumps(
+            {
+                "shows": shows,
+                "timetable": {
+                    "bytes_per_show": round(timetable_bytes / shows, 1),
+                    "array_bytes": timetable.stats()["bytes"],
+                    "load_seconds": round(timetable_seconds, 2),
+                    "movies_us": summarize(movies_samples,
+                                           scale=1e6,
+                                           digits=1),
+                    "schedule_us": summarize(timetable_samples,
+                                             scale=1e6,
+                                             digits=1)
+                },
+                "orm": {
+                    "bytes_per_show": round(orm_bytes / shows, 1),
+                    "build_seconds": round(orm_seconds, 2),
+                    "schedule_us": summarize(orm_samples,
+                                             scale=1e6,
+                                             digits=1)
+                }
+            },
+            indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""seat maps and seat holds
+
+Revision ID: 1cee6ec17316
+Revises: 57c41bf10398
+Create Date: 2026-10-18 09:12:40.118203
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = '1cee6ec17316'
+down_revision = '57c41bf10398'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('shows',
+                  sa.Column('seat_map', postgresql.BIT(varying=True)))
+    op.add_column('tickets',
+                  sa.Column('seats', postgresql.BIT(varying=True)))
+    # existing shows get a seat map sized to the hall, seats sold so far
+    # take its first seats
+    op.execute("UPDATE shows SET seat_map = repeat('0', no_of_seats)::varbit")
+    op.execute("""
+        UPDATE shows
+        SET seat_map = (repeat('1', sold.no_of_seats) ||
+                        repeat('0', shows.no_of_seats))::varbit
+        FROM (
+            SELECT movie, cinema, show_time, ticket_date,
+                   sum(no_of_seats)::integer AS no_of_seats
+            FROM tickets
+            GROUP BY movie, cinema, show_time, ticket_date
+        ) AS sold
+        WHERE shows.movie_id = sold.movie AND shows.cinema_id = sold.cinema
+          AND shows.show_times = sold.show_time
+          AND shows.show_date = sold.ticket_date
+    """)
+    # bookings by seat count take the first free seats of the map, so the
+    # free seats of a map always add up to the show's seat count
+    op.execute("""
+        CREATE FUNCTION claim_free_seats(seat_map varbit, wanted integer)
+        RETURNS varbit AS $$
+            SELECT coalesce(string_agg(
+                CASE WHEN seat = '0' AND free <= wanted THEN '1'
+                     ELSE seat END, '' ORDER BY position)::varbit, seat_map)
+            FROM (
+                SELECT position, seat,
+                       count(*) FILTER (WHERE seat = '0')
+                           OVER (ORDER BY position) AS free
+                FROM unnest(string_to_array(seat_map::text, NULL))
+                     WITH ORDINALITY AS seats (seat, position)
+            ) AS seats
+        $$ LANGUAGE sql IMMUTABLE STRICT
+    """)
+    op.create_table(
+        'seat_holds', sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('movie_id', sa.Integer(), nullable=False),
+        sa.Column('cinema_id', sa.Integer(), nullable=False),
+        sa.Column('show_times', sa.String(length=8), nullable=False),
+        sa.Column('show_date', sa.Date(), nullable=False),
+        sa.Column('user', sa.Integer(), nullable=False),
+        sa.Column('seats', postgresql.BIT(varying=True), nullable=False),
+        sa.Column('no_of_seats', sa.Integer(), nullable=False),
+        sa.Column('expires_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ['user'],
+            ['users.id'],
+        ), sa.PrimaryKeyConstraint('id'))
+    op.create_index('ix_seat_holds_expires_at', 'seat_holds', ['expires_at'])
+
+
+def downgrade():
+    op.drop_index('ix_seat_holds_expires_at', table_name='seat_holds')
+    op.drop_table('seat_holds')
+    op.drop_column('tickets', 'seats')
+    op.execute('DROP FUNCTION claim_free_seats(varbit, integer)')
+    op.drop_column('shows', 'seat_map')
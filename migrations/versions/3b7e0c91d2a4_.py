@@ -0,0 +1,44 @@
+"""notify seat availability changes
+
+Revision ID: 3b7e0c91d2a4
+Revises: 66b057a94c30
+Create Date: 2026-10-18 12:10:41.208337
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '3b7e0c91d2a4'
+down_revision = '66b057a94c30'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # every change of a show's seat count, whichever statement made it, is
+    # announced on commit to the listeners of src/events.py
+    op.execute("""
+        CREATE FUNCTION notify_seat_availability() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_notify('seat_availability', json_build_object(
+                'movie_id', NEW.movie_id,
+                'cinema_id', NEW.cinema_id,
+                'show_time', NEW.show_times,
+                'show_date', to_char(NEW.show_date, 'DD-MM-YYYY'),
+                'available_seats', NEW.no_of_seats)::text);
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+    """)
+    op.execute("""
+        CREATE TRIGGER shows_notify_seat_availability
+        AFTER UPDATE OF no_of_seats ON shows
+        FOR EACH ROW
+        WHEN (OLD.no_of_seats IS DISTINCT FROM NEW.no_of_seats)
+        EXECUTE PROCEDURE notify_seat_availability()
+    """)
+
+
+def downgrade():
+    op.execute('DROP TRIGGER shows_notify_seat_availability ON shows')
+    op.execute('DROP FUNCTION notify_seat_availability()')
@@ -0,0 +1,31 @@
+"""ticket history index
+
+Revision ID: 66b057a94c30
+Revises: 68b0409e5f2f
+Create Date: 2026-10-18 11:05:22.871460
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '66b057a94c30'
+down_revision = '68b0409e5f2f'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # booking history pages through a user's tickets newest first, the
+    # composite index also serves every plain lookup by user
+    op.drop_index('ix_tickets_user', table_name='tickets')
+    op.create_index('ix_tickets_user_transaction_date', 'tickets', [
+        'user',
+        sa.text('transaction_date DESC'),
+        sa.text('id DESC')
+    ])
+
+
+def downgrade():
+    op.drop_index('ix_tickets_user_transaction_date', table_name='tickets')
+    op.create_index('ix_tickets_user', 'tickets', ['user'])
@@ -0,0 +1,37 @@
+"""movie runs
+
+Revision ID: 68b0409e5f2f
+Revises: 4df83fa1f2a1
+Create Date: 2026-10-18 10:41:57.204316
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '68b0409e5f2f'
+down_revision = '4df83fa1f2a1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'movie_runs', sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('movie_id', sa.Integer(), nullable=False),
+        sa.Column('cinema_id', sa.Integer(), nullable=False),
+        sa.Column('start_date', sa.Date(), nullable=False),
+        sa.Column('end_date', sa.Date(), nullable=True),
+        sa.Column('no_of_seats', sa.Integer(), nullable=False),
+        sa.Column('materialized_until', sa.Date(), nullable=True),
+        sa.ForeignKeyConstraint(
+            ['cinema_id'],
+            ['cinemas.id'],
+        ), sa.ForeignKeyConstraint(
+            ['movie_id'],
+            ['movies.id'],
+        ), sa.PrimaryKeyConstraint('id'))
+
+
+def downgrade():
+    op.drop_table('movie_runs')
@@ -0,0 +1,48 @@
+"""notify catalog changes
+
+Revision ID: 7a3d5e9c1f60
+Revises: f71c3a8e2d54
+Create Date: 2026-10-18 23:05:44.120318
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '7a3d5e9c1f60'
+down_revision = 'f71c3a8e2d54'
+branch_labels = None
+depends_on = None
+
+# tables whose writes change cached catalog responses; shows only for
+# TRUNCATE, its other writes send schedule or seat notifications
+CATALOG_TABLES = {
+    'cities': 'INSERT OR UPDATE OR DELETE OR TRUNCATE',
+    'cinemas': 'INSERT OR UPDATE OR DELETE OR TRUNCATE',
+    'movies': 'INSERT OR UPDATE OR DELETE OR TRUNCATE',
+    'shows': 'TRUNCATE',
+}
+
+
+def upgrade():
+    # one notification per statement, however many rows it wrote
+    op.execute("""
+        CREATE FUNCTION notify_catalog_change() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_notify('seat_availability', json_build_object(
+                'op', 'CATALOG', 'table', TG_TABLE_NAME)::text);
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+    """)
+    for table, events in CATALOG_TABLES.items():
+        op.execute("""
+            CREATE TRIGGER {0}_notify_catalog
+            AFTER {1} ON {0}
+            FOR EACH STATEMENT EXECUTE PROCEDURE notify_catalog_change()
+        """.format(table, events))
+
+
+def downgrade():
+    for table in CATALOG_TABLES:
+        op.execute('DROP TRIGGER {0}_notify_catalog ON {0}'.format(table))
+    op.execute('DROP FUNCTION notify_catalog_change()')
@@ -0,0 +1,40 @@
+"""idempotency keys
+
+Revision ID: 9c2f4e6a1b8d
+Revises: 3b7e0c91d2a4
+Create Date: 2026-10-18 12:48:09.663170
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = '9c2f4e6a1b8d'
+down_revision = '3b7e0c91d2a4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'idempotency_keys', sa.Column('user', sa.Integer(), nullable=False),
+        sa.Column('key', sa.String(length=64), nullable=False),
+        sa.Column('request_hash', sa.String(length=64), nullable=False),
+        sa.Column('status_code', sa.SmallInteger(), nullable=True),
+        sa.Column('response',
+                  postgresql.JSONB(astext_type=sa.Text()),
+                  nullable=True),
+        sa.Column('expires_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ['user'],
+            ['users.id'],
+        ), sa.PrimaryKeyConstraint('user', 'key'))
+    op.create_index('ix_idempotency_keys_expires_at', 'idempotency_keys',
+                    ['expires_at'])
+
+
+def downgrade():
+    op.drop_index('ix_idempotency_keys_expires_at',
+                  table_name='idempotency_keys')
+    op.drop_table('idempotency_keys')
@@ -0,0 +1,29 @@
+"""trigram name search
+
+Revision ID: b5d81f3c7e20
+Revises: 9c2f4e6a1b8d
+Create Date: 2026-10-18 13:21:37.415592
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'b5d81f3c7e20'
+down_revision = '9c2f4e6a1b8d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # trigram GIN indexes answer both ILIKE '%term%' and the fuzzy
+    # similarity operator used by /search/
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.execute('CREATE INDEX ix_movies_name_trgm '
+               'ON movies USING gin (name gin_trgm_ops)')
+    op.execute('CREATE INDEX ix_cinemas_name_trgm '
+               'ON cinemas USING gin (name gin_trgm_ops)')
+
+
+def downgrade():
+    op.drop_index('ix_cinemas_name_trgm', table_name='cinemas')
+    op.drop_index('ix_movies_name_trgm', table_name='movies')
@@ -0,0 +1,32 @@
+"""cinema locations
+
+Revision ID: e4a96d2b5f17
+Revises: b5d81f3c7e20
+Create Date: 2026-10-18 13:58:14.092368
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'e4a96d2b5f17'
+down_revision = 'b5d81f3c7e20'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('cinemas', sa.Column('latitude', sa.Float(),
+                                       nullable=True))
+    op.add_column('cinemas', sa.Column('longitude', sa.Float(),
+                                       nullable=True))
+    # nearby queries prefilter on a latitude range first, the longitude
+    # range is then checked within the index
+    op.create_index('ix_cinemas_location', 'cinemas',
+                    ['latitude', 'longitude'])
+
+
+def downgrade():
+    op.drop_index('ix_cinemas_location', table_name='cinemas')
+    op.drop_column('cinemas', 'longitude')
+    op.drop_column('cinemas', 'latitude')
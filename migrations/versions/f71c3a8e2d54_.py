@@ -0,0 +1,96 @@
+"""notify show schedule changes
+
+Revision ID: f71c3a8e2d54
+Revises: e4a96d2b5f17
+Create Date: 2026-10-18 19:42:07.518264
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'f71c3a8e2d54'
+down_revision = 'e4a96d2b5f17'
+branch_labels = None
+depends_on = None
+
+# (city, date) of the shows a statement inserted, deleted or moved to
+# another movie, cinema, time or date; a seat count update changes none
+CHANGED_DAYS = {
+    'INSERT': "SELECT cinema_id, show_date FROM new_shows",
+    'DELETE': "SELECT cinema_id, show_date FROM old_shows",
+    'UPDATE': """
+        SELECT cinema_id, show_date FROM (
+            (SELECT movie_id, cinema_id, show_times, show_date
+             FROM new_shows
+             EXCEPT
+             SELECT movie_id, cinema_id, show_times, show_date
+             FROM old_shows)
+            UNION ALL
+            (SELECT movie_id, cinema_id, show_times, show_date
+             FROM old_shows
+             EXCEPT
+             SELECT movie_id, cinema_id, show_times, show_date
+             FROM new_shows)
+        ) AS moved
+    """
+}
+
+NOTIFY_CHANGED_DAYS = """
+    PERFORM pg_notify('seat_availability', json_build_object(
+        'op', 'SCHEDULE',
+        'city_id', changed.city,
+        'show_date', to_char(changed.show_date, 'DD-MM-YYYY'))::text)
+    FROM (
+        SELECT DISTINCT cinemas.city, shows.show_date::date AS show_date
+        FROM ({0}) AS shows JOIN cinemas ON cinemas.id = shows.cinema_id
+    ) AS changed;
+"""
+
+
+def upgrade():
+    # one notification per city and date a statement changed, so a bulk
+    # import or show materialization of millions of rows sends a few
+    # thousand at most
+    op.execute("""
+        CREATE FUNCTION notify_show_schedule() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                {INSERT}
+            ELSIF TG_OP = 'DELETE' THEN
+                {DELETE}
+            ELSE
+                {UPDATE}
+            END IF;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+    """.format(**{
+        operation: NOTIFY_CHANGED_DAYS.format(query)
+        for operation, query in CHANGED_DAYS.items()
+    }))
+    # transition tables allow a single event per trigger
+    op.execute("""
+        CREATE TRIGGER shows_notify_schedule_insert
+        AFTER INSERT ON shows
+        REFERENCING NEW TABLE AS new_shows
+        FOR EACH STATEMENT EXECUTE PROCEDURE notify_show_schedule()
+    """)
+    op.execute("""
+        CREATE TRIGGER shows_notify_schedule_delete
+        AFTER DELETE ON shows
+        REFERENCING OLD TABLE AS old_shows
+        FOR EACH STATEMENT EXECUTE PROCEDURE notify_show_schedule()
+    """)
+    op.execute("""
+        CREATE TRIGGER shows_notify_schedule_update
+        AFTER UPDATE ON shows
+        REFERENCING OLD TABLE AS old_shows NEW TABLE AS new_shows
+        FOR EACH STATEMENT EXECUTE PROCEDURE notify_show_schedule()
+    """)
+
+
+def downgrade():
+    op.execute('DROP TRIGGER shows_notify_schedule_update ON shows')
+    op.execute('DROP TRIGGER shows_notify_schedule_delete ON shows')
+    op.execute('DROP TRIGGER shows_notify_schedule_insert ON shows')
+    op.execute('DROP FUNCTION notify_show_schedule()')
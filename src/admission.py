@@ -0,0 +1,147 @@
+"""
+Per-show admission queue for ticket bookings.
+
+Bookings of the same show wait in one in-process queue. The request at the
+head of the queue becomes the leader: it books up to ``batch_size`` queued
+requests in one transaction which locks the show row once, hands every
+waiter its result and passes leadership to the next request in line. So a
+rush on one show costs one row lock per batch instead of one per booking,
+and other processes' batches simply queue on the row lock.
+
+A full queue is refused straight away with the queue depth and an
+estimated wait, computed from the recent batch durations.
+"""
+import threading
+import time
+from collections import deque
+
+BOOKED = "booked"
+SOLD_OUT = "sold_out"
+NO_SHOW = "no_show"
+
+
+class QueueFull(Exception):
+    """
+    Raised when a show's queue is at its maximum depth.
+    """
+    def __init__(self, depth, estimated_wait):
+        super().__init__(depth, estimated_wait)
+        self.depth = depth
+        self.estimated_wait = estimated_wait
+
+
+class QueueTimeout(Exception):
+    """
+    Raised when a booking was not admitted in time.
+    """
+
+
+class Booking:
+    """
+    A queued booking. ``result`` is a (status, transaction id) pair once the
+    booking went through a batch.
+    """
+    def __init__(self, user, no_of_seats):
+        self.user = user
+        self.no_of_seats = no_of_seats
+        self.position = None
+        self.result = None
+        self.lead = False
+        self.done = threading.Event()
+
+
+class AdmissionQueue:
+    """
+    Serializes bookings per show key through leader run batches.
+    """
+    def __init__(self, batch_size=50, max_depth=500, timeout=10):
+        self.batch_size = batch_size
+        self.max_depth = max_depth
+        self.timeout = timeout
+        self.batches = 0
+        self.admitted = 0
+        self.rejected = 0
+        # moving average of the seconds a batch takes
+        self.batch_seconds = 0.0
+        self._queues = {}
+        self._lock = threading.Lock()
+
+    def estimated_wait(self, position):
+        return -(-position // self.batch_size) * self.batch_seconds
+
+    def submit(self, key, booking, run_batch):
+        """
+        Queues the booking and returns its result once its batch ran.
+        ``run_batch(key, bookings)`` books a batch in one transaction and
+        returns one result per booking.
+        """
+        with self._lock:
+            queue = self._queues.get(key)
+            if queue is None:
+                queue = self._queues[key] = deque()
+                booking.lead = True
+            elif len(queue) >= self.max_depth:
+                self.rejected += 1
+                raise QueueFull(len(queue),
+                                self.estimated_wait(len(queue) + 1))
+            queue.append(booking)
+            booking.position = len(queue)
+        if not booking.lead:
+            self._wait(key, booking)
+        if booking.lead:
+            self._lead(key, run_batch)
+        if isinstance(booking.result, Exception):
+            raise booking.result
+        return booking.result
+
+    def _wait(self, key, booking):
+        if booking.done.wait(self.timeout):
+            return
+        with self._lock:
+            # the leader may have taken the booking and dropped the queue
+            queue = self._queues.get(key, ())
+            if not booking.lead and booking in queue:
+                queue.remove(booking)
+                raise QueueTimeout()
+        # already part of a running batch or just made leader
+        if not booking.lead:
+            booking.done.wait()
+
+    def _lead(self, key, run_batch):
+        with self._lock:
+            queue = self._queues[key]
+            batch = [
+                queue.popleft()
+                for _ in range(min(self.batch_size, len(queue)))
+            ]
+        started = time.monotonic()
+        try:
+            results = run_batch(key, batch)
+        except Exception as err:
+            results = [err] * len(batch)
+        finally:
+            elapsed = time.monotonic() - started
+            with self._lock:
+                self.batches += 1
+                self.admitted += len(batch)
+                self.batch_seconds = (elapsed if self.batches == 1 else
+                                      0.8 * self.batch_seconds +
+                                      0.2 * elapsed)
+                if queue:
+                    queue[0].lead = True
+                    queue[0].done.set()
+                else:
+                    del self._queues[key]
+        for booking, result in zip(batch, results):
+            booking.result = result
+            booking.done.set()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "shows": len(self._queues),
+                "queued": sum(len(queue) for queue in self._queues.values()),
+                "batches": self.batches,
+                "admitted": self.admitted,
+                "rejected": self.rejected
+            }
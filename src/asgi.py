@@ -0,0 +1,361 @@
+"""
+Asyncio (ASGI) entry point for the API.
+
+The catalog endpoints and ticket booking are served natively on asyncpg
+connection pools, so a request waiting on the database does not pin a
+thread. They run the same SQLAlchemy statements as the Flask resources,
+compiled for asyncpg, and reuse the validators, serializers and response
+cache. The seat availability stream is native too, so an idle client
+costs a coroutine rather than a thread. Every other route of src/urls.py
+is served by the Flask app through Starlette's WSGI adapter.
+
+Selected at deploy time with ``SERVER_MODE=asgi`` (see the Procfile).
+"""
+import asyncio
+import re
+import time
+import uuid
+from datetime import datetime
+
+import asyncpg
+from flask_jwt_extended import decode_token
+from marshmallow import ValidationError
+from sqlalchemy.dialects import postgresql
+from starlette.applications import Starlette
+from starlette.middleware.wsgi import WSGIMiddleware
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Mount, Route, request_response
+
+from src import app as flask_app
+from src import validators
+from src.cache import MISSING, show_tag
+from src.events import (HEARTBEAT, AsyncSubscription, TooManySubscribers,
+                        format_event)
+from src.main import cache, logger, encode_json, seat_events, timetable
+from src.models import City, Movie, Show, Ticket
+from src.schemas import serialize_cities, serialize_movies, serialize_shows
+from src.timetable import covers_show_query
+
+SECURITY_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Headers': 'Authorization, Content-Type',
+    'Access-Control-Allow-Methods': 'OPTIONS, GET, PUT, POST',
+    'X-XSS-Protection': '1',
+    'mode': 'block',
+    'X-Frame-Options': 'SAMEORIGIN',
+    'X-Content-Type-Options': 'nosniff'
+}
+
+# numeric placeholders (:1, :2) are rewritten to asyncpg's $1, $2
+_dialect = postgresql.dialect(paramstyle='numeric')
+_placeholder = re.compile(r'(?<![:\w]):(\d+)')
+
+pools = {}
+
+
+def compile_query(statement):
+    """
+    Compiles a SQLAlchemy statement or ORM query into asyncpg SQL and its
+    positional arguments.
+    """
+    statement = getattr(statement, 'statement', statement)
+    compiled = statement.compile(dialect=_dialect)
+    sql = _placeholder.sub(r'$\1', compiled.string)
+    return sql, [compiled.params[name] for name in compiled.positiontup]
+
+
+def json_response(data, status=200, headers=None):
+    response_headers = dict(SECURITY_HEADERS)
+    response_headers.update(headers or {})
+    return Response(encode_json(data),
+                    status_code=status,
+                    headers=response_headers,
+                    media_type='application/json')
+
+
+def invalid_request(err):
+    return json_response(
+        {"data": {
+            "error_message": "Invalid request",
+            "errors": err.messages
+        }}, 400)
+
+
+def read_pool(request):
+    """
+    Returns the replica pool unless the client wrote recently, see
+    ``read_replica`` in src/main.py.
+    """
+    primary_until = request.cookies.get('primary_until', '0')
+    if primary_until.isdigit() and int(primary_until) > time.time():
+        return pools['primary']
+    return pools.get('replica', pools['primary'])
+
+
+async def fetch(pool, query):
+    sql, args = compile_query(query)
+    async with pool.acquire() as connection:
+        return await connection.fetch(sql, *args)
+
+
+async def cached(request, tags, handler):
+    """
+    Serves a catalog endpoint through the shared response cache, answering
+    a matching If-None-Match with a 304.
+    """
+    etag, last_modified = cache.validators(tags)
+    headers = {
+        'ETag': '"{0}"'.format(etag),
+        'Last-Modified':
+        last_modified.strftime('%a, %d %b %Y %H:%M:%S GMT'),
+        'Cache-Control': 'public, max-age={0}'.format(
+            flask_app.config['CACHE_CONTROL_MAX_AGE'])
+    }
+    if headers['ETag'] in request.headers.get('if-none-match', ''):
+        return Response(status_code=304, headers=headers)
+    key = ('asgi:' + request.url.path,
+           tuple(sorted(request.query_params.multi_items())))
+    data = cache.get(key)
+    if data is MISSING:
+        try:
+            data = await handler()
+        except ValidationError as err:
+            return invalid_request(err)
+        cache.set(key, data, tags)
+    return json_response(data, headers=headers)
+
+
+async def cities(request):
+    async def handler():
+        rows = await fetch(
+            read_pool(request),
+            City.query.with_entities(City.id,
+                                     City.city_name).order_by(City.id))
+        return {"data": serialize_cities(rows)}
+
+    return await cached(request, ('cities', ), handler)
+
+
+async def movies(request):
+    async def handler():
+        data = validators.movie_query.load(dict(request.query_params))
+        rows = None
+        if data['show_date']:
+            rows = timetable.movies(data['city_id'],
+                                    data['show_date'],
+                                    after=data['after'],
+                                    limit=data['limit'])
+        if rows is None:
+            rows = await fetch(
+                read_pool(request),
+                Movie.playing_in_city(data['city_id'],
+                                      show_date=data['show_date'],
+                                      after=data['after'],
+                                      limit=data['limit']))
+        next_cursor = None
+        if data['limit'] and len(rows) == data['limit']:
+            next_cursor = rows[-1][0]
+        return {"data": serialize_movies(rows), "next": next_cursor}
+
+    return await cached(request, ('cities', 'cinemas', 'movies', 'shows'),
+                        handler)
+
+
+async def shows(request):
+    async def handler():
+        data = validators.show_query.load(dict(request.query_params))
+        rows = None
+        if covers_show_query(data):
+            rows = timetable.schedule(data['movie_id'],
+                                      data['show_date'],
+                                      cinema_id=data['cinema_id'],
+                                      show_time=data['show_time'])
+        if rows is None:
+            rows = await fetch(read_pool(request), Show.schedule(**data))
+        return {"data": serialize_shows(rows)}
+
+    return await cached(
+        request,
+        ('cinemas', 'shows', show_tag(request.query_params.get('movie_id'))),
+        handler)
+
+
+async def seat_stream(request):
+    try:
+        data = validators.seat_stream_query.load(dict(request.query_params))
+    except ValidationError as err:
+        return invalid_request(err)
+    try:
+        subscription = seat_events.subscribe(
+            AsyncSubscription(asyncio.get_event_loop(), **data))
+    except TooManySubscribers:
+        return json_response(
+            {"data": {
+                "error_message": "Server is busy. Try again later."
+            }}, 503, {'Retry-After': '1'})
+    heartbeat = flask_app.config['SEAT_STREAM_HEARTBEAT']
+
+    async def stream():
+        try:
+            while True:
+                events = await subscription.wait(heartbeat)
+                yield "".join(map(format_event, events)) or HEARTBEAT
+        finally:
+            seat_events.unsubscribe(subscription)
+
+    headers = dict(SECURITY_HEADERS)
+    headers.update({'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    return StreamingResponse(stream(),
+                             media_type='text/event-stream',
+                             headers=headers)
+
+
+def authenticate(request):
+    """
+    Returns the identity of a valid refresh token in the Authorization
+    header, or None.
+    """
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    if scheme != flask_app.config['JWT_HEADER_TYPE'] or not token:
+        return None
+    try:
+        with flask_app.app_context():
+            decoded = decode_token(token)
+    except Exception:
+        return None
+    if decoded.get('type') != 'refresh':
+        return None
+    return decoded.get(flask_app.config['JWT_IDENTITY_CLAIM'])
+
+
+async def tickets(request):
+    identity = authenticate(request)
+    if not identity:
+        return json_response({"msg": "Missing or invalid refresh token"},
+                             401)
+    try:
+        body = await request.json()
+    except ValueError:
+        body = {}
+    try:
+        data = validators.ticket.load(body if isinstance(body, dict) else {})
+    except ValidationError as err:
+        return invalid_request(err)
+
+    reserve_sql, reserve_args = compile_query(
+        Show.reserve_seats_statement(data["movie"], data["cinema"],
+                                     data["show_time"], data["ticket_date"],
+                                     data["no_of_seats"]))
+    insert_sql, insert_args = compile_query(Ticket.__table__.insert().values(
+        transaction_id=str(uuid.uuid1()),
+        movie=data["movie"],
+        cinema=data["cinema"],
+        show_time=data["show_time"],
+        no_of_seats=data["no_of_seats"],
+        ticket_date=data["ticket_date"],
+        transaction_date=datetime.utcnow().date(),
+        user=identity["id"]))
+    try:
+        async with pools['primary'].acquire() as connection:
+            async with connection.transaction():
+                remaining = await connection.fetchval(reserve_sql,
+                                                      *reserve_args)
+                if remaining is not None:
+                    await connection.execute(insert_sql, *insert_args)
+            if remaining is None:
+                exists_sql, exists_args = compile_query(
+                    Show.query.filter_by(
+                        movie_id=data["movie"],
+                        cinema_id=data["cinema"],
+                        show_times=data["show_time"],
+                        show_date=data["ticket_date"]).exists().select())
+                if not await connection.fetchval(exists_sql, *exists_args):
+                    return json_response(
+                        {
+                            "data": {
+                                "error_message":
+                                "No show available for selected "
+                                "Movie/Cinema/Date"
+                            }
+                        }, 404)
+                return json_response(
+                    {
+                        "data": {
+                            "error_message":
+                            "No tickets are available for selected data"
+                        }
+                    }, 404)
+    except Exception:
+        logger.exception("Error while booking tickets")
+        return json_response(
+            {
+                "data": {
+                    "error_message":
+                    "Unexpected error occurred. Try again later."
+                }
+            }, 500)
+    cache.invalidate(show_tag(data["movie"]))
+    window = flask_app.config['READ_YOUR_WRITES_WINDOW']
+    response = json_response(
+        {"data": {
+            "success_message": "Ticket booked successfully"
+        }})
+    response.set_cookie('primary_until',
+                        str(int(time.time()) + window),
+                        max_age=window)
+    return response
+
+
+class TicketsRoute:
+    """
+    Books natively, except requests with an Idempotency-Key which go to
+    the Flask resource that records their outcome.
+    """
+    def __init__(self, native, fallback):
+        self.native = request_response(native)
+        self.fallback = fallback
+
+    async def __call__(self, scope, receive, send):
+        if any(name == b'idempotency-key' for name, _ in scope['headers']):
+            await self.fallback(scope, receive, send)
+        else:
+            await self.native(scope, receive, send)
+
+
+async def startup():
+    options = flask_app.config['SQLALCHEMY_ENGINE_OPTIONS']
+    pool_options = {
+        "min_size": 1,
+        "max_size": options['pool_size'] + options['max_overflow'],
+        "max_inactive_connection_lifetime": options['pool_recycle'],
+        "server_settings": {
+            "statement_timeout":
+            str(flask_app.config['DB_STATEMENT_TIMEOUT'])
+        }
+    }
+    pools['primary'] = await asyncpg.create_pool(
+        flask_app.config['SQLALCHEMY_DATABASE_URI'], **pool_options)
+    replica_url = flask_app.config['SQLALCHEMY_BINDS'].get('replica')
+    if replica_url:
+        pools['replica'] = await asyncpg.create_pool(replica_url,
+                                                     **pool_options)
+
+
+async def shutdown():
+    for pool in pools.values():
+        await pool.close()
+    pools.clear()
+
+
+flask_wsgi = WSGIMiddleware(flask_app)
+
+app = Starlette(routes=[
+    Route('/cities/', cities, methods=['GET']),
+    Route('/movies/', movies, methods=['GET']),
+    Route('/shows/', shows, methods=['GET']),
+    Route('/shows/stream/', seat_stream, methods=['GET']),
+    Route('/tickets/', TicketsRoute(tickets, flask_wsgi), methods=['POST']),
+    Mount('/', app=flask_wsgi),
+],
+                on_startup=[startup],
+                on_shutdown=[shutdown])
@@ -0,0 +1,236 @@
+"""
+In-process read-through cache for the catalog endpoints.
+
+Entries are keyed by endpoint plus the normalized query arguments, bounded
+by an LRU size limit and expire after a per-entry TTL. Every entry carries
+tags (e.g. ``shows`` or ``shows:<movie_id>``) so writes can evict exactly
+the entries they affect.
+
+Each tag also has a version counter bumped on invalidation. The counters
+make up the ETag of a cached endpoint, so conditional GETs can be answered
+with a 304 before the resource runs.
+"""
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from functools import wraps
+
+from flask import request, g, Response
+
+MISSING = object()
+
+
+class LRUCache:
+    """
+    Thread safe LRU cache with per-entry TTL and tag based invalidation.
+    A ``max_entries`` of 0 disables caching.
+    """
+    def __init__(self, max_entries=10000, ttl=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._tags = {}
+        self._versions = {}
+        self._lock = threading.Lock()
+        # ETags of a restarted process must not match the old ones
+        self._boot_id = uuid.uuid4().hex[:8]
+        self._boot_time = datetime.utcnow().replace(microsecond=0)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return MISSING
+            expires_at, value, _ = entry
+            if expires_at <= time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return MISSING
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, tags=(), ttl=None):
+        if not self.max_entries:
+            return
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (expires_at, value, tags)
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, *tags):
+        """
+        Evicts every entry carrying any of the given tags.
+        """
+        now = datetime.utcnow().replace(microsecond=0)
+        with self._lock:
+            for tag in tags:
+                version, _ = self._versions.get(tag, (0, None))
+                self._versions[tag] = (version + 1, now)
+                for key in self._tags.pop(tag, ()):
+                    if key in self._entries:
+                        self._remove(key)
+                        self.invalidations += 1
+
+    def validators(self, tags):
+        """
+        Returns the (etag, last modified) pair for content depending on the
+        given tags. The etag also rolls over every TTL so writes made by
+        other processes are picked up within the same bound as the cache.
+        """
+        with self._lock:
+            versions = [self._versions.get(tag, (0, None)) for tag in tags]
+        epoch = int(time.time() // self.ttl) if self.ttl else 0
+        etag = "{0}-{1}-{2}".format(
+            self._boot_id, epoch,
+            ".".join(str(version) for version, _ in versions))
+        last_modified = max([self._boot_time] + [
+            modified for _, modified in versions if modified is not None
+        ])
+        return etag, last_modified
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations
+            }
+
+    def _remove(self, key):
+        _, _, tags = self._entries.pop(key)
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def cached(self, *tags):
+        """
+        Decorator for resource ``get`` methods. Successful responses are
+        cached under the endpoint and sorted query arguments. Tags are
+        formatted with the query arguments, so ``shows:{movie_id}`` becomes
+        ``shows:12`` for ``?movie_id=12``.
+
+        The ETag and Last-Modified validators are stored on ``g`` for the
+        ``after_request`` hook, and a matching ``If-None-Match`` is answered
+        with a 304 without running the resource.
+        """
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                try:
+                    entry_tags = tuple(
+                        tag.format(**request.args.to_dict()) for tag in tags)
+                except KeyError:
+                    entry_tags = tags
+                g.etag, g.last_modified = self.validators(entry_tags)
+                if g.etag in request.if_none_match:
+                    return Response(status=304)
+                if not self.max_entries:
+                    return func(*args, **kwargs)
+                key = (request.endpoint,
+                       tuple(sorted(request.args.items(multi=True))))
+                response = self.get(key)
+                if response is not MISSING:
+                    return response
+                response = func(*args, **kwargs)
+                if isinstance(response, tuple) and response[1] == 200:
+                    self.set(key, response, entry_tags)
+                return response
+
+            return wrapper
+
+        return decorator
+
+
+class CityIndexes:
+    """
+    In-memory indexes per city built by ``factory`` from rows of the
+    database. Each index remembers the validators of ``tags`` it was built
+    with and is rebuilt on its own by the first lookup after those tags
+    were invalidated or the cache TTL rolled over. Meanwhile concurrent
+    lookups keep using the old index, so only one request per city pays
+    for a rebuild.
+    """
+    def __init__(self, cache, factory, tags):
+        self.cache = cache
+        self.factory = factory
+        self.tags = tags
+        self.rebuilds = 0
+        self._indexes = {}
+        self._building = set()
+        self._lock = threading.Lock()
+
+    def get(self, city_id, load, wait=True):
+        """
+        Returns the city's index. ``load(city_id)`` returns the rows the
+        index is built from when it has to be (re)built. Without ``wait``,
+        returns None instead of building the city's first index again
+        while another request builds it.
+        """
+        etag, _ = self.cache.validators(self.tags)
+        built = self._indexes.get(city_id)
+        if built is None or built[0] != etag:
+            built = self._rebuild(city_id, etag, built, load, wait)
+        return built[1] if built else None
+
+    def _rebuild(self, city_id, etag, stale, load, wait):
+        with self._lock:
+            if city_id in self._building:
+                if stale is not None:
+                    return stale
+                if not wait:
+                    return None
+            self._building.add(city_id)
+        try:
+            built = (etag, self.factory(load(city_id)))
+            with self._lock:
+                self._indexes[city_id] = built
+                self.rebuilds += 1
+            return built
+        finally:
+            with self._lock:
+                self._building.discard(city_id)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "cities": len(self._indexes),
+                "entries": sum(
+                    len(index) for _, index in self._indexes.values()),
+                "rebuilds": self.rebuilds
+            }
+
+
+def show_tag(movie_id):
+    """
+    Tag of the cached show listings for a movie, evicted when its seat
+    counts change.
+    """
+    return f"shows:{movie_id}"
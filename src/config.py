@@ -8,6 +8,83 @@ SQLALCHEMY_DATABASE_URI = "postgresql://{0}:{1}@{2}:{4}/{3}".format(
 if os.environ.get('DATABASE_URL'):
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL')
 SQLALCHEMY_TRACK_MODIFICATIONS = False
+# milliseconds, applies to every statement on a connection
+DB_STATEMENT_TIMEOUT = int(os.environ.get('DB_STATEMENT_TIMEOUT', 5000))
+SQLALCHEMY_ENGINE_OPTIONS = {
+    'pool_size': int(os.environ.get('DB_POOL_SIZE', 10)),
+    'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 20)),
+    'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT', 10)),
+    'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+    'pool_pre_ping': os.environ.get('DB_POOL_PRE_PING', 'true') == 'true',
+    'connect_args': {
+        'options': '-c statement_timeout={0}'.format(DB_STATEMENT_TIMEOUT)
+    }
+}
+# read only replica used by the catalog endpoints when configured
+SQLALCHEMY_BINDS = {}
+if os.environ.get('DATABASE_REPLICA_URL'):
+    SQLALCHEMY_BINDS['replica'] = os.environ.get('DATABASE_REPLICA_URL')
+# seconds a client reads from the primary after one of its writes
+READ_YOUR_WRITES_WINDOW = int(os.environ.get('READ_YOUR_WRITES_WINDOW', 10))
 SECRET_KEY = os.environ.get('SECRET_KEY')
 JWT_SECRET_KEY = os.environ.get('JWT_SECRET_KEY')
 PROPAGATE_EXCEPTIONS = True
+# seconds a seat hold lasts before the sweeper gives the seats back
+SEAT_HOLD_TTL = int(os.environ.get('SEAT_HOLD_TTL', 600))
+SEAT_HOLD_SWEEP_INTERVAL = int(os.environ.get('SEAT_HOLD_SWEEP_INTERVAL', 30))
+SEAT_HOLD_SWEEP_BATCH = int(os.environ.get('SEAT_HOLD_SWEEP_BATCH', 1000))
+# catalog response cache, CACHE_MAX_ENTRIES=0 disables it
+CACHE_MAX_ENTRIES = int(os.environ.get('CACHE_MAX_ENTRIES', 10000))
+CACHE_TTL = int(os.environ.get('CACHE_TTL', 300))
+# max-age sent with catalog responses, clients revalidate with the ETag
+CACHE_CONTROL_MAX_AGE = int(os.environ.get('CACHE_CONTROL_MAX_AGE', 0))
+# password hashing process pool, HASH_POOL_WORKERS=0 hashes inline
+HASH_POOL_WORKERS = int(os.environ.get('HASH_POOL_WORKERS', 2))
+HASH_POOL_MAX_PENDING = int(os.environ.get('HASH_POOL_MAX_PENDING', 32))
+HASH_TIMEOUT = int(os.environ.get('HASH_TIMEOUT', 10))
+# passwords hashed with other rounds are rehashed on the next login
+PBKDF2_ROUNDS = int(os.environ.get('PBKDF2_ROUNDS', 0)) or None
+# days ahead shows are created from movie runs
+SHOW_MATERIALIZE_DAYS = int(os.environ.get('SHOW_MATERIALIZE_DAYS', 14))
+# share of requests instrumented for /metrics, 0 turns it off
+METRICS_SAMPLE_RATE = float(os.environ.get('METRICS_SAMPLE_RATE', 1.0))
+# a request repeating one statement more often is flagged as N+1
+METRICS_N_PLUS_ONE_THRESHOLD = int(
+    os.environ.get('METRICS_N_PLUS_ONE_THRESHOLD', 10))
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+# "text" or "json", one object per line
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text')
+# records waiting for the writer thread, further records are dropped
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', 10000))
+# share of successful request and login records written
+LOG_SUCCESS_SAMPLE_RATE = float(os.environ.get('LOG_SUCCESS_SAMPLE_RATE',
+                                               1.0))
+# clients streaming seat availability per process
+SEAT_STREAM_MAX_SUBSCRIBERS = int(
+    os.environ.get('SEAT_STREAM_MAX_SUBSCRIBERS', 1000))
+# seat streams per process in WSGI mode, where each holds a server thread
+# for as long as it is open. 0 serves them only in ASGI mode.
+SEAT_STREAM_WSGI_MAX_SUBSCRIBERS = int(
+    os.environ.get('SEAT_STREAM_WSGI_MAX_SUBSCRIBERS', 0))
+# seconds between keep-alive comments on an idle seat stream
+SEAT_STREAM_HEARTBEAT = int(os.environ.get('SEAT_STREAM_HEARTBEAT', 15))
+# bookings of one show booked per transaction by the admission queue
+BOOKING_BATCH_SIZE = int(os.environ.get('BOOKING_BATCH_SIZE', 50))
+# bookings waiting per show before further ones get a 503
+BOOKING_QUEUE_MAX_DEPTH = int(os.environ.get('BOOKING_QUEUE_MAX_DEPTH', 500))
+# seconds a booking waits in the queue before giving up
+BOOKING_QUEUE_TIMEOUT = int(os.environ.get('BOOKING_QUEUE_TIMEOUT', 10))
+# seconds a stored Idempotency-Key response answers retries
+IDEMPOTENCY_TTL = int(os.environ.get('IDEMPOTENCY_TTL', 86400))
+# seconds a running request holds its key before a retry may take it over
+IDEMPOTENCY_LEASE = int(os.environ.get('IDEMPOTENCY_LEASE', 30))
+# seconds a duplicate waits for the running request before a 409
+IDEMPOTENCY_WAIT = int(os.environ.get('IDEMPOTENCY_WAIT', 10))
+IDEMPOTENCY_POLL_INTERVAL = float(
+    os.environ.get('IDEMPOTENCY_POLL_INTERVAL', 0.05))
+# days of shows, from today, answered from the in-process timetable,
+# TIMETABLE_DAYS=0 disables it
+TIMETABLE_DAYS = int(os.environ.get('TIMETABLE_DAYS', 2))
+# seconds between full reloads of the timetable
+TIMETABLE_REFRESH_INTERVAL = int(
+    os.environ.get('TIMETABLE_REFRESH_INTERVAL', 300))
@@ -0,0 +1,223 @@
+"""
+Live seat availability.
+
+A trigger on ``shows`` sends a ``seat_availability`` notification with the
+new seat count whenever a booking, hold or release commits. A statement
+inserting, deleting or rescheduling shows sends one notification with an
+``op`` of SCHEDULE per ``city_id`` and ``show_date`` it changed, and a
+statement writing cities, cinemas or movies, or truncating shows, one with
+an ``op`` of CATALOG naming the ``table``. Each process keeps a single
+``LISTEN`` connection on a background thread and hands every notification
+to the listeners, such as the timetable of src/timetable.py and the
+response cache eviction of src/main.py, and seat changes to the
+subscriptions of their cinema, which the ``/shows/stream/`` endpoints send
+to their clients as Server-Sent Events.
+
+A subscription only keeps the latest count of every show it has not sent
+yet, so a slow client costs a bounded amount of memory and never holds up
+the listener or other clients.
+"""
+import asyncio
+import json
+import select
+import threading
+import time
+from collections import defaultdict
+
+import psycopg2
+import psycopg2.extensions
+
+CHANNEL = "seat_availability"
+HEARTBEAT = ": keep-alive\n\n"
+
+
+class TooManySubscribers(Exception):
+    """
+    Raised when the process already streams to the maximum of clients.
+    """
+
+
+def format_event(event):
+    return "event: seats\ndata: {0}\n\n".format(json.dumps(event))
+
+
+class Subscription:
+    """
+    Seat changes of one cinema, optionally narrowed to a movie, show time
+    and date, for a client served on a thread.
+    """
+    def __init__(self,
+                 cinema_id,
+                 movie_id=None,
+                 show_time=None,
+                 show_date=None):
+        self.cinema_id = cinema_id
+        self.movie_id = movie_id
+        self.show_time = show_time
+        self.show_date = (show_date.strftime("%d-%m-%Y")
+                          if show_date else None)
+        self._pending = {}
+        self._condition = threading.Condition()
+
+    def matches(self, event):
+        return ((self.movie_id is None
+                 or event["movie_id"] == self.movie_id)
+                and (self.show_time is None
+                     or event["show_time"] == self.show_time)
+                and (self.show_date is None
+                     or event["show_date"] == self.show_date))
+
+    def push(self, event):
+        key = (event["movie_id"], event["show_time"], event["show_date"])
+        with self._condition:
+            # an unsent count of the same show is simply replaced
+            self._pending[key] = event
+            self._wake()
+
+    def _wake(self):
+        self._condition.notify()
+
+    def drain(self):
+        with self._condition:
+            events = list(self._pending.values())
+            self._pending.clear()
+        return events
+
+    def wait(self, timeout):
+        """
+        Returns the pending events, waiting up to ``timeout`` seconds for
+        one when there are none.
+        """
+        with self._condition:
+            if not self._pending:
+                self._condition.wait(timeout)
+        return self.drain()
+
+
+class AsyncSubscription(Subscription):
+    """
+    Subscription for a client served on an asyncio event loop.
+    """
+    def __init__(self, loop, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._loop = loop
+        self._ready = asyncio.Event()
+
+    def _wake(self):
+        self._loop.call_soon_threadsafe(self._ready.set)
+
+    async def wait(self, timeout):
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._ready.clear()
+        return self.drain()
+
+
+class SeatEventHub:
+    """
+    Fans out the notifications of one LISTEN connection to its listeners
+    and at most ``max_subscribers`` subscriptions. The listener thread is
+    started with the first listener or subscription and reconnects on its
+    own.
+    """
+    def __init__(self,
+                 dsn,
+                 max_subscribers=1000,
+                 logger=None,
+                 poll_interval=5,
+                 reconnect_delay=1):
+        self.dsn = dsn
+        self.max_subscribers = max_subscribers
+        self.logger = logger
+        self.poll_interval = poll_interval
+        self.reconnect_delay = reconnect_delay
+        self.events = 0
+        self._listeners = []
+        self._subscribers = defaultdict(set)
+        self._count = 0
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def _start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._listen,
+                                            name="seat-event-listener",
+                                            daemon=True)
+            self._thread.start()
+
+    def add_listener(self, listener):
+        """
+        Calls ``listener(event)`` with every notification, on the listener
+        thread.
+        """
+        with self._lock:
+            self._listeners.append(listener)
+            self._start()
+
+    def subscribe(self, subscription):
+        with self._lock:
+            if self._count >= self.max_subscribers:
+                raise TooManySubscribers()
+            self._subscribers[subscription.cinema_id].add(subscription)
+            self._count += 1
+            self._start()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.cinema_id)
+            if subscribers and subscription in subscribers:
+                subscribers.remove(subscription)
+                self._count -= 1
+                if not subscribers:
+                    del self._subscribers[subscription.cinema_id]
+
+    def publish(self, payload):
+        event = json.loads(payload)
+        with self._lock:
+            self.events += 1
+            listeners = list(self._listeners)
+            # schedule changes are not about a single cinema
+            subscribers = list(
+                self._subscribers.get(event.get("cinema_id"), ()))
+        for listener in listeners:
+            try:
+                listener(event)
+            except Exception:
+                if self.logger:
+                    self.logger.exception("Seat event listener %r failed",
+                                          listener)
+        for subscription in subscribers:
+            if subscription.matches(event):
+                subscription.push(event)
+
+    def stats(self):
+        with self._lock:
+            return {"subscribers": self._count, "events": self.events}
+
+    def _listen(self):
+        while True:
+            connection = None
+            try:
+                connection = psycopg2.connect(self.dsn)
+                connection.set_isolation_level(
+                    psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                connection.cursor().execute("LISTEN " + CHANNEL)
+                while True:
+                    readable, _, _ = select.select([connection], [], [],
+                                                   self.poll_interval)
+                    if not readable:
+                        continue
+                    connection.poll()
+                    while connection.notifies:
+                        self.publish(connection.notifies.pop(0).payload)
+            except Exception:
+                if self.logger:
+                    self.logger.exception(
+                        "Seat event listener failed, reconnecting")
+                time.sleep(self.reconnect_delay)
+            finally:
+                if connection is not None:
+                    connection.close()
@@ -0,0 +1,85 @@
+"""
+Distances and nearby lookups for cinema locations.
+
+``bounding_box`` gives the latitude/longitude ranges which contain every
+point within a radius, used to prefilter on indexed columns before the
+exact haversine distance is computed. ``GridIndex`` buckets a city's
+cinemas into square cells so a nearby lookup only measures the cinemas of
+the few cells the radius touches.
+"""
+import math
+
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = (math.sin((lat2 - lat1) / 2)**2 +
+         math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2)**2)
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def bounding_box(lat, lon, radius_km):
+    """
+    Returns (min lat, max lat, min lon, max lon) around the point. Near the
+    poles or across the antimeridian the longitude range is not narrowed.
+    """
+    delta_lat = radius_km / KM_PER_DEGREE
+    min_lat, max_lat = lat - delta_lat, lat + delta_lat
+    if min_lat <= -90 or max_lat >= 90:
+        return max(min_lat, -90), min(max_lat, 90), -180, 180
+    delta_lon = radius_km / (KM_PER_DEGREE * math.cos(math.radians(lat)))
+    if lon - delta_lon < -180 or lon + delta_lon > 180:
+        return min_lat, max_lat, -180, 180
+    return min_lat, max_lat, lon - delta_lon, lon + delta_lon
+
+
+class GridIndex:
+    """
+    Immutable grid of (id, latitude, longitude, ...) points with cells of
+    ``cell_km`` a side. Points may carry further values after those.
+    """
+    def __init__(self, points, cell_km=2):
+        self.cell_degrees = cell_km / KM_PER_DEGREE
+        self._cells = {}
+        self._size = 0
+        for point in points:
+            if point[1] is None or point[2] is None:
+                continue
+            self._cells.setdefault(self._cell(point[1], point[2]),
+                                   []).append(point)
+            self._size += 1
+
+    def __len__(self):
+        return self._size
+
+    def _cell(self, lat, lon):
+        return (math.floor(lat / self.cell_degrees),
+                math.floor(lon / self.cell_degrees))
+
+    def nearby(self, lat, lon, radius_km, limit=None):
+        """
+        Returns (distance in km, point) pairs of the points within the
+        radius, nearest first.
+        """
+        min_lat, max_lat, min_lon, max_lon = bounding_box(
+            lat, lon, radius_km)
+        low_row, low_column = self._cell(min_lat, min_lon)
+        high_row, high_column = self._cell(max_lat, max_lon)
+        found = []
+        if ((high_row - low_row + 1) * (high_column - low_column + 1) >
+                len(self._cells)):
+            # a wide radius covers more cells than the city has in use
+            cells = self._cells.values()
+        else:
+            cells = (self._cells.get((row, column), ())
+                     for row in range(low_row, high_row + 1)
+                     for column in range(low_column, high_column + 1))
+        for points in cells:
+            for point in points:
+                distance = haversine_km(lat, lon, point[1], point[2])
+                if distance <= radius_km:
+                    found.append((distance, point))
+        found.sort(key=lambda item: item[0])
+        return found[:limit] if limit else found
@@ -0,0 +1,111 @@
+"""
+Password hashing on a bounded process pool.
+
+PBKDF2 hashing holds the GIL for its whole run, so doing it in the request
+thread stalls every other request on the worker. Hashes are computed in
+separate processes instead, and the number of pending jobs is bounded so a
+login burst gets fast ``HashingBusy`` errors rather than an ever growing
+queue.
+
+Workers are started by a fork server, since the serving process already
+runs threads (server, log queue, listeners) whose locks a plain fork could
+copy in a held state. A pool broken by a killed worker is replaced by the
+next job.
+"""
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from passlib.hash import django_pbkdf2_sha256
+
+
+class HashingBusy(Exception):
+    """
+    Raised when the hashing queue is full or a job does not finish in time.
+    """
+
+
+def _hash(password, rounds):
+    handler = django_pbkdf2_sha256
+    if rounds:
+        handler = handler.using(rounds=rounds)
+    return handler.hash(password)
+
+
+def _verify(password, _hash):
+    return django_pbkdf2_sha256.verify(password, _hash)
+
+
+class HashingPool:
+    """
+    Runs password hashing and verification on a process pool with at most
+    ``max_pending`` jobs queued or running. With ``workers`` set to 0 the
+    work is done inline in the calling thread.
+    """
+    def __init__(self, workers=2, max_pending=32, timeout=10, rounds=None):
+        self.workers = workers
+        self.timeout = timeout
+        self.rounds = rounds
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def hash(self, password):
+        return self._run(_hash, password, self.rounds)
+
+    def verify(self, password, _hash):
+        return self._run(_verify, password, _hash)
+
+    def needs_rehash(self, _hash):
+        """
+        Returns True when the hash was made with other rounds than the
+        configured ones. Hashes look like ``pbkdf2_sha256$rounds$salt$sum``.
+        """
+        if not self.rounds:
+            return False
+        return int(_hash.split('$')[1]) != self.rounds
+
+    def _run(self, func, *args):
+        if not self.workers:
+            return func(*args)
+        if not self._slots.acquire(blocking=False):
+            raise HashingBusy("Password hashing queue is full")
+        executor = self._get_executor()
+        try:
+            future = executor.submit(func, *args)
+        except BrokenProcessPool:
+            self._slots.release()
+            self._discard(executor)
+            raise HashingBusy("Password hashing pool is restarting")
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            raise HashingBusy("Password hashing timed out")
+        except BrokenProcessPool:
+            self._discard(executor)
+            raise HashingBusy("Password hashing pool is restarting")
+
+    def _get_executor(self):
+        # created lazily so importing the app does not start processes
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.workers,
+                        mp_context=multiprocessing.get_context("forkserver"))
+        return self._executor
+
+    def _discard(self, executor):
+        """
+        Drops a pool broken by a dead worker, so the next job starts a new
+        one. Only the broken pool is dropped, not one already replacing it.
+        """
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False)
@@ -0,0 +1,185 @@
+"""
+Idempotency keys for the booking endpoints.
+
+A request carrying an ``Idempotency-Key`` header first claims the key for
+its user in ``idempotency_keys``. Only the claiming request runs; it
+stores its response, which then answers every retry with the same key
+until the key expires, without touching ``shows`` again.
+
+A duplicate arriving while the first request still runs waits for its
+result: on an in-process event when the first request runs in the same
+process, else by polling the key's row. A claim expires after a short
+lease, so the key of a request which died half way can be claimed again.
+Server errors are not stored, their key is released for the retry.
+"""
+import hashlib
+import json
+import threading
+import time
+from functools import wraps
+
+from flask import current_app, request
+from flask_jwt_extended import get_jwt_identity
+from flask_restful.utils import unpack
+from sqlalchemy import text
+
+from src.main import db
+
+HEADER = "Idempotency-Key"
+MAX_KEY_LENGTH = 64
+
+# claims a new or expired key, returns no row when the key is taken
+CLAIM_KEY = text("""
+    INSERT INTO idempotency_keys ("user", key, request_hash, expires_at)
+    VALUES (:user_id, :key, :request_hash,
+            now() at time zone 'utc' + :lease * interval '1 second')
+    ON CONFLICT ("user", key) DO UPDATE
+    SET request_hash = EXCLUDED.request_hash, status_code = NULL,
+        response = NULL, expires_at = EXCLUDED.expires_at
+    WHERE idempotency_keys.expires_at <= now() at time zone 'utc'
+    RETURNING 1
+""")
+
+FIND_KEY = text("""
+    SELECT request_hash, status_code, response FROM idempotency_keys
+    WHERE "user" = :user_id AND key = :key
+      AND expires_at > now() at time zone 'utc'
+""")
+
+STORE_RESPONSE = text("""
+    UPDATE idempotency_keys
+    SET status_code = :status_code, response = CAST(:response AS jsonb),
+        expires_at = now() at time zone 'utc' + :ttl * interval '1 second'
+    WHERE "user" = :user_id AND key = :key
+""")
+
+RELEASE_KEY = text("""
+    DELETE FROM idempotency_keys WHERE "user" = :user_id AND key = :key
+""")
+
+PURGE_EXPIRED_KEYS = text("""
+    DELETE FROM idempotency_keys
+    WHERE ctid IN (
+        SELECT ctid FROM idempotency_keys
+        WHERE expires_at <= now() at time zone 'utc'
+        LIMIT :batch_size
+    )
+""")
+
+# (user, key) of the requests running in this process
+_in_flight = {}
+_in_flight_lock = threading.Lock()
+
+
+def _error(message, status):
+    return {"data": {"error_message": message}}, status
+
+
+def _replay(row):
+    return row.response, row.status_code, {"Idempotent-Replayed": "true"}
+
+
+def _await_result(params, request_hash):
+    """
+    Waits for the request holding the key and returns its stored response,
+    or None when the key was released or its claim expired meanwhile.
+    """
+    deadline = time.monotonic() + current_app.config['IDEMPOTENCY_WAIT']
+    while True:
+        # a completed key is replayed right away, only a running one waits
+        row = db.session.execute(FIND_KEY, params).first()
+        db.session.rollback()
+        if row is None:
+            return None
+        if row.request_hash != request_hash:
+            return _error(
+                "Idempotency-Key was already used for another request", 422)
+        if row.status_code is not None:
+            return _replay(row)
+        if time.monotonic() >= deadline:
+            return _error(
+                "A request with this Idempotency-Key is still being "
+                "processed", 409)
+        with _in_flight_lock:
+            running = _in_flight.get((params["user_id"], params["key"]))
+        if running:
+            running.wait(max(0, deadline - time.monotonic()))
+        else:
+            time.sleep(current_app.config['IDEMPOTENCY_POLL_INTERVAL'])
+
+
+def idempotent(func):
+    """
+    Decorator for JWT protected resource methods which makes requests with
+    an ``Idempotency-Key`` header run at most once per user and key.
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get(HEADER)
+        if key is None:
+            return func(*args, **kwargs)
+        if not key or len(key) > MAX_KEY_LENGTH:
+            return _error(
+                "Idempotency-Key must be 1 to {0} characters".format(
+                    MAX_KEY_LENGTH), 400)
+        params = {"user_id": get_jwt_identity()["id"], "key": key}
+        request_hash = hashlib.sha256(
+            request.method.encode() + request.path.encode() +
+            request.get_data()).hexdigest()
+
+        while True:
+            claimed = db.session.execute(
+                CLAIM_KEY,
+                dict(params,
+                     request_hash=request_hash,
+                     lease=current_app.config['IDEMPOTENCY_LEASE'])).scalar()
+            db.session.commit()
+            if claimed:
+                break
+            response = _await_result(params, request_hash)
+            if response is not None:
+                return response
+
+        done = threading.Event()
+        with _in_flight_lock:
+            _in_flight[(params["user_id"], key)] = done
+        try:
+            response = func(*args, **kwargs)
+            data, status, _ = unpack(response)
+            if status < 500:
+                db.session.execute(
+                    STORE_RESPONSE,
+                    dict(params,
+                         status_code=status,
+                         response=json.dumps(data),
+                         ttl=current_app.config['IDEMPOTENCY_TTL']))
+            else:
+                db.session.execute(RELEASE_KEY, params)
+            db.session.commit()
+            return response
+        except Exception:
+            db.session.rollback()
+            db.session.execute(RELEASE_KEY, params)
+            db.session.commit()
+            raise
+        finally:
+            with _in_flight_lock:
+                del _in_flight[(params["user_id"], key)]
+            done.set()
+
+    return wrapper
+
+
+def purge_expired_keys(batch_size=1000):
+    """
+    Deletes expired keys batch by batch and returns how many were deleted.
+    """
+    deleted = 0
+    while True:
+        count = db.session.execute(PURGE_EXPIRED_KEYS, {
+            "batch_size": batch_size
+        }).rowcount
+        db.session.commit()
+        deleted += count
+        if count < batch_size:
+            return deleted
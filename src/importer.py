@@ -0,0 +1,169 @@
+"""
+Bulk catalog import.
+
+Files are streamed into a temporary staging table with Postgres ``COPY``
+and then upserted into the real table with one set-based statement, so
+memory stays bounded by the COPY buffer no matter how large the file is.
+CSV files need a header row naming the columns; JSON lines files hold one
+object per line, all with the keys of the first. Only the columns a file
+names are written, so existing rows keep the values of the others. Dates
+are ISO formatted.
+"""
+import csv
+import io
+import json
+import time
+
+from src.main import db
+
+# columns loaded and conflict key of every importable table
+TABLES = {
+    "cities": (("id", "city_name"), ("id", )),
+    "cinemas": (("id", "name", "show_times", "city", "latitude",
+                 "longitude"), ("id", )),
+    "movies": (("id", "name", "release_date"), ("id", )),
+    "shows": (("movie_id", "cinema_id", "show_times", "show_date",
+               "no_of_seats"), ("movie_id", "cinema_id", "show_times",
+                                "show_date")),
+}
+
+
+class JsonLinesReader:
+    """
+    File-like object which streams a JSON lines file as CSV rows for COPY,
+    converting only as many lines as each ``read`` asks for.
+    """
+    def __init__(self, file, columns):
+        self._lines = iter(file)
+        self._columns = columns
+        self._buffer = ""
+        self._output = io.StringIO()
+        self._writer = csv.writer(self._output)
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            line = next(self._lines, None)
+            if line is None:
+                break
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            try:
+                row = [
+                    self._value(record[column]) for column in self._columns
+                ]
+            except KeyError as err:
+                raise ValueError(
+                    "Every JSON line needs the keys of the first, {0} is "
+                    "missing".format(err))
+            self._writer.writerow(row)
+            self._buffer += self._output.getvalue()
+            self._output.seek(0)
+            self._output.truncate()
+        if size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    @staticmethod
+    def _value(value):
+        if isinstance(value, list):
+            # Postgres array literal
+            return "{" + ",".join(json.dumps(str(item))
+                                  for item in value) + "}"
+        return value
+
+
+def json_lines_columns(file):
+    """
+    Returns the keys of the first record of a JSON lines file and rewinds
+    it.
+    """
+    for line in file:
+        if line.strip():
+            file.seek(0)
+            return tuple(json.loads(line))
+    file.seek(0)
+    return ()
+
+
+def check_columns(table, columns, keys):
+    unknown = set(columns) - set(TABLES[table][0])
+    if unknown or not set(keys) <= set(columns):
+        raise ValueError(
+            "Files must name the key columns {0} and only columns of "
+            "{1}".format(", ".join(keys), table))
+
+
+def upsert_statement(table, columns, keys):
+    """
+    INSERT ... SELECT from the staging table, keeping one row per key.
+    Existing catalog rows get the given columns updated, while existing
+    shows are left alone since their seat counts are live inventory.
+    """
+    column_list = ", ".join(columns)
+    select = ("SELECT DISTINCT ON ({keys}) {columns} FROM staging_{table} "
+              "ORDER BY {keys}").format(keys=", ".join(keys),
+                                        columns=column_list,
+                                        table=table)
+    if table == "shows":
+        return ("INSERT INTO shows ({columns}, seat_map) "
+                "SELECT {columns}, repeat('0', no_of_seats)::varbit "
+                "FROM ({select}) AS staged "
+                "ON CONFLICT ({keys}) DO NOTHING").format(
+                    columns=column_list, select=select, keys=", ".join(keys))
+    updates = ", ".join("{0} = EXCLUDED.{0}".format(column)
+                        for column in columns if column not in keys)
+    return ("INSERT INTO {table} ({columns}) {select} "
+            "ON CONFLICT ({keys}) DO {action}").format(
+                table=table,
+                columns=column_list,
+                select=select,
+                keys=", ".join(keys),
+                action="UPDATE SET " + updates if updates else "NOTHING")
+
+
+def import_file(table, path, file_format=None):
+    """
+    Imports a CSV or JSON lines file into ``table`` in one transaction.
+    Returns (rows copied, rows written, seconds taken).
+    """
+    columns, keys = TABLES[table]
+    file_format = file_format or ("jsonl" if path.endswith(
+        (".jsonl", ".json")) else "csv")
+    started = time.monotonic()
+    connection = db.engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        # imports can run far longer than the request statement timeout
+        cursor.execute("SET LOCAL statement_timeout = 0")
+        cursor.execute("CREATE TEMP TABLE staging_{0} (LIKE {0}) "
+                       "ON COMMIT DROP".format(table))
+        with open(path, newline="") as file:
+            if file_format == "jsonl":
+                columns = json_lines_columns(file)
+                check_columns(table, columns, keys)
+                source, header = JsonLinesReader(file, columns), ""
+            else:
+                source, header = file, ", HEADER true"
+                header_columns = next(csv.reader([file.readline()]))
+                file.seek(0)
+                columns = tuple(column.strip() for column in header_columns)
+                check_columns(table, columns, keys)
+            cursor.copy_expert(
+                "COPY staging_{0} ({1}) FROM STDIN WITH (FORMAT csv{2})".
+                format(table, ", ".join(columns), header), source)
+            copied = cursor.rowcount
+        cursor.execute(upsert_statement(table, columns, keys))
+        written = cursor.rowcount
+        if "id" in columns:
+            cursor.execute(
+                "SELECT setval(pg_get_serial_sequence('{0}', 'id'), "
+                "(SELECT max(id) FROM {0}))".format(table))
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        connection.close()
+    return copied, written, time.monotonic() - started
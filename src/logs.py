@@ -0,0 +1,123 @@
+"""
+Non-blocking logging.
+
+Request threads only put records on a bounded in-memory queue. A single
+background listener thread formats them and writes them to stderr, so
+slow log output never stalls a request. Records keep their %-style
+arguments and are only formatted by the listener, and a record that does
+not fit in a full queue is dropped and counted instead of blocking.
+
+Every record carries the id of the request it was logged in. Records
+logged with ``extra=SUCCESS`` are sampled with ``success_sample_rate``.
+"""
+import atexit
+import json
+import logging
+import queue
+import random
+import sys
+from logging.handlers import QueueHandler, QueueListener
+
+from flask import g, has_request_context
+
+# passed as ``extra`` to mark routine success records which may be sampled
+SUCCESS = {"success": True}
+
+TEXT_FORMAT = ('[%(asctime)s] %(levelname)s %(request_id)s in %(module)s: '
+               '%(message)s')
+
+# attributes of every LogRecord, everything else was passed in ``extra``
+_RECORD_ATTRIBUTES = set(
+    vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {
+        "message", "asctime", "request_id", "success"
+    }
+
+
+class RequestContextFilter(logging.Filter):
+    """
+    Tags records with the current request id and drops all but
+    ``success_sample_rate`` of the success records.
+    """
+    def __init__(self, success_sample_rate=1.0):
+        super().__init__()
+        self.success_sample_rate = success_sample_rate
+
+    def filter(self, record):
+        if (getattr(record, "success", False)
+                and self.success_sample_rate < 1
+                and random.random() >= self.success_sample_rate):
+            return False
+        record.request_id = (g.get("request_id", "-")
+                             if has_request_context() else "-")
+        return True
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    Queue handler which leaves formatting to the listener thread and drops
+    records when the queue is full.
+    """
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # the queue never leaves the process, so the record is passed on
+        # as is and its message is built by the listener
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats records as one JSON object per line, including any fields
+    passed in ``extra``.
+    """
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "module": record.module,
+            "request_id": getattr(record, "request_id", "-"),
+            "message": record.getMessage()
+        }
+        entry.update((key, value) for key, value in vars(record).items()
+                     if key not in _RECORD_ATTRIBUTES)
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging(level="INFO",
+                      log_format="text",
+                      queue_size=10000,
+                      success_sample_rate=1.0,
+                      stream=None):
+    """
+    Routes the root logger through a queue to a background writer thread
+    and returns the queue handler.
+    """
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(JsonFormatter() if log_format ==
+                        "json" else logging.Formatter(TEXT_FORMAT))
+    handler = NonBlockingQueueHandler(queue.Queue(queue_size))
+    handler.addFilter(RequestContextFilter(success_sample_rate))
+
+    root = logging.getLogger()
+    for existing in root.handlers[:]:
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
+
+    listener = QueueListener(handler.queue, output)
+    listener.start()
+    # writes out what is still queued when the process exits
+    atexit.register(listener.stop)
+    handler.listener = listener
+    return handler
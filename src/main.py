@@ -3,38 +3,60 @@ In this file we initialize the flask app and add configurations to it.
 We initialize API, jwt and db extensions using the app
 """
 
-import traceback
-from time import strftime
+import json
+import threading
+import time
+import uuid
+from functools import wraps
 
-from flask import Flask, request
+import click
+from flask import (Flask, Response, request, g, make_response,
+                   has_request_context)
 from flask_restful import Api
-from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy import SQLAlchemy, SignallingSession, get_state
+from sqlalchemy import orm
 from flask_jwt_extended import JWTManager
 from flask_migrate import Migrate
-from logging.config import dictConfig
 from flask_marshmallow import Marshmallow
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 from . import config
+from .admission import AdmissionQueue
+from .cache import CityIndexes, LRUCache
+from .events import SeatEventHub
+from .geo import GridIndex
+from .hashing import HashingPool
+from .logs import SUCCESS, configure_logging
+from .metrics import Metrics
+from .search import PrefixIndex
+from .timetable import Timetable
+
+log_handler = configure_logging(config.LOG_LEVEL, config.LOG_FORMAT,
+                                config.LOG_QUEUE_SIZE,
+                                config.LOG_SUCCESS_SAMPLE_RATE)
+
+
+class RoutingSession(SignallingSession):
+    """
+    Session which sends every statement of a request marked with
+    ``read_replica`` to the replica bind, when one is configured.
+    """
+    def get_bind(self, mapper=None, clause=None):
+        if (has_request_context() and g.get('use_replica')
+                and 'replica' in self.app.config['SQLALCHEMY_BINDS']):
+            return get_state(self.app).db.get_engine(self.app,
+                                                     bind='replica')
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
 
-dictConfig({
-    'version': 1,
-    'formatters': {
-        'default': {
-            'format': '[%(asctime)s] %(levelname)s in %(module)s: %(message)s',
-        }
-    },
-    'handlers': {
-        'wsgi': {
-            'class': 'logging.StreamHandler',
-            'stream': 'ext://flask.logging.wsgi_errors_stream',
-            'formatter': 'default'
-        }
-    },
-    'root': {
-        'level': 'INFO',
-        'handlers': ['wsgi']
-    }
-})
 
 app = Flask(__name__)
 logger = app.logger
@@ -42,18 +64,98 @@ api = Api(app)
 app.config.from_object(config)
 
 jwt = JWTManager(app)
-db = SQLAlchemy(app)
+db = RoutingSQLAlchemy(app)
 migrate = Migrate(app, db)
 ma = Marshmallow(app)
+cache = LRUCache(app.config['CACHE_MAX_ENTRIES'], app.config['CACHE_TTL'])
+autocomplete = CityIndexes(cache, PrefixIndex,
+                           ('cities', 'cinemas', 'movies', 'shows'))
+cinema_grid = CityIndexes(cache, GridIndex, ('cinemas', ))
+hashing_pool = HashingPool(app.config['HASH_POOL_WORKERS'],
+                           app.config['HASH_POOL_MAX_PENDING'],
+                           app.config['HASH_TIMEOUT'],
+                           app.config['PBKDF2_ROUNDS'])
+booking_queue = AdmissionQueue(app.config['BOOKING_BATCH_SIZE'],
+                               app.config['BOOKING_QUEUE_MAX_DEPTH'],
+                               app.config['BOOKING_QUEUE_TIMEOUT'])
+metrics = Metrics(app.config['METRICS_SAMPLE_RATE'],
+                  app.config['METRICS_N_PLUS_ONE_THRESHOLD'], logger)
+metrics.install()
+# notifications are not replicated, so the listener always uses the primary
+seat_events = SeatEventHub(app.config['SQLALCHEMY_DATABASE_URI'],
+                           app.config['SEAT_STREAM_MAX_SUBSCRIBERS'], logger)
+# seat streams served by WSGI threads, the ASGI mode serves them natively
+wsgi_seat_streams = threading.BoundedSemaphore(
+    app.config['SEAT_STREAM_WSGI_MAX_SUBSCRIBERS'])
+timetable = Timetable(app.config['TIMETABLE_DAYS'],
+                      app.config['TIMETABLE_REFRESH_INTERVAL'], logger, cache)
+
+
+def evict_catalog(event):
+    """
+    Seat event listener evicting the cached responses of a catalog table or
+    schedule that a notification says changed, written by any process.
+    """
+    if event.get("op") == "CATALOG":
+        cache.invalidate(event["table"])
+    elif event.get("op") == "SCHEDULE":
+        cache.invalidate('shows', 'movies')
+
+
+def encode_json(data):
+    """
+    Encodes with orjson when it is installed, else with the standard
+    library encoder without indentation or extra whitespace.
+    """
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, separators=(',', ':'))
+
+
+@api.representation('application/json')
+def output_json(data, code, headers=None):
+    response = make_response(encode_json(data), code)
+    response.headers.extend(headers or {})
+    response.headers['Content-Type'] = 'application/json'
+    return response
+
+
+def read_replica(func):
+    """
+    Resource method decorator routing the request's reads to the replica,
+    unless the client wrote recently and has to read its own writes.
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        primary_until = request.cookies.get('primary_until', '0')
+        g.use_replica = not (primary_until.isdigit()
+                             and int(primary_until) > time.time())
+        return func(*args, **kwargs)
+
+    return wrapper
+
+
+@app.before_request
+def before_request():
+    g.request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex
+    metrics.start_request()
 
 
 # using after request decorator logging all requests
 @app.after_request
 def after_request(response):
-    timestamp = strftime('[%Y-%b-%d %H:%M]')
-    logger.info('{0} {1} {2} {3} {4} {5}'.format(
-        timestamp, request.remote_addr, request.method, request.scheme,
-        request.full_path, response.status))
+    metrics.finish_request(
+        request.url_rule.rule if request.url_rule else 'unmatched',
+        request.method, response.status_code)
+    logger.info('%s %s %s %s %s',
+                request.remote_addr,
+                request.method,
+                request.scheme,
+                request.full_path,
+                response.status,
+                extra=SUCCESS if response.status_code < 400 else None)
+    if 'request_id' in g:
+        response.headers['X-Request-ID'] = g.request_id
     response.headers['Access-Control-Allow-Origin'] = '*'
     response.headers[
         'Access-Control-Allow-Headers'] = 'Authorization, Content-Type'
@@ -63,19 +165,102 @@ def after_request(response):
     response.headers['mode'] = 'block'
     response.headers['X-Frame-Options'] = 'SAMEORIGIN'
     response.headers['X-Content-Type-Options'] = 'nosniff'
+    if request.method != 'GET' and response.status_code < 400:
+        # pins the client's reads to the primary until the replica caught up
+        window = app.config['READ_YOUR_WRITES_WINDOW']
+        response.set_cookie('primary_until',
+                            str(int(time.time()) + window),
+                            max_age=window)
+    etag = g.get('etag')
+    if etag and response.status_code in (200, 304):
+        response.set_etag(etag)
+        response.last_modified = g.last_modified
+        response.headers['Cache-Control'] = 'public, max-age={0}'.format(
+            app.config['CACHE_CONTROL_MAX_AGE'])
     return response
 
 
 # using error handler decorator to log all the exceptions
 @app.errorhandler(Exception)
 def exception_handler(e):
-    timestamp = strftime('[%Y-%b-%d %H:%M]')
-    logger.error('{0} {1} {2} {3} {4} 500 INTERNAL SERVER ERROR\n%s',
-                 timestamp, request.remote_addr, request.method,
-                 request.scheme, request.full_path, traceback.format_exc())
+    logger.exception('%s %s %s %s 500 INTERNAL SERVER ERROR',
+                     request.remote_addr, request.method, request.scheme,
+                     request.full_path)
     return e.status_code
 
 
 @app.route('/health-check/', methods=["GET"])
 def health_check():
     return "success"
+
+
+@app.route('/cache-stats/', methods=["GET"])
+def cache_stats():
+    return {"data": cache.stats()}
+
+
+@app.route('/metrics', methods=["GET"])
+def metrics_endpoint():
+    gauges = {
+        "catalog_cache_{0}".format(name): value
+        for name, value in cache.stats().items()
+    }
+    gauges.update(("seat_stream_{0}".format(name), value)
+                  for name, value in seat_events.stats().items())
+    gauges.update(("booking_queue_{0}".format(name), value)
+                  for name, value in booking_queue.stats().items())
+    gauges.update(("autocomplete_{0}".format(name), value)
+                  for name, value in autocomplete.stats().items())
+    gauges.update(("cinema_grid_{0}".format(name), value)
+                  for name, value in cinema_grid.stats().items())
+    gauges.update(("timetable_{0}".format(name), value)
+                  for name, value in timetable.stats().items())
+    return Response(metrics.render(gauges),
+                    mimetype='text/plain; version=0.0.4')
+
+
+@app.cli.command('sweep-seat-holds')
+def sweep_seat_holds():
+    """Release all expired seat holds."""
+    from src.seats import sweep_expired_holds
+    updated = sweep_expired_holds(app.config['SEAT_HOLD_SWEEP_BATCH'])
+    logger.info('Released expired seat holds on %s shows', updated)
+
+
+@app.cli.command('purge-idempotency-keys')
+def purge_idempotency_keys():
+    """Delete expired idempotency keys."""
+    from src.idempotency import purge_expired_keys
+    deleted = purge_expired_keys()
+    logger.info('Deleted %s expired idempotency keys', deleted)
+
+
+@app.cli.command('import-catalog')
+@click.argument('table', type=click.Choice(['cities', 'cinemas', 'movies',
+                                            'shows']))
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format',
+              'file_format',
+              type=click.Choice(['csv', 'jsonl']),
+              help='Defaults to jsonl for .jsonl/.json files, else csv.')
+def import_catalog(table, path, file_format):
+    """Bulk load a CSV or JSON lines file into a catalog table."""
+    from src.importer import import_file
+    copied, written, seconds = import_file(table, path, file_format)
+    click.echo('{0}: copied {1} rows, wrote {2} rows in {3:.1f}s '
+               '({4:.0f} rows/sec)'.format(table, copied, written, seconds,
+                                           copied / max(seconds, 0.001)))
+
+
+@app.cli.command('materialize-shows')
+@click.option('--days',
+              type=int,
+              help='Days ahead to create shows for, defaults to '
+              'SHOW_MATERIALIZE_DAYS.')
+@click.option('--batch-size', type=int, default=500, show_default=True)
+def materialize_shows_command(days, batch_size):
+    """Create the missing shows of every movie run, meant to run nightly."""
+    from src.scheduler import materialize_shows
+    runs, shows = materialize_shows(
+        days or app.config['SHOW_MATERIALIZE_DAYS'], batch_size)
+    click.echo('Created {0} shows for {1} movie runs'.format(shows, runs))
@@ -0,0 +1,168 @@
+"""
+Per-request latency and SQL instrumentation exported in the Prometheus
+text format.
+
+SQLAlchemy engine events count the statements and database time of every
+sampled request. A request running the same statement more than the N+1
+threshold is counted and logged. With ``sample_rate`` below 1 only that
+share of requests is instrumented; the others pay for a single random()
+call.
+"""
+import random
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+
+from flask import g, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+STATEMENT_BUCKETS = (1, 2, 5, 10, 20, 50, 100)
+
+
+class Histogram:
+    """
+    Cumulative Prometheus histogram keyed by a tuple of label values.
+    """
+    def __init__(self, name, description, labels, buckets):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_values, value):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [
+                    [0] * len(self.buckets), 0.0, 0
+                ]
+            index = bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [
+            "# HELP {0} {1}".format(self.name, self.description),
+            "# TYPE {0} histogram".format(self.name)
+        ]
+        with self._lock:
+            series = sorted(self._series.items())
+            for label_values, (counts, total, count) in series:
+                labels = _labels(zip(self.labels, label_values))
+                prefix = labels + "," if labels else ""
+                cumulative = 0
+                for bucket, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    lines.append('{0}_bucket{{{1}le="{2}"}} {3}'.format(
+                        self.name, prefix, bucket, cumulative))
+                lines.append('{0}_bucket{{{1}le="+Inf"}} {2}'.format(
+                    self.name, prefix, count))
+                lines.append("{0}_sum{{{1}}} {2}".format(
+                    self.name, labels, total))
+                lines.append("{0}_count{{{1}}} {2}".format(
+                    self.name, labels, count))
+        return lines
+
+
+class Metrics:
+    """
+    Request metrics registry. Call ``start_request`` before and
+    ``finish_request`` after every request.
+    """
+    def __init__(self, sample_rate=1.0, n_plus_one_threshold=10,
+                 logger=None):
+        self.sample_rate = sample_rate
+        self.n_plus_one_threshold = n_plus_one_threshold
+        self.logger = logger
+        self.request_latency = Histogram(
+            "http_request_duration_seconds", "Request latency.",
+            ("route", "method", "status"), LATENCY_BUCKETS)
+        self.db_time = Histogram("http_request_db_seconds",
+                                 "Time spent in SQL per request.",
+                                 ("route", ), LATENCY_BUCKETS)
+        self.statements = Histogram("http_request_sql_statements",
+                                    "SQL statements per request.",
+                                    ("route", ), STATEMENT_BUCKETS)
+        self.n_plus_one = Counter()
+        self._lock = threading.Lock()
+
+    def install(self):
+        """
+        Listens to the statements of every engine, primary and replica.
+        """
+        event.listen(Engine, "before_cursor_execute", self._before_execute)
+        event.listen(Engine, "after_cursor_execute", self._after_execute)
+
+    def start_request(self):
+        if self.sample_rate >= 1 or random.random() < self.sample_rate:
+            g.metrics = {
+                "started": time.perf_counter(),
+                "db_time": 0.0,
+                "statements": Counter()
+            }
+
+    def finish_request(self, route, method, status):
+        request_metrics = g.pop("metrics", None)
+        if request_metrics is None:
+            return
+        elapsed = time.perf_counter() - request_metrics["started"]
+        statements = request_metrics["statements"]
+        self.request_latency.observe((route, method, str(status)), elapsed)
+        self.db_time.observe((route, ), request_metrics["db_time"])
+        self.statements.observe((route, ), sum(statements.values()))
+        if statements:
+            statement, repeats = statements.most_common(1)[0]
+            if repeats > self.n_plus_one_threshold:
+                with self._lock:
+                    self.n_plus_one[route] += 1
+                if self.logger:
+                    self.logger.warning(
+                        "N+1 query pattern on %s: statement repeated %s "
+                        "times: %s", route, repeats, statement)
+
+    def _before_execute(self, conn, cursor, statement, parameters, context,
+                        executemany):
+        if has_request_context() and "metrics" in g:
+            context._metrics_started = time.perf_counter()
+
+    def _after_execute(self, conn, cursor, statement, parameters, context,
+                       executemany):
+        started = getattr(context, "_metrics_started", None)
+        if started is not None and has_request_context() and "metrics" in g:
+            g.metrics["db_time"] += time.perf_counter() - started
+            g.metrics["statements"][statement] += 1
+
+    def render(self, gauges=None):
+        """
+        Returns all metrics in the Prometheus text format. ``gauges`` maps
+        extra metric names to values.
+        """
+        lines = []
+        for histogram in (self.request_latency, self.db_time,
+                          self.statements):
+            lines.extend(histogram.render())
+        lines.append("# HELP http_request_n_plus_one_total Requests which "
+                     "repeated one statement above the threshold.")
+        lines.append("# TYPE http_request_n_plus_one_total counter")
+        with self._lock:
+            for route, count in sorted(self.n_plus_one.items()):
+                lines.append("http_request_n_plus_one_total{{{0}}} {1}".format(
+                    _labels([("route", route)]), count))
+        for name, value in sorted((gauges or {}).items()):
+            lines.append("# TYPE {0} gauge".format(name))
+            lines.append("{0} {1}".format(name, value))
+        return "\n".join(lines) + "\n"
+
+
+def _labels(pairs):
+    return ",".join('{0}="{1}"'.format(
+        name,
+        str(value).replace("\\", "\\\\").replace('"', '\\"'))
+                    for name, value in pairs)
@@ -1,12 +1,28 @@
 import uuid
 from datetime import datetime
-from itertools import chain
 
-from sqlalchemy.dialects.postgresql import ARRAY
-from sqlalchemy.ext.hybrid import hybrid_property
-from passlib.hash import django_pbkdf2_sha256
+from sqlalchemy.dialects.postgresql import ARRAY, BIT, JSONB
 
-from src.main import db
+from src.geo import EARTH_RADIUS_KM, bounding_box
+from src.main import db, hashing_pool
+
+
+def name_search(model, term, limit, *criteria):
+    """
+    Returns a query of (id, name) rows of ``model`` whose name contains
+    ``term`` or is similar to it and which meet ``criteria``, best matches
+    first. Both name conditions are answered by the pg_trgm GIN index on
+    the name.
+    """
+    pattern = "%{0}%".format(
+        term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_"))
+    # text() escapes the percent operator for the driver's paramstyle
+    similar = db.text("{0}.name % :term".format(
+        model.__tablename__)).bindparams(term=term)
+    return db.session.query(model.id, model.name).filter(
+        db.or_(model.name.ilike(pattern), similar), *criteria).order_by(
+            db.func.similarity(model.name, term).desc(),
+            model.name).limit(limit)
 
 
 class User(db.Model):
@@ -18,18 +34,21 @@ class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     phone_number = db.Column(db.String(10), unique=True, nullable=False)
     password = db.Column(db.String(128), nullable=False)
-    tickets = db.relationship("Ticket")
+    tickets = db.relationship("Ticket", lazy="dynamic")
 
     @classmethod
     def check_password(cls, password, _hash):
-        return django_pbkdf2_sha256.verify(password, _hash)
+        return hashing_pool.verify(password, _hash)
+
+    def needs_rehash(self):
+        return hashing_pool.needs_rehash(self.password)
 
     def pre_commit_setup(self):
         """
         This method generates the required fields either from available
         information else automatic fields are generated.
         """
-        self.password = django_pbkdf2_sha256.hash(self.password)
+        self.password = hashing_pool.hash(self.password)
 
 
 class City(db.Model):
@@ -42,13 +61,14 @@ class City(db.Model):
     city_name = db.Column(db.String(80), nullable=False)
     cinemas = db.relationship("Cinema")
 
-    @hybrid_property
-    def movies(self):
-        return list(chain(*[cinema.movies for cinema in self.cinemas]))
-
 
 class Show(db.Model):
     __tablename__ = "shows"
+    __table_args__ = (
+        # both are created with INCLUDE columns by the migration
+        db.Index('ix_shows_movie_id_show_date', 'movie_id', 'show_date'),
+        db.Index('ix_shows_cinema_id_show_date', 'cinema_id', 'show_date'),
+    )
     movie_id = db.Column(db.Integer,
                          db.ForeignKey('movies.id'),
                          primary_key=True)
@@ -56,16 +76,121 @@ class Show(db.Model):
                           db.ForeignKey('cinemas.id'),
                           primary_key=True)
     show_times = db.Column(db.String(8), nullable=False, primary_key=True)
-    show_date = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    show_date = db.Column(db.DateTime,
+                          nullable=False,
+                          primary_key=True,
+                          default=datetime.utcnow)
     no_of_seats = db.Column('no_of_seats', db.Integer, nullable=False)
+    # one bit per seat, set while the seat is held or sold
+    seat_map = db.Column(BIT(varying=True))
     cinema = db.relationship("Cinema", backref="shows")
 
+    @classmethod
+    def reserve_seats_statement(cls, movie_id, cinema_id, show_time,
+                                show_date, seats):
+        """
+        Conditional UPDATE which decrements the available seats of a show
+        only if enough are left, returning the remaining seats. The seats
+        are taken from the first free seats of the seat map, so they can
+        not be held afterwards.
+        """
+        shows = cls.__table__
+        return shows.update().where(
+            db.and_(shows.c.movie_id == movie_id,
+                    shows.c.cinema_id == cinema_id,
+                    shows.c.show_times == show_time,
+                    shows.c.show_date == show_date,
+                    shows.c.no_of_seats >= seats)).values(
+                        no_of_seats=shows.c.no_of_seats - seats,
+                        seat_map=db.func.claim_free_seats(
+                            shows.c.seat_map,
+                            seats)).returning(shows.c.no_of_seats)
+
+    @classmethod
+    def reserve_seats(cls, movie_id, cinema_id, show_time, show_date, seats):
+        """
+        Checks and decrements the available seats of a show in a single
+        conditional UPDATE, so concurrent bookings can never oversell.
+        Returns the remaining seats, or None when the show does not exist
+        or does not have enough seats left. The caller owns the transaction.
+        """
+        return db.session.execute(
+            cls.reserve_seats_statement(movie_id, cinema_id, show_time,
+                                        show_date, seats)).scalar()
+
+    @classmethod
+    def schedule(cls,
+                 movie_id,
+                 cinema_id=None,
+                 show_time=None,
+                 show_date=None,
+                 from_date=None,
+                 to_date=None,
+                 lat=None,
+                 lon=None,
+                 radius=None):
+        """
+        Returns a query of (cinema name, show time, show date, seats) rows
+        for a movie, ordered by cinema. Only the columns needed are
+        selected, with the cinema joined in, so it is one SQL round trip.
+
+        With a location (``lat``, ``lon``) only cinemas within ``radius``
+        km are returned, nearest first, and every row ends with the
+        cinema's distance.
+        """
+        columns = [Cinema.name, cls.show_times, cls.show_date, cls.no_of_seats]
+        order = [Cinema.name, cls.show_date, cls.show_times]
+        if lat is not None and lon is not None:
+            distance = Cinema.distance_km(lat, lon)
+            columns.append(distance)
+            order.insert(0, distance)
+        shows = db.session.query(*columns).join(
+            Cinema,
+            cls.cinema_id == Cinema.id).filter(cls.movie_id == movie_id)
+        if lat is not None and lon is not None:
+            shows = shows.filter(*Cinema.within(lat, lon, radius))
+        if cinema_id:
+            shows = shows.filter(cls.cinema_id == cinema_id)
+        if show_time:
+            shows = shows.filter(cls.show_times == show_time)
+        if show_date:
+            shows = shows.filter(cls.show_date == show_date)
+        if from_date:
+            shows = shows.filter(cls.show_date >= from_date)
+        if to_date:
+            shows = shows.filter(cls.show_date <= to_date)
+        return shows.order_by(*order)
+
+    @classmethod
+    def timetable(cls, from_date, to_date, city_id=None):
+        """
+        Returns a query of (city, show date, movie id, movie name, cinema id,
+        cinema name, show time, seats) rows of the shows from ``from_date``
+        up to ``to_date`` excluded, in the order src/timetable.py stores
+        them. Rows are streamed from the server in batches.
+        """
+        shows = db.session.query(Cinema.city, cls.show_date, cls.movie_id,
+                                 Movie.name, cls.cinema_id, Cinema.name,
+                                 cls.show_times, cls.no_of_seats).join(
+                                     Cinema, cls.cinema_id == Cinema.id).join(
+                                         Movie, cls.movie_id == Movie.id)
+        shows = shows.filter(cls.show_date >= from_date,
+                             cls.show_date < to_date)
+        if city_id:
+            shows = shows.filter(Cinema.city == city_id)
+        return shows.order_by(Cinema.city, cls.show_date, cls.movie_id,
+                              Cinema.name, cls.show_times).yield_per(10000)
+
 
 class Movie(db.Model):
     """
     Model form movie details
     """
     __tablename__ = "movies"
+    __table_args__ = (db.Index('ix_movies_name_trgm',
+                               'name',
+                               postgresql_using='gin',
+                               postgresql_ops={'name': 'gin_trgm_ops'}), )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(120), nullable=False)
@@ -74,21 +199,109 @@ class Movie(db.Model):
                               secondary='shows',
                               back_populates="movies")
 
+    @classmethod
+    def playing_in_city(cls, city_id, show_date=None, after=None, limit=None):
+        """
+        Returns a query of (id, name) rows of the distinct movies with shows
+        in any cinema of the city, ordered by id. ``after`` and
+        ``limit`` page through the result by movie id (keyset pagination).
+        """
+        movies = db.session.query(cls.id, cls.name).join(
+            Show, Show.movie_id == cls.id).join(
+                Cinema,
+                Show.cinema_id == Cinema.id).filter(Cinema.city == city_id)
+        if show_date:
+            movies = movies.filter(Show.show_date == show_date)
+        if after:
+            movies = movies.filter(cls.id > after)
+        movies = movies.distinct().order_by(cls.id)
+        if limit:
+            movies = movies.limit(limit)
+        return movies
+
+    @classmethod
+    def search(cls, term, city_id=None, limit=10):
+        """
+        Fuzzy name search, optionally only movies with shows in the city.
+        """
+        criteria = []
+        if city_id:
+            criteria.append(
+                cls.id.in_(
+                    db.session.query(Show.movie_id).join(
+                        Cinema, Show.cinema_id == Cinema.id).filter(
+                            Cinema.city == city_id)))
+        return name_search(cls, term, limit, *criteria)
+
 
 class Cinema(db.Model):
     """
     Model for cinemas
     """
     __tablename__ = "cinemas"
+    __table_args__ = (
+        db.Index('ix_cinemas_city', 'city', 'id'),
+        db.Index('ix_cinemas_name_trgm',
+                 'name',
+                 postgresql_using='gin',
+                 postgresql_ops={'name': 'gin_trgm_ops'}),
+        db.Index('ix_cinemas_location', 'latitude', 'longitude'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(120), nullable=False)
     show_times = db.Column(ARRAY(db.String(8)))
     city = db.Column(db.Integer, db.ForeignKey('cities.id'), nullable=False)
+    latitude = db.Column(db.Float)
+    longitude = db.Column(db.Float)
     movies = db.relationship("Movie",
                              secondary='shows',
                              back_populates="cinemas")
 
+    @classmethod
+    def distance_km(cls, lat, lon):
+        """
+        SQL haversine distance in km between the cinema and the point.
+        """
+        func = db.func
+        a = (func.power(func.sin(func.radians(cls.latitude - lat) / 2), 2) +
+             func.cos(func.radians(lat)) * func.cos(func.radians(
+                 cls.latitude)) *
+             func.power(func.sin(func.radians(cls.longitude - lon) / 2), 2))
+        return 2 * EARTH_RADIUS_KM * func.asin(func.least(1, func.sqrt(a)))
+
+    @classmethod
+    def within(cls, lat, lon, radius):
+        """
+        Filter conditions for cinemas within ``radius`` km of the point:
+        a bounding box on the indexed columns and the exact distance.
+        """
+        min_lat, max_lat, min_lon, max_lon = bounding_box(lat, lon, radius)
+        return (cls.latitude.between(min_lat, max_lat),
+                cls.longitude.between(min_lon, max_lon),
+                cls.distance_km(lat, lon) <= radius)
+
+    @classmethod
+    def nearest(cls, lat, lon, radius, city_id=None, limit=10):
+        """
+        Returns a query of (id, name, distance) rows of the cinemas within
+        ``radius`` km of the point, nearest first.
+        """
+        distance = cls.distance_km(lat, lon)
+        cinemas = db.session.query(cls.id, cls.name, distance).filter(
+            *cls.within(lat, lon, radius))
+        if city_id:
+            cinemas = cinemas.filter(cls.city == city_id)
+        return cinemas.order_by(distance).limit(limit)
+
+    @classmethod
+    def search(cls, term, city_id=None, limit=10):
+        """
+        Fuzzy name search, optionally only cinemas of the city.
+        """
+        criteria = [cls.city == city_id] if city_id else []
+        return name_search(cls, term, limit, *criteria)
+
 
 class Ticket(db.Model):
     """
@@ -108,6 +321,7 @@ class Ticket(db.Model):
                                  nullable=False,
                                  default=datetime.utcnow)
     user = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    seats = db.Column(BIT(varying=True))
 
     def pre_commit_setup(self):
         """
@@ -115,3 +329,85 @@ class Ticket(db.Model):
         """
 
         self.transaction_id = uuid.uuid1()
+
+    @classmethod
+    def history(cls, user_id, before=None, limit=20):
+        """
+        Returns a query of a user's tickets, newest first, with the movie
+        and cinema names resolved in the same statement. ``before`` is the
+        (transaction date, id) of the last ticket of the previous page.
+        """
+        tickets = db.session.query(
+            cls.id, cls.transaction_id, Movie.name.label('movie'),
+            Cinema.name.label('cinema'), cls.show_time, cls.ticket_date,
+            cls.no_of_seats,
+            cls.transaction_date).join(Movie, cls.movie == Movie.id).join(
+                Cinema, cls.cinema == Cinema.id).filter(cls.user == user_id)
+        if before:
+            tickets = tickets.filter(
+                db.tuple_(cls.transaction_date, cls.id) < db.tuple_(*before))
+        return tickets.order_by(cls.transaction_date.desc(),
+                                cls.id.desc()).limit(limit)
+
+
+# booking history pages through a user's tickets newest first
+db.Index('ix_tickets_user_transaction_date', Ticket.user,
+         Ticket.transaction_date.desc(), Ticket.id.desc())
+
+
+class SeatHold(db.Model):
+    """
+    Model for seats held on a show while the user pays
+    """
+
+    __tablename__ = "seat_holds"
+
+    id = db.Column(db.Integer, primary_key=True)
+    movie_id = db.Column(db.Integer, nullable=False)
+    cinema_id = db.Column(db.Integer, nullable=False)
+    show_times = db.Column(db.String(8), nullable=False)
+    show_date = db.Column(db.Date, nullable=False)
+    user = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    seats = db.Column(BIT(varying=True), nullable=False)
+    no_of_seats = db.Column(db.Integer, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+
+class MovieRun(db.Model):
+    """
+    Model for a movie playing in a cinema over a date range. Shows are
+    materialized from it for every slot in the cinema's show times.
+    """
+
+    __tablename__ = "movie_runs"
+
+    id = db.Column(db.Integer, primary_key=True)
+    movie_id = db.Column(db.Integer,
+                         db.ForeignKey('movies.id'),
+                         nullable=False)
+    cinema_id = db.Column(db.Integer,
+                          db.ForeignKey('cinemas.id'),
+                          nullable=False)
+    start_date = db.Column(db.Date, nullable=False)
+    end_date = db.Column(db.Date)
+    no_of_seats = db.Column(db.Integer, nullable=False)
+    # last date shows were created for
+    materialized_until = db.Column(db.Date)
+
+
+class IdempotencyKey(db.Model):
+    """
+    Model for the outcome of a request sent with an Idempotency-Key
+    """
+
+    __tablename__ = "idempotency_keys"
+
+    user = db.Column(db.Integer,
+                     db.ForeignKey('users.id'),
+                     primary_key=True)
+    key = db.Column(db.String(64), primary_key=True)
+    request_hash = db.Column(db.String(64), nullable=False)
+    # both empty while the request is still running
+    status_code = db.Column(db.SmallInteger)
+    response = db.Column(JSONB)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
@@ -1,58 +1,83 @@
 """
 File where we create API resources
 """
-import traceback
+import uuid
 from datetime import datetime
 
-from flask import request
+from flask import Response, request, current_app
 from flask_jwt_extended import (create_refresh_token,
                                 jwt_refresh_token_required, get_jwt_identity)
-from flask_restful import Resource, reqparse
+from flask_restful import Resource
 from sqlalchemy.exc import IntegrityError
 
-from src.main import logger, db
-from src.models import User, City, Movie, Cinema, Show, Ticket
-from src.schemas import CitySchema, MovieSchema
+from src.main import (logger, db, cache, read_replica, seat_events,
+                      booking_queue, autocomplete, cinema_grid, timetable,
+                      wsgi_seat_streams)
+from src.admission import (NO_SHOW, SOLD_OUT, Booking, QueueFull,
+                           QueueTimeout)
+from src.cache import show_tag
+from src.events import (HEARTBEAT, Subscription, TooManySubscribers,
+                        format_event)
+from src.hashing import HashingBusy
+from src.idempotency import idempotent
+from src.logs import SUCCESS
+from src.models import User, City, Movie, Show, Ticket, Cinema
+from src.schemas import (serialize_cities, serialize_movies, serialize_shows,
+                         serialize_tickets, serialize_cinemas,
+                         serialize_suggestions, serialize_nearby_cinemas,
+                         encode_cursor)
+from src.timetable import covers_show_query
+from src import seats, validators
+
+# returned when the hashing pool, a booking queue or the streams are full
+SERVER_BUSY = ({
+    "data": {
+        "error_message": "Server is busy. Try again later."
+    }
+}, 503, {
+    "Retry-After": "1"
+})
 
 
 class UserLogin(Resource):
     """
     Restful resource for logging in user
     """
-
-    parser = reqparse.RequestParser()
-
     def post(self):
-
-        # adding arguments to data parser for required
-        # fields
-        self.parser.add_argument('phone_number',
-                                 help='Phone number cannot be blank',
-                                 required=True)
-        self.parser.add_argument('password',
-                                 help='Password cannot be blank',
-                                 required=True)
-
-        data = self.parser.parse_args(strict=True)
+        data = validators.parse(validators.user_credentials)
 
         user = User.query.filter_by(phone_number=data["phone_number"]).first()
 
         if not user:
             logger.info(
-                "request from {0} to {1} failed because of wrong phone number/"
-                "unregistered number ({2}) is entered.".format(
-                    request.remote_addr, request.path, data["phone_number"]))
+                "request from %s to %s failed because of wrong phone number/"
+                "unregistered number (%s) is entered.", request.remote_addr,
+                request.path, data["phone_number"])
             return {
                 'message':
                 'Please check your phone number {0}/ If not registered, '
                 'kindly register with us.'.format(data["phone_number"])
             }, 401
 
-        if user.check_password(data["password"], user.password):
+        try:
+            password_matches = user.check_password(data["password"],
+                                                   user.password)
+        except HashingBusy:
+            return SERVER_BUSY
+        if password_matches:
+            if user.needs_rehash():
+                try:
+                    user.password = data["password"]
+                    user.pre_commit_setup()
+                except HashingBusy:
+                    # keep the old hash, it is upgraded on a later login
+                    db.session.rollback()
             logger.info(
-                "request from {0} for user login request is successful for "
-                "phone number {1}".format(request.remote_addr,
-                                          data["phone_number"]))
+                "request from %s for user login request is successful for "
+                "phone number %s",
+                request.remote_addr,
+                data["phone_number"],
+                extra=SUCCESS)
             db.session.commit()
             refresh_token = create_refresh_token({
                 "id": user.id,
@@ -63,9 +88,9 @@ class UserLogin(Resource):
             }, 200
         else:
             logger.info(
-                "request from {0} for user login request is failed for "
-                "phone number {1} because of wrong password.".format(
-                    request.remote_addr, data["phone_number"]))
+                "request from %s for user login request is failed for "
+                "phone number %s because of wrong password.",
+                request.remote_addr, data["phone_number"])
             return {'message': 'Kindly check your password.'}, 404
 
 
@@ -73,19 +98,8 @@ class UserResource(Resource):
     """
     Resource for creating user
     """
-
-    parser = reqparse.RequestParser()
-
     def post(self):
-
-        self.parser.add_argument('phone_number',
-                                 help='Phone number cannot be blank',
-                                 required=True)
-        self.parser.add_argument('password',
-                                 help='Password cannot be blank',
-                                 required=True)
-
-        data = self.parser.parse_args(strict=True)
+        data = validators.parse(validators.user_credentials)
 
         user = User.query.filter_by(phone_number=data["phone_number"]).first()
 
@@ -97,7 +111,10 @@ class UserResource(Resource):
             }, 409
         else:
             new_user = User(**data)
-            new_user.pre_commit_setup()
+            try:
+                new_user.pre_commit_setup()
+            except HashingBusy:
+                return SERVER_BUSY
             try:
                 db.session.add(new_user)
                 db.session.commit()
@@ -115,88 +132,218 @@ class UserResource(Resource):
             }, 201
 
 
+class UserTicketsResource(Resource):
+    """
+    Resource for a user's booking history
+    """
+    @jwt_refresh_token_required
+    def get(self):
+        data = validators.parse(validators.ticket_history_query,
+                                location='args')
+        tickets = Ticket.history(get_jwt_identity()["id"],
+                                 before=data["cursor"],
+                                 limit=data["limit"]).all()
+        next_cursor = None
+        if len(tickets) == data["limit"]:
+            next_cursor = encode_cursor(tickets[-1].transaction_date,
+                                        tickets[-1].id)
+        return {"data": serialize_tickets(tickets), "next": next_cursor}, 200
+
+
 class CityResource(Resource):
     """
     Resource for city
     """
+    method_decorators = [read_replica]
+
+    @cache.cached('cities')
     def get(self):
 
         try:
-            cities = City.query.all()
-            city_schema = CitySchema(many=True)
-            return {"data": city_schema.dump(cities)}, 200
+            cities = db.session.query(City.id, City.city_name).order_by(
+                City.id)
+            return {"data": serialize_cities(cities)}, 200
         except Exception:
-            logger.error(
-                f"Error while querying cities {traceback.format_exc()}")
+            logger.exception("Error while querying cities")
 
 
 class MovieResource(Resource):
     """
     Resource for Movie
     """
+    method_decorators = [read_replica]
 
-    parser = reqparse.RequestParser()
-
+    @cache.cached('cities', 'cinemas', 'movies', 'shows')
     def get(self):
-        self.parser.add_argument('city_id', location='args')
-        data = self.parser.parse_args()
-
-        city = City.query.filter_by(id=data['city_id']).first()
-        movies = city.movies
-        movie_schema = MovieSchema(many=True)
-        return {"data": movie_schema.dump(movies)}, 200
+        data = validators.parse(validators.movie_query, location='args')
+
+        movies = None
+        if data['show_date']:
+            movies = timetable.movies(data['city_id'],
+                                      data['show_date'],
+                                      after=data['after'],
+                                      limit=data['limit'],
+                                      load=Show.timetable)
+        if movies is None:
+            movies = Movie.playing_in_city(data['city_id'],
+                                           show_date=data['show_date'],
+                                           after=data['after'],
+                                           limit=data['limit']).all()
+        next_cursor = None
+        if data['limit'] and len(movies) == data['limit']:
+            next_cursor = movies[-1][0]
+        return {"data": serialize_movies(movies), "next": next_cursor}, 200
 
 
 class ShowResource(Resource):
     """
     Resource for Cinema
     """
-    parser = reqparse.RequestParser()
+    method_decorators = [read_replica]
+
+    @cache.cached('cinemas', 'shows', 'shows:{movie_id}')
+    def get(self):
+        data = validators.parse(validators.show_query, location='args')
+        shows = None
+        if covers_show_query(data):
+            shows = timetable.schedule(data['movie_id'],
+                                       data['show_date'],
+                                       cinema_id=data['cinema_id'],
+                                       show_time=data['show_time'],
+                                       load=Show.timetable)
+        if shows is None:
+            shows = Show.schedule(**data)
+        return {"data": serialize_shows(shows)}, 200
+
+
+class SearchResource(Resource):
+    """
+    Resource for fuzzy searching movies and cinemas by name
+    """
+    method_decorators = [read_replica]
+
+    @cache.cached('cinemas', 'movies', 'shows')
+    def get(self):
+        data = validators.parse(validators.search_query, location='args')
+        return {
+            "data": {
+                "movies":
+                serialize_movies(
+                    Movie.search(data['q'], data['city_id'], data['limit'])),
+                "cinemas":
+                serialize_cinemas(
+                    Cinema.search(data['q'], data['city_id'], data['limit']))
+            }
+        }, 200
+
+
+def city_names(city_id):
+    """
+    Returns the (kind, id, name) entries autocompleted for a city: the
+    movies playing there and its cinemas.
+    """
+    movies = Movie.playing_in_city(city_id).all()
+    cinemas = db.session.query(Cinema.id,
+                               Cinema.name).filter(Cinema.city == city_id)
+    return ([("movie", movie_id, name) for movie_id, name in movies] +
+            [("cinema", cinema_id, name) for cinema_id, name in cinemas])
+
+
+class AutocompleteResource(Resource):
+    """
+    Resource for completing movie and cinema names of a city, answered
+    from an in-process prefix index
+    """
+    method_decorators = [read_replica]
+
+    def get(self):
+        data = validators.parse(validators.autocomplete_query,
+                                location='args')
+        index = autocomplete.get(data['city_id'], city_names)
+        suggestions = index.search(data['q'], data['limit'])
+        return {"data": serialize_suggestions(suggestions)}, 200
+
+
+def city_locations(city_id):
+    """
+    Returns the (id, latitude, longitude, name) rows of a city's cinemas.
+    """
+    return db.session.query(Cinema.id, Cinema.latitude, Cinema.longitude,
+                            Cinema.name).filter(Cinema.city == city_id).all()
+
 
+class NearbyCinemasResource(Resource):
+    """
+    Resource for the cinemas of a city nearest to a point, answered from an
+    in-process grid index, or by the database while another request builds
+    the city's first grid
+    """
+    method_decorators = [read_replica]
+
+    def get(self):
+        data = validators.parse(validators.nearby_cinemas_query,
+                                location='args')
+        grid = cinema_grid.get(data['city_id'], city_locations, wait=False)
+        if grid is None:
+            cinemas = Cinema.nearest(data['lat'], data['lon'],
+                                     data['radius'], data['city_id'],
+                                     data['limit'])
+        else:
+            cinemas = ((cinema[0], cinema[3], distance)
+                       for distance, cinema in grid.nearby(
+                           data['lat'], data['lon'], data['radius'],
+                           data['limit']))
+        return {
+            "data":
+            serialize_nearby_cinemas((cinema_id, name, round(distance, 2))
+                                     for cinema_id, name, distance in cinemas)
+        }, 200
+
+
+class SeatStreamResource(Resource):
+    """
+    Server-Sent Events stream of seat availability changes of a cinema.
+    An open stream holds a server thread, so only
+    SEAT_STREAM_WSGI_MAX_SUBSCRIBERS are served here; the ASGI mode serves
+    the route natively.
+    """
     def get(self):
-        self.parser.add_argument('movie_id', location='args')
-        self.parser.add_argument('cinema_id', location='args')
-        self.parser.add_argument('show_time', location='args')
-        self.parser.add_argument('show_date', location='args')
-
-        data = self.parser.parse_args()
-        shows = Show.query.join(Movie).join(Cinema).filter(
-            Show.movie_id == data['movie_id'])
-
-        if data["cinema_id"]:
-            shows = shows.filter(Show.cinema_id == data["cinema_id"])
-        if data["show_time"]:
-            shows = shows.filter(Show.show_times == data["show_time"])
-        if data["show_date"]:
-            show_date = datetime.strptime(data["show_date"], "%d-%m-%Y").date()
-            shows = shows.filter(Show.show_date == show_date)
-        shows = shows.all()
-        response = {}
-        for show in shows:
-            if show.cinema.name in response:
-                response[show.cinema.name]["show_times"].append({
-                    "show_time":
-                    show.show_times,
-                    "available_seats":
-                    show.no_of_seats,
-                    "show_date":
-                    show.show_date.strftime("%d-%m-%Y")
-                })
-
-            else:
-                response[show.cinema.name] = {
-                    "cinema":
-                    show.cinema.name,
-                    "show_times": [{
-                        "show_time":
-                        show.show_times,
-                        "available_seats":
-                        show.no_of_seats,
-                        "show_date":
-                        show.show_date.strftime("%d-%m-%Y")
-                    }]
+        data = validators.parse(validators.seat_stream_query, location='args')
+        if not current_app.config['SEAT_STREAM_WSGI_MAX_SUBSCRIBERS']:
+            return {
+                "data": {
+                    "error_message":
+                    "Seat streams are only served in ASGI mode"
                 }
-        return {"data": list(response.values())}, 200
+            }, 503
+        if not wsgi_seat_streams.acquire(blocking=False):
+            return SERVER_BUSY
+        try:
+            subscription = seat_events.subscribe(Subscription(**data))
+        except TooManySubscribers:
+            wsgi_seat_streams.release()
+            return SERVER_BUSY
+        heartbeat = current_app.config['SEAT_STREAM_HEARTBEAT']
+
+        def stream():
+            while True:
+                events = subscription.wait(heartbeat)
+                yield "".join(map(format_event, events)) or HEARTBEAT
+
+        def close():
+            seat_events.unsubscribe(subscription)
+            wsgi_seat_streams.release()
+
+        response = Response(stream(),
+                            mimetype='text/event-stream',
+                            headers={
+                                'Cache-Control': 'no-cache',
+                                'X-Accel-Buffering': 'no'
+                            })
+        # called by the server when the client is gone, even if the stream
+        # never started
+        response.call_on_close(close)
+        return response
 
 
 class TicketResource(Resource):
@@ -204,78 +351,217 @@ class TicketResource(Resource):
     Resource for tickets
     """
 
-    parser = reqparse.RequestParser()
-
     @jwt_refresh_token_required
+    @idempotent
     def post(self):
-        self.parser.add_argument('movie_id',
-                                 required=True,
-                                 help='movie id is mandatory',
-                                 location='json',
-                                 dest='movie')
-        self.parser.add_argument('cinema_id',
-                                 required=True,
-                                 help='cinema id is mandatory',
-                                 location='json',
-                                 dest='cinema')
-        self.parser.add_argument('show_time',
-                                 required=True,
-                                 help='show time is mandatory',
-                                 location='json')
-        self.parser.add_argument('no_of_seats',
-                                 required=True,
-                                 type=int,
-                                 help='number of tickets is mandatory',
-                                 location='json')
-        self.parser.add_argument('ticket_date',
-                                 required=True,
-                                 help='Ticket date is mandatory',
-                                 location='json')
-
-        data = self.parser.parse_args(strict=True)
-        data["user"] = get_jwt_identity()["id"]
-        data["ticket_date"] = datetime.strptime(data["ticket_date"],
-                                                "%d-%m-%Y")
-        show = Show.query.filter_by(movie_id=data["movie"],
-                                    cinema_id=data["cinema"],
-                                    show_times=data["show_time"],
-                                    show_date=data["ticket_date"]).first()
-        if not show:
+        data = validators.parse(validators.ticket)
+        key = (data["movie"], data["cinema"], data["show_time"],
+               data["ticket_date"])
+        booking = Booking(get_jwt_identity()["id"], data["no_of_seats"])
+        try:
+            # bookings of the same show are booked in batches, one row lock
+            # and one commit per batch, see src/admission.py
+            status, transaction_id = booking_queue.submit(
+                key, booking, seats.book_batch)
+        except QueueFull as err:
+            return {
+                "data": {
+                    "error_message": "Server is busy. Try again later.",
+                    "queue_depth": err.depth,
+                    "estimated_wait": round(err.estimated_wait, 3)
+                }
+            }, 503, {
+                "Retry-After": str(max(1, round(err.estimated_wait)))
+            }
+        except QueueTimeout:
+            return SERVER_BUSY
+        except Exception:
+            logger.exception("Error while booking tickets")
+            return {
+                "data": {
+                    "error_message":
+                    "Unexpected error occurred. Try again later."
+                }
+            }, 500
+        if status == NO_SHOW:
             return {
                 "data": {
                     "error_message":
                     "No show available for selected Movie/Cinema/Date"
                 }
             }, 404
-        else:
-            if not show.no_of_seats >= data["no_of_seats"]:
-                return {
-                    "data": {
-                        "error_message":
-                        "No tickets are available for selected data"
-                    }
-                }, 404
-            else:
-                try:
-                    show.no_of_tickets = show.no_of_seats - data["no_of_seats"]
-                    db.session.commit()
-                    ticket = Ticket(**data)
-                    ticket.pre_commit_setup()
-                    db.session.add(ticket)
-                    db.session.commit()
-                    return {
-                        "data": {
-                            "success_message": "Ticket booked successfully"
-                        }
-                    }
-                except Exception:
+        if status == SOLD_OUT:
+            return {
+                "data": {
+                    "error_message":
+                    "No tickets are available for selected data"
+                }
+            }, 404
+        cache.invalidate(show_tag(data["movie"]))
+        return {
+            "data": {
+                "success_message": "Ticket booked successfully"
+            }
+        }, 200, {
+            "X-Queue-Position": str(booking.position)
+        }
+
+
+class BulkTicketResource(Resource):
+    """
+    Resource for booking tickets of several shows in one transaction
+    """
+    @jwt_refresh_token_required
+    @idempotent
+    def post(self):
+        data = validators.parse(validators.bulk_tickets)
+        user = get_jwt_identity()["id"]
+        requested = {}
+        for item in data["tickets"]:
+            key = (item["movie"], item["cinema"], item["show_time"],
+                   item["ticket_date"])
+            requested[key] = requested.get(key, 0) + item["no_of_seats"]
+        try:
+            # shows are always decremented in key order, so concurrent bulk
+            # bookings lock rows in the same order and cannot deadlock.
+            for key in sorted(requested):
+                if Show.reserve_seats(*key, requested[key]) is None:
                     db.session.rollback()
-                    logger.error(
-                        f"Error while booking tickets {traceback.format_exc()}"
-                    )
+                    movie, cinema, show_time, ticket_date = key
                     return {
                         "data": {
                             "error_message":
-                            "Unexpected error occurred. Try again later."
+                            "No tickets are available for selected data",
+                            "movie_id": movie,
+                            "cinema_id": cinema,
+                            "show_time": show_time,
+                            "ticket_date": ticket_date.strftime("%d-%m-%Y")
                         }
+                    }, 404
+            transaction_date = datetime.utcnow().date()
+            tickets = [
+                dict(item,
+                     user=user,
+                     transaction_id=str(uuid.uuid1()),
+                     transaction_date=transaction_date)
+                for item in data["tickets"]
+            ]
+            db.session.execute(Ticket.__table__.insert().values(tickets))
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            logger.exception("Error while booking tickets")
+            return {
+                "data": {
+                    "error_message":
+                    "Unexpected error occurred. Try again later."
+                }
+            }, 500
+        cache.invalidate(*{show_tag(movie) for movie, _, _, _ in requested})
+        return {
+            "data": {
+                "success_message": "Tickets booked successfully",
+                "transaction_ids":
+                [ticket["transaction_id"] for ticket in tickets]
+            }
+        }, 201
+
+
+class SeatHoldResource(Resource):
+    """
+    Resource for holding and releasing seats of a show
+    """
+
+    @jwt_refresh_token_required
+    def post(self):
+        data = validators.parse(validators.seat_hold)
+        try:
+            hold = seats.hold_seats(data["movie_id"], data["cinema_id"],
+                                    data["show_time"], data["ticket_date"],
+                                    data["seats"],
+                                    get_jwt_identity()["id"],
+                                    current_app.config['SEAT_HOLD_TTL'])
+            if not hold:
+                db.session.rollback()
+                return {
+                    "data": {
+                        "error_message":
+                        "Selected seats are not available for selected show"
                     }
+                }, 409
+            db.session.commit()
+            cache.invalidate(show_tag(data["movie_id"]))
+            return {
+                "data": {
+                    "hold_id": hold.id,
+                    "expires_at": hold.expires_at.isoformat(),
+                    "available_seats": hold.no_of_seats
+                }
+            }, 201
+        except seats.SeatOutOfRange as err:
+            db.session.rollback()
+            return {
+                "data": {
+                    "error_message":
+                    "Seat numbers must be below {0}".format(err.width)
+                }
+            }, 400
+        except Exception:
+            db.session.rollback()
+            logger.exception("Error while holding seats")
+            return {
+                "data": {
+                    "error_message":
+                    "Unexpected error occurred. Try again later."
+                }
+            }, 500
+
+    @jwt_refresh_token_required
+    def delete(self):
+        data = validators.parse(validators.hold, location='args')
+        show = seats.release_hold(data["hold_id"], get_jwt_identity()["id"])
+        db.session.commit()
+        if not show:
+            return {"data": {"error_message": "Seat hold not found"}}, 404
+        cache.invalidate(show_tag(show.movie_id))
+        return {
+            "data": {
+                "success_message": "Seats released successfully",
+                "available_seats": show.no_of_seats
+            }
+        }, 200
+
+
+class SeatHoldConfirmResource(Resource):
+    """
+    Resource for booking held seats
+    """
+    @jwt_refresh_token_required
+    def post(self):
+        data = validators.parse(validators.hold)
+        try:
+            ticket = seats.confirm_hold(data["hold_id"],
+                                        get_jwt_identity()["id"])
+            if not ticket:
+                db.session.rollback()
+                return {
+                    "data": {
+                        "error_message": "Seat hold not found or expired"
+                    }
+                }, 404
+            db.session.commit()
+            return {
+                "data": {
+                    "success_message": "Ticket booked successfully",
+                    "transaction_id": ticket.transaction_id
+                }
+            }, 201
+        except Exception:
+            db.session.rollback()
+            logger.exception("Error while booking held seats")
+            return {
+                "data": {
+                    "error_message":
+                    "Unexpected error occurred. Try again later."
+                }
+            }, 500
@@ -0,0 +1,70 @@
+"""
+Rolling show materialization.
+
+Shows are created ahead of time from ``movie_runs`` for every slot in the
+cinema's ``show_times``. Each run remembers the last date it was
+materialized for, so a nightly run only inserts the new days, and every
+batch of runs is committed on its own so an interrupted job resumes where
+it stopped.
+"""
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+from src.main import db
+
+MATERIALIZE_SHOWS = text("""
+    WITH due AS (
+        SELECT id, movie_id, cinema_id, no_of_seats,
+               greatest(start_date, materialized_until + 1, :today)
+                   AS from_date,
+               least(coalesce(end_date, :horizon), :horizon) AS to_date
+        FROM movie_runs
+        WHERE coalesce(materialized_until, start_date - 1)
+              < least(coalesce(end_date, :horizon), :horizon)
+        ORDER BY id
+        LIMIT :batch_size
+        FOR UPDATE SKIP LOCKED
+    ), inserted AS (
+        INSERT INTO shows (movie_id, cinema_id, show_times, show_date,
+                           no_of_seats, seat_map)
+        SELECT due.movie_id, due.cinema_id, slot.show_time, day::date,
+               due.no_of_seats, repeat('0', due.no_of_seats)::varbit
+        FROM due
+        JOIN cinemas ON cinemas.id = due.cinema_id
+        CROSS JOIN LATERAL unnest(cinemas.show_times) AS slot(show_time)
+        CROSS JOIN LATERAL generate_series(due.from_date, due.to_date,
+                                           interval '1 day') AS day
+        ON CONFLICT DO NOTHING
+        RETURNING 1
+    ), marked AS (
+        UPDATE movie_runs SET materialized_until = due.to_date
+        FROM due
+        WHERE movie_runs.id = due.id
+        RETURNING 1
+    )
+    SELECT (SELECT count(*) FROM marked) AS runs,
+           (SELECT count(*) FROM inserted) AS shows
+""")
+
+
+def materialize_shows(days, batch_size=500, today=None):
+    """
+    Creates the missing shows up to ``days`` days ahead of ``today`` and
+    returns (runs processed, shows created). Existing shows are never
+    touched and past days are never created.
+    """
+    today = today or datetime.utcnow().date()
+    params = {
+        "today": today,
+        "horizon": today + timedelta(days=days),
+        "batch_size": batch_size
+    }
+    runs = shows = 0
+    while True:
+        batch = db.session.execute(MATERIALIZE_SHOWS, params).first()
+        db.session.commit()
+        if not batch.runs:
+            return runs, shows
+        runs += batch.runs
+        shows += batch.shows
@@ -1,3 +1,5 @@
+import base64
+
 from src.models import City, Cinema, Movie, Show
 from src.main import ma
 
@@ -32,3 +34,67 @@ class ShowSchema(ma.SQLAlchemySchema):
 
     cinema_id = ma.Nested(CinemaSchema())
     show_times = ma.auto_field()
+
+
+def row_serializer(*fields):
+    """
+    Returns a function turning query result rows into dicts keyed by
+    ``fields``. Used by hot endpoints which select only the columns they
+    return, where a marshmallow dump per object is too slow.
+    """
+    def serialize(rows):
+        return [dict(zip(fields, row)) for row in rows]
+
+    return serialize
+
+
+serialize_cities = row_serializer('id', 'city_name')
+serialize_movies = row_serializer('id', 'name')
+serialize_cinemas = row_serializer('id', 'name')
+serialize_suggestions = row_serializer('type', 'id', 'name')
+serialize_nearby_cinemas = row_serializer('id', 'name', 'distance_km')
+
+
+def serialize_shows(rows):
+    """
+    Groups (cinema name, show time, show date, seats) rows by cinema. Each
+    distinct date is formatted once. Rows of a location filtered schedule
+    end with the cinema's distance, which is added to its cinema.
+    """
+    response = {}
+    show_dates = {}
+    for cinema, show_time, show_date, available_seats, *distance in rows:
+        if show_date not in show_dates:
+            show_dates[show_date] = show_date.strftime("%d-%m-%Y")
+        show = {
+            "show_time": show_time,
+            "available_seats": available_seats,
+            "show_date": show_dates[show_date]
+        }
+        if cinema in response:
+            response[cinema]["show_times"].append(show)
+        else:
+            response[cinema] = {"cinema": cinema, "show_times": [show]}
+            if distance:
+                response[cinema]["distance_km"] = round(distance[0], 2)
+    return list(response.values())
+
+
+def encode_cursor(transaction_date, ticket_id):
+    """
+    Opaque cursor pointing after a ticket of a user's booking history.
+    """
+    value = "{0}_{1}".format(transaction_date.isoformat(), ticket_id)
+    return base64.urlsafe_b64encode(value.encode()).decode()
+
+
+def serialize_tickets(rows):
+    return [{
+        "transaction_id": row.transaction_id,
+        "movie": row.movie,
+        "cinema": row.cinema,
+        "show_time": row.show_time,
+        "ticket_date": row.ticket_date.strftime("%d-%m-%Y"),
+        "no_of_seats": row.no_of_seats,
+        "transaction_date": row.transaction_date.strftime("%d-%m-%Y")
+    } for row in rows]
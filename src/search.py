@@ -0,0 +1,54 @@
+"""
+In-process autocomplete over the movie and cinema names of a city.
+
+Every name is stored once per word it contains, normalized, in one sorted
+array, so a prefix of any word finds it with a single bisect and a short
+scan. One index is kept per city, see ``CityIndexes`` in src/cache.py.
+"""
+import re
+from bisect import bisect_left
+
+_WORD = re.compile(r"\w+")
+
+
+def normalize(text):
+    return " ".join(_WORD.findall(text.casefold()))
+
+
+class PrefixIndex:
+    """
+    Immutable sorted-array index of (kind, id, name) entries.
+    """
+    def __init__(self, entries):
+        keyed = []
+        for entry in entries:
+            name = normalize(entry[2])
+            for word in _WORD.finditer(name):
+                keyed.append((name[word.start():], entry))
+        keyed.sort(key=lambda item: item[0])
+        self._keys = [key for key, _ in keyed]
+        self._entries = [entry for _, entry in keyed]
+
+    def __len__(self):
+        return len(self._keys)
+
+    def search(self, prefix, limit=10):
+        """
+        Returns up to ``limit`` entries with a word starting with
+        ``prefix``, ordered by the name from that word on, so the scan
+        stops after ``limit`` matches however many there are.
+        """
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        results = []
+        seen = set()
+        position = bisect_left(self._keys, prefix)
+        while (position < len(self._keys) and len(results) < limit
+               and self._keys[position].startswith(prefix)):
+            entry = self._entries[position]
+            if entry not in seen:
+                seen.add(entry)
+                results.append(entry)
+            position += 1
+        return results
@@ -0,0 +1,328 @@
+"""
+Seat level inventory for shows.
+
+Each show keeps a bit string seat map where bit ``i`` is set while seat ``i``
+is held or sold. Holding, confirming and releasing seats are each a single
+statement that ORs / ANDs a seat mask into the map, so a hold costs one
+short row update regardless of how many seats it covers. Bookings by seat
+count take the first free seats (``claim_free_seats`` in SQL), so the free
+seats of a map always match the show's seat count.
+
+``book_batch`` books several seat count bookings of one show at once for
+the admission queue of src/admission.py.
+"""
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from sqlalchemy import text
+
+from src.main import db, logger, cache
+from src.admission import BOOKED, NO_SHOW, SOLD_OUT
+from src.cache import show_tag
+from src.models import Show, Ticket
+
+HOLD_SEATS = text("""
+    WITH held AS (
+        UPDATE shows
+        SET seat_map = seat_map | rpad(:mask, length(seat_map), '0')::varbit,
+            no_of_seats = no_of_seats - :count
+        WHERE movie_id = :movie_id AND cinema_id = :cinema_id
+          AND show_times = :show_time AND show_date = :show_date
+          AND length(seat_map) >= :width AND no_of_seats >= :count
+          AND strpos((seat_map & rpad(:mask, length(seat_map), '0')::varbit)
+                     ::text, '1') = 0
+        RETURNING movie_id, cinema_id, show_times, show_date, no_of_seats,
+                  length(seat_map) AS width
+    ), hold AS (
+        INSERT INTO seat_holds (movie_id, cinema_id, show_times, show_date,
+                                "user", seats, no_of_seats, expires_at)
+        SELECT movie_id, cinema_id, show_times, show_date, :user_id,
+               rpad(:mask, width, '0')::varbit, :count,
+               now() at time zone 'utc' + :ttl * interval '1 second'
+        FROM held
+        RETURNING id, expires_at
+    )
+    SELECT hold.id, hold.expires_at, held.no_of_seats FROM hold, held
+""")
+
+CONFIRM_HOLD = text("""
+    WITH hold AS (
+        DELETE FROM seat_holds
+        WHERE id = :hold_id AND "user" = :user_id
+          AND expires_at > now() at time zone 'utc'
+        RETURNING movie_id, cinema_id, show_times, show_date, "user", seats,
+                  no_of_seats
+    )
+    INSERT INTO tickets (transaction_id, movie, cinema, show_time,
+                         no_of_seats, ticket_date, transaction_date, "user",
+                         seats)
+    SELECT :transaction_id, movie_id, cinema_id, show_times, no_of_seats,
+           show_date, :transaction_date, "user", seats
+    FROM hold
+    RETURNING transaction_id, movie, cinema, show_time, ticket_date
+""")
+
+RELEASE_HOLD = text("""
+    WITH hold AS (
+        DELETE FROM seat_holds WHERE id = :hold_id AND "user" = :user_id
+        RETURNING movie_id, cinema_id, show_times, show_date, seats,
+                  no_of_seats
+    )
+    UPDATE shows
+    SET seat_map = shows.seat_map & ~hold.seats,
+        no_of_seats = shows.no_of_seats + hold.no_of_seats
+    FROM hold
+    WHERE shows.movie_id = hold.movie_id AND shows.cinema_id = hold.cinema_id
+      AND shows.show_times = hold.show_times
+      AND shows.show_date = hold.show_date
+    RETURNING shows.movie_id, shows.cinema_id, shows.show_times,
+              shows.show_date, shows.no_of_seats
+""")
+
+# expired holds are released in bulk: the masks of every expired hold on a
+# show are OR-ed together and cleared from the seat map in one update.
+RELEASE_EXPIRED_HOLDS = text("""
+    WITH expired AS (
+        DELETE FROM seat_holds
+        WHERE id IN (
+            SELECT id FROM seat_holds
+            WHERE expires_at <= now() at time zone 'utc'
+            ORDER BY expires_at
+            LIMIT :batch_size
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING movie_id, cinema_id, show_times, show_date, seats,
+                  no_of_seats
+    ), freed AS (
+        SELECT movie_id, cinema_id, show_times, show_date,
+               bit_or(seats) AS seats, sum(no_of_seats) AS no_of_seats
+        FROM expired
+        GROUP BY movie_id, cinema_id, show_times, show_date
+    )
+    UPDATE shows
+    SET seat_map = shows.seat_map & ~freed.seats,
+        no_of_seats = shows.no_of_seats + freed.no_of_seats
+    FROM freed
+    WHERE shows.movie_id = freed.movie_id
+      AND shows.cinema_id = freed.cinema_id
+      AND shows.show_times = freed.show_times
+      AND shows.show_date = freed.show_date
+    RETURNING shows.movie_id, shows.cinema_id, shows.show_times,
+              shows.show_date, shows.no_of_seats
+""")
+
+
+SEAT_MAP_WIDTH = text("""
+    SELECT length(seat_map) FROM shows
+    WHERE movie_id = :movie_id AND cinema_id = :cinema_id
+      AND show_times = :show_time AND show_date = :show_date
+""")
+
+
+class SeatOutOfRange(Exception):
+    """
+    Raised when a seat number is not a seat of the show.
+    """
+    def __init__(self, width):
+        super().__init__(width)
+        self.width = width
+
+
+def seat_mask(seats):
+    """
+    Builds the bit string mask for the given seat numbers. The mask is as
+    wide as the highest seat number and is right padded in SQL to the width
+    of the show's seat map.
+    """
+    selected = set(seats)
+    return ''.join('1' if seat in selected else '0'
+                   for seat in range(max(selected) + 1))
+
+
+def hold_seats(movie_id, cinema_id, show_time, show_date, seats, user_id,
+               ttl):
+    """
+    Holds the given seats of a show for ``ttl`` seconds. Returns a row of
+    (hold id, expiry, remaining seats) or None when the show has no seat map
+    or any of the seats is already held or sold. Raises SeatOutOfRange for
+    a seat number beyond the show's seat map, before any mask is built.
+    """
+    show = {
+        "movie_id": movie_id,
+        "cinema_id": cinema_id,
+        "show_time": show_time,
+        "show_date": show_date
+    }
+    width = db.session.execute(SEAT_MAP_WIDTH, show).scalar()
+    if width is None:
+        return None
+    if max(seats) >= width:
+        raise SeatOutOfRange(width)
+    mask = seat_mask(seats)
+    return db.session.execute(
+        HOLD_SEATS,
+        dict(show,
+             mask=mask,
+             width=len(mask),
+             count=len(set(seats)),
+             user_id=user_id,
+             ttl=ttl)).first()
+
+
+def confirm_hold(hold_id, user_id):
+    """
+    Turns an unexpired hold into a ticket. The seats stay set in the seat
+    map and were already taken out of the seat count by the hold.
+    """
+    return db.session.execute(
+        CONFIRM_HOLD, {
+            "hold_id": hold_id,
+            "user_id": user_id,
+            "transaction_id": str(uuid.uuid1()),
+            "transaction_date": datetime.utcnow().date()
+        }).first()
+
+
+def release_hold(hold_id, user_id):
+    """
+    Releases a hold and gives its seats back to the show.
+    """
+    return db.session.execute(RELEASE_HOLD, {
+        "hold_id": hold_id,
+        "user_id": user_id
+    }).first()
+
+
+def release_expired_holds(batch_size=1000):
+    """
+    Releases up to ``batch_size`` expired holds and returns the shows whose
+    seats were given back.
+    """
+    return db.session.execute(RELEASE_EXPIRED_HOLDS, {
+        "batch_size": batch_size
+    }).fetchall()
+
+
+def sweep_expired_holds(batch_size=1000):
+    """
+    Releases expired holds batch by batch until none are left, committing
+    after each batch. Returns the number of shows updated.
+    """
+    updated = 0
+    while True:
+        shows = release_expired_holds(batch_size)
+        db.session.commit()
+        if not shows:
+            return updated
+        cache.invalidate(*{show_tag(show.movie_id) for show in shows})
+        updated += len(shows)
+
+
+def start_hold_sweeper(app, interval, batch_size=1000):
+    """
+    Starts a daemon thread which releases expired holds every ``interval``
+    seconds.
+    """
+    def sweep():
+        while True:
+            time.sleep(interval)
+            with app.app_context():
+                try:
+                    sweep_expired_holds(batch_size)
+                except Exception:
+                    db.session.rollback()
+                    logger.exception(
+                        "Error while releasing expired seat holds")
+                finally:
+                    db.session.remove()
+
+    thread = threading.Thread(target=sweep,
+                              name="seat-hold-sweeper",
+                              daemon=True)
+    thread.start()
+    return thread
+
+
+def book_batch(key, bookings):
+    """
+    Books a batch of one show's bookings in arrival order in a single
+    transaction. A booking which does not fit the remaining seats is sold
+    out, later smaller ones may still fit.
+    """
+    try:
+        return _book_batch(key, bookings)
+    except Exception:
+        db.session.rollback()
+        raise
+
+
+def _book_batch(key, bookings):
+    movie, cinema, show_time, show_date = key
+    if len(bookings) == 1:
+        # uncontended, the conditional UPDATE needs no separate lock
+        remaining = Show.reserve_seats(movie, cinema, show_time, show_date,
+                                       bookings[0].no_of_seats)
+        granted = [remaining is not None]
+        if remaining is None:
+            db.session.rollback()
+            exists = db.session.query(
+                Show.query.filter_by(movie_id=movie,
+                                     cinema_id=cinema,
+                                     show_times=show_time,
+                                     show_date=show_date).exists()).scalar()
+            return [(SOLD_OUT if exists else NO_SHOW, None)]
+    else:
+        remaining = db.session.query(Show.no_of_seats).filter_by(
+            movie_id=movie,
+            cinema_id=cinema,
+            show_times=show_time,
+            show_date=show_date).with_for_update().scalar()
+        if remaining is None:
+            db.session.rollback()
+            return [(NO_SHOW, None)] * len(bookings)
+        granted = []
+        for booking in bookings:
+            granted.append(booking.no_of_seats <= remaining)
+            if granted[-1]:
+                remaining -= booking.no_of_seats
+        if not any(granted):
+            db.session.rollback()
+            return [(SOLD_OUT, None)] * len(bookings)
+        booked = sum(booking.no_of_seats
+                     for booking, ok in zip(bookings, granted) if ok)
+        Show.query.filter_by(movie_id=movie,
+                             cinema_id=cinema,
+                             show_times=show_time,
+                             show_date=show_date).update(
+                                 {
+                                     "no_of_seats":
+                                     remaining,
+                                     "seat_map":
+                                     db.func.claim_free_seats(
+                                         Show.seat_map, booked)
+                                 },
+                                 synchronize_session=False)
+    transaction_date = datetime.utcnow().date()
+    results = []
+    tickets = []
+    for booking, booked in zip(bookings, granted):
+        if not booked:
+            results.append((SOLD_OUT, None))
+            continue
+        transaction_id = str(uuid.uuid1())
+        results.append((BOOKED, transaction_id))
+        tickets.append({
+            "transaction_id": transaction_id,
+            "movie": movie,
+            "cinema": cinema,
+            "show_time": show_time,
+            "no_of_seats": booking.no_of_seats,
+            "ticket_date": show_date,
+            "transaction_date": transaction_date,
+            "user": booking.user
+        })
+    db.session.execute(Ticket.__table__.insert().values(tickets))
+    db.session.commit()
+    return results
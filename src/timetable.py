@@ -0,0 +1,373 @@
+"""
+In-process timetable of the shows of the next few days.
+
+The shows of one city on one date are a ``DayTimetable``: four parallel
+arrays of movie id, cinema id, show time and seats, sorted by movie, plus
+the sorted distinct movie ids. Movie and cinema names and show times are
+stored once per process in the ``Timetable`` and referenced by id, so a
+show costs 14 bytes of arrays, about 14 MB per million shows plus the
+names (see benchmarks/timetable_memory.py for the comparison with ORM
+objects).
+
+The whole window is loaded on startup and reloaded every refresh interval,
+which also repairs any notification missed while the listener reconnected.
+In between, the notifications of src/events.py keep it current: a seat
+count change is written into its array in place, a schedule change marks
+the city's day to be loaded again on the next lookup. Either then evicts
+the cached listings it changed, which the catalog endpoints may have
+cached from the timetable before the notification arrived.
+"""
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta
+
+from src.cache import show_tag
+
+
+class DayTimetable:
+    """
+    Shows of a city on a date, appended in (movie id, cinema name, show
+    time) order. Only seat counts change once it is built.
+    """
+    __slots__ = ("movie_ids", "cinema_ids", "time_ids", "seats", "movies")
+
+    def __init__(self):
+        self.movie_ids = array("i")
+        self.cinema_ids = array("i")
+        self.time_ids = array("H")
+        self.seats = array("i")
+        self.movies = array("i")
+
+    def __len__(self):
+        return len(self.movie_ids)
+
+    @property
+    def nbytes(self):
+        return sum(
+            len(column) * column.itemsize
+            for column in (self.movie_ids, self.cinema_ids, self.time_ids,
+                           self.seats, self.movies))
+
+    def append(self, movie_id, cinema_id, time_id, seats):
+        if not self.movies or self.movies[-1] != movie_id:
+            self.movies.append(movie_id)
+        self.movie_ids.append(movie_id)
+        self.cinema_ids.append(cinema_id)
+        self.time_ids.append(time_id)
+        self.seats.append(seats)
+
+    def movie_rows(self, movie_id):
+        start = bisect_left(self.movie_ids, movie_id)
+        if start == len(self.movie_ids) or self.movie_ids[start] != movie_id:
+            return range(0)
+        return range(start, bisect_right(self.movie_ids, movie_id, start))
+
+    def movies_after(self, after=None, limit=None):
+        start = bisect_right(self.movies, after) if after else 0
+        return self.movies[start:start + limit if limit else None]
+
+    def set_seats(self, movie_id, cinema_id, time_id, seats):
+        """
+        Updates the seat count of a show, returns False when the day has
+        no such show.
+        """
+        for row in self.movie_rows(movie_id):
+            if (self.cinema_ids[row] == cinema_id
+                    and self.time_ids[row] == time_id):
+                self.seats[row] = seats
+                return True
+        return False
+
+
+def covers_show_query(data):
+    """
+    Whether a parsed show query asks for a single date without a date
+    range or location, which ``Timetable.schedule`` can answer.
+    """
+    return bool(data['show_date'] and not data['from_date']
+                and not data['to_date'] and data['lat'] is None)
+
+
+# the day of a city without shows on a fully loaded date
+EMPTY_DAY = DayTimetable()
+
+
+class Timetable:
+    """
+    Day timetables of every city for ``days`` days from today (UTC).
+
+    Lookups take a ``load(from_date, to_date, city_id=None)`` callable
+    returning (city id, show date, movie id, movie name, cinema id, cinema
+    name, show time, seats) rows ordered by city, date, movie id, cinema
+    name and show time. Without one, or before ``start``, a lookup never
+    touches the database and returns None for a day which is not loaded,
+    which is what the asyncio handlers use. A day loaded while nothing
+    applies the notifications would never see a change.
+    """
+    def __init__(self, days=2, refresh_interval=300, logger=None,
+                 cache=None):
+        self.days = days
+        self.refresh_interval = refresh_interval
+        self.logger = logger
+        self.cache = cache
+        self.running = False
+        self.movie_names = {}
+        self.cinema_names = {}
+        self.cinema_cities = {}
+        self.loads = 0
+        self.refreshes = 0
+        self.updates = 0
+        self.invalidations = 0
+        self._times = []
+        self._time_ids = {}
+        # date -> city id -> day, None once the day has to be loaded again
+        self._days = {}
+        # dates loaded for every city
+        self._dates = frozenset()
+        # date -> movie id -> ids of the cities with its shows that day
+        self._playing = {}
+        # (date, city id) of the notifications received during a refresh
+        self._changed = None
+        self._lock = threading.Lock()
+
+    def window(self):
+        today = datetime.utcnow().date()
+        return today, today + timedelta(days=self.days)
+
+    def _time_id(self, show_time):
+        time_id = self._time_ids.get(show_time)
+        if time_id is None:
+            with self._lock:
+                time_id = self._time_ids.get(show_time)
+                if time_id is None:
+                    time_id = len(self._times)
+                    self._times.append(show_time)
+                    self._time_ids[show_time] = time_id
+        return time_id
+
+    def _build(self, rows):
+        days = {}
+        key = day = None
+        for (city_id, show_date, movie_id, movie_name, cinema_id,
+             cinema_name, show_time, seats) in rows:
+            if isinstance(show_date, datetime):
+                show_date = show_date.date()
+            if (city_id, show_date) != key:
+                key = (city_id, show_date)
+                day = days.setdefault(show_date,
+                                      {}).setdefault(city_id, DayTimetable())
+            # names are overwritten, so renames show up after a refresh
+            self.movie_names[movie_id] = movie_name
+            self.cinema_names[cinema_id] = cinema_name
+            self.cinema_cities[cinema_id] = city_id
+            day.append(movie_id, cinema_id, self._time_id(show_time), seats)
+        return days
+
+    def refresh(self, load):
+        """
+        Loads every city's days of the window in one query, replacing the
+        loaded days.
+        """
+        started = time.monotonic()
+        start, end = self.window()
+        with self._lock:
+            self._changed = set()
+        try:
+            days = self._build(load(start, end))
+            show_date = start
+            while show_date < end:
+                days.setdefault(show_date, {})
+                show_date += timedelta(days=1)
+            playing = {}
+            for show_date, cities in days.items():
+                for city_id, day in cities.items():
+                    self._index(playing, show_date, city_id, day)
+            with self._lock:
+                # the query may have read these days before their change
+                for show_date, city_id in self._changed:
+                    if show_date in days:
+                        days[show_date][city_id] = None
+                self._days = days
+                self._playing = playing
+                self._dates = frozenset(days)
+                self.refreshes += 1
+        finally:
+            with self._lock:
+                self._changed = None
+        if self.logger:
+            self.logger.info("Loaded %s shows into the timetable in %.2fs",
+                             sum(len(day) for cities in days.values()
+                                 for day in cities.values() if day),
+                             time.monotonic() - started)
+
+    @staticmethod
+    def _index(playing, show_date, city_id, day):
+        movies = playing.setdefault(show_date, {})
+        for movie_id in day.movies:
+            movies.setdefault(movie_id, set()).add(city_id)
+
+    def _load(self, city_id, show_date, load):
+        days = self._build(
+            load(show_date, show_date + timedelta(days=1), city_id))
+        day = days.get(show_date, {}).get(city_id, EMPTY_DAY)
+        with self._lock:
+            self._days.setdefault(show_date, {})[city_id] = day
+            self._index(self._playing, show_date, city_id, day)
+            self.loads += 1
+        return day
+
+    def day(self, city_id, show_date, load=None):
+        """
+        Returns the city's DayTimetable of the date, or None when the date
+        is outside the window or the day is not loaded and ``load`` is not
+        given or the timetable is not started.
+        """
+        cities = self._days.get(show_date, {})
+        day = cities.get(city_id)
+        if day is not None:
+            return day
+        if show_date in self._dates and city_id not in cities:
+            return EMPTY_DAY
+        start, end = self.window()
+        if load is None or not self.running or not start <= show_date < end:
+            return None
+        return self._load(city_id, show_date, load)
+
+    def movies(self, city_id, show_date, after=None, limit=None, load=None):
+        """
+        Returns (id, name) pairs of the movies playing in the city on the
+        date, like ``Movie.playing_in_city``, or None when the day is not
+        available.
+        """
+        day = self.day(city_id, show_date, load)
+        if day is None:
+            return None
+        return [(movie_id, self.movie_names[movie_id])
+                for movie_id in day.movies_after(after, limit)]
+
+    def schedule(self, movie_id, show_date, cinema_id=None, show_time=None,
+                 load=None):
+        """
+        Returns the (cinema name, show time, show date, seats) rows of a
+        movie on a date, like ``Show.schedule``, or None when the date is
+        not loaded for every city.
+        """
+        if show_date not in self._dates:
+            return None
+        cities = self._days.get(show_date, {})
+        for city_id, day in list(cities.items()):
+            # a day changed by an insert may add the movie to its city
+            if day is None and self.day(city_id, show_date, load) is None:
+                return None
+        if cinema_id:
+            city_ids = [self.cinema_cities.get(cinema_id)]
+        else:
+            city_ids = list(
+                self._playing.get(show_date, {}).get(movie_id, ()))
+        rows = []
+        times = self._times
+        cinema_names = self.cinema_names
+        for city_id in city_ids:
+            day = cities.get(city_id)
+            if day is None:
+                continue
+            for row in day.movie_rows(movie_id):
+                if cinema_id and day.cinema_ids[row] != cinema_id:
+                    continue
+                time_value = times[day.time_ids[row]]
+                if show_time and time_value != show_time:
+                    continue
+                rows.append((cinema_names[day.cinema_ids[row]], time_value,
+                             show_date, day.seats[row]))
+        rows.sort(key=lambda row: (row[0], row[1]))
+        return rows
+
+    def apply(self, event):
+        """
+        Applies a notification of src/events.py to the loaded days and
+        then evicts the cached listings built from them.
+        """
+        if event.get("op") == "CATALOG":
+            # renamed movies and cinemas show up after the next refresh
+            return
+        # a seat count change, schedule changes come with an op and city
+        seats_changed = "op" not in event
+        self._apply(event, seats_changed)
+        if self.cache is not None:
+            if seats_changed:
+                self.cache.invalidate(show_tag(event["movie_id"]))
+            else:
+                self.cache.invalidate('shows', 'movies')
+
+    def _apply(self, event, seats_changed):
+        show_date = datetime.strptime(event["show_date"], "%d-%m-%Y").date()
+        if seats_changed:
+            city_id = self.cinema_cities.get(event["cinema_id"])
+            if city_id is None:
+                # a cinema whose shows are not loaded, its schedule change
+                # says where
+                return
+        else:
+            city_id = event["city_id"]
+        with self._lock:
+            if self._changed is not None:
+                self._changed.add((show_date, city_id))
+        cities = self._days.get(show_date)
+        if cities is None:
+            return
+        day = cities.get(city_id)
+        if seats_changed:
+            time_id = self._time_ids.get(event["show_time"])
+            if (day is not None and time_id is not None
+                    and day.set_seats(event["movie_id"], event["cinema_id"],
+                                      time_id, event["available_seats"])):
+                with self._lock:
+                    self.updates += 1
+                return
+        with self._lock:
+            cities[city_id] = None
+            self.invalidations += 1
+
+    def start(self, app, load, events):
+        """
+        Starts a daemon thread which loads the timetable and reloads it
+        every refresh interval, and applies the notifications of the
+        ``events`` hub from then on.
+        """
+        def refresh():
+            while True:
+                with app.app_context():
+                    try:
+                        self.refresh(load)
+                    except Exception:
+                        if self.logger:
+                            self.logger.exception(
+                                "Error while loading the timetable")
+                time.sleep(self.refresh_interval)
+
+        events.add_listener(self.apply)
+        thread = threading.Thread(target=refresh,
+                                  name="timetable-refresh",
+                                  daemon=True)
+        thread.start()
+        self.running = True
+        return thread
+
+    def stats(self):
+        with self._lock:
+            days = [
+                day for cities in self._days.values()
+                for day in cities.values() if day is not None
+            ]
+            return {
+                "dates": len(self._dates),
+                "days": len(days),
+                "shows": sum(len(day) for day in days),
+                "bytes": sum(day.nbytes for day in days),
+                "loads": self.loads,
+                "refreshes": self.refreshes,
+                "updates": self.updates,
+                "invalidations": self.invalidations
+            }
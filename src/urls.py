@@ -3,7 +3,15 @@ from src import resources
 
 api.add_resource(resources.UserResource, '/user/')
 api.add_resource(resources.UserLogin, '/user/login/')
+api.add_resource(resources.UserTicketsResource, '/user/tickets/')
 api.add_resource(resources.CityResource, '/cities/')
 api.add_resource(resources.MovieResource, '/movies/')
+api.add_resource(resources.NearbyCinemasResource, '/cinemas/nearby/')
 api.add_resource(resources.ShowResource, '/shows/')
+api.add_resource(resources.SeatStreamResource, '/shows/stream/')
+api.add_resource(resources.SearchResource, '/search/')
+api.add_resource(resources.AutocompleteResource, '/search/autocomplete/')
 api.add_resource(resources.TicketResource, '/tickets/')
+api.add_resource(resources.BulkTicketResource, '/tickets/bulk/')
+api.add_resource(resources.SeatHoldResource, '/tickets/holds/')
+api.add_resource(resources.SeatHoldConfirmResource, '/tickets/holds/confirm/')
@@ -0,0 +1,211 @@
+"""
+Request validation schemas.
+
+Schemas are built once at import and shared by all requests, so parsing a
+request costs the same on the millionth call as on the first. Invalid
+requests are answered with a 400 listing the error of every field.
+"""
+import base64
+import binascii
+from datetime import datetime
+
+from flask import request
+from flask_restful import abort
+from marshmallow import EXCLUDE, ValidationError, validates_schema
+from marshmallow.validate import Length, Range
+
+from src.main import ma
+
+DATE_FORMAT = "%d-%m-%Y"
+# seat numbers are bits of a show's seat map, see src/seats.py
+MAX_SEAT_NUMBER = 9999
+MAX_SEATS_PER_HOLD = 50
+
+
+class Cursor(ma.Field):
+    """
+    Booking history cursor, loaded as a (transaction date, ticket id) pair.
+    """
+    def _deserialize(self, value, attr, data, **kwargs):
+        try:
+            transaction_date, ticket_id = base64.urlsafe_b64decode(
+                value.encode()).decode().split("_")
+            return (datetime.strptime(transaction_date, "%Y-%m-%d").date(),
+                    int(ticket_id))
+        except (binascii.Error, UnicodeDecodeError, ValueError):
+            raise ValidationError("Invalid cursor")
+
+
+class QuerySchema(ma.Schema):
+    """
+    Base schema for query string arguments, unknown arguments are ignored.
+    """
+    class Meta:
+        unknown = EXCLUDE
+
+
+class UserCredentialsSchema(ma.Schema):
+    phone_number = ma.Str(
+        required=True,
+        error_messages={"required": "Phone number cannot be blank"})
+    password = ma.Str(required=True,
+                      error_messages={"required": "Password cannot be blank"})
+
+
+class MovieQuerySchema(QuerySchema):
+    city_id = ma.Int(required=True,
+                     error_messages={"required": "city id is mandatory"})
+    show_date = ma.Date(format=DATE_FORMAT, missing=None)
+    after = ma.Int(missing=None)
+    limit = ma.Int(missing=None, validate=Range(min=1))
+
+
+class LocationQuerySchema(QuerySchema):
+    """
+    Optional point and radius in km, latitude and longitude go together.
+    """
+    lat = ma.Float(missing=None, validate=Range(min=-90, max=90))
+    lon = ma.Float(missing=None, validate=Range(min=-180, max=180))
+    radius = ma.Float(missing=5, validate=Range(min=0.1, max=100))
+
+    @validates_schema
+    def validate_location(self, data, **kwargs):
+        if (data.get("lat") is None) != (data.get("lon") is None):
+            raise ValidationError("lat and lon must be given together",
+                                  "lat")
+
+
+class ShowQuerySchema(LocationQuerySchema):
+    movie_id = ma.Int(required=True,
+                      error_messages={"required": "movie id is mandatory"})
+    cinema_id = ma.Int(missing=None)
+    show_time = ma.Str(missing=None)
+    show_date = ma.Date(format=DATE_FORMAT, missing=None)
+    from_date = ma.Date(format=DATE_FORMAT, missing=None)
+    to_date = ma.Date(format=DATE_FORMAT, missing=None)
+
+
+class NearbyCinemasQuerySchema(LocationQuerySchema):
+    city_id = ma.Int(required=True,
+                     error_messages={"required": "city id is mandatory"})
+    lat = ma.Float(required=True,
+                   validate=Range(min=-90, max=90),
+                   error_messages={"required": "lat is mandatory"})
+    lon = ma.Float(required=True,
+                   validate=Range(min=-180, max=180),
+                   error_messages={"required": "lon is mandatory"})
+    limit = ma.Int(missing=10, validate=Range(min=1, max=50))
+
+
+class SeatStreamQuerySchema(QuerySchema):
+    cinema_id = ma.Int(required=True,
+                       error_messages={"required": "cinema id is mandatory"})
+    movie_id = ma.Int(missing=None)
+    show_time = ma.Str(missing=None)
+    show_date = ma.Date(format=DATE_FORMAT, missing=None)
+
+
+class SearchQuerySchema(QuerySchema):
+    q = ma.Str(required=True,
+               validate=Length(min=1, max=100),
+               error_messages={"required": "search term is mandatory"})
+    city_id = ma.Int(missing=None)
+    limit = ma.Int(missing=10, validate=Range(min=1, max=50))
+
+
+class AutocompleteQuerySchema(SearchQuerySchema):
+    city_id = ma.Int(required=True,
+                     error_messages={"required": "city id is mandatory"})
+
+
+class TicketHistoryQuerySchema(QuerySchema):
+    cursor = Cursor(missing=None)
+    limit = ma.Int(missing=20, validate=Range(min=1, max=100))
+
+
+class TicketSchema(ma.Schema):
+    movie = ma.Int(required=True,
+                   data_key="movie_id",
+                   error_messages={"required": "movie id is mandatory"})
+    cinema = ma.Int(required=True,
+                    data_key="cinema_id",
+                    error_messages={"required": "cinema id is mandatory"})
+    show_time = ma.Str(required=True,
+                       error_messages={"required": "show time is mandatory"})
+    no_of_seats = ma.Int(
+        required=True,
+        validate=Range(min=1,
+                       error="Number of tickets must be at least 1"),
+        error_messages={"required": "number of tickets is mandatory"})
+    ticket_date = ma.Date(
+        format=DATE_FORMAT,
+        required=True,
+        error_messages={"required": "Ticket date is mandatory"})
+
+
+class BulkTicketSchema(ma.Schema):
+    tickets = ma.List(ma.Nested(TicketSchema),
+                      required=True,
+                      validate=Length(min=1, max=50),
+                      error_messages={"required": "tickets are mandatory"})
+
+
+class SeatHoldSchema(ma.Schema):
+    movie_id = ma.Int(required=True,
+                      error_messages={"required": "movie id is mandatory"})
+    cinema_id = ma.Int(required=True,
+                       error_messages={"required": "cinema id is mandatory"})
+    show_time = ma.Str(required=True,
+                       error_messages={"required": "show time is mandatory"})
+    ticket_date = ma.Date(
+        format=DATE_FORMAT,
+        required=True,
+        error_messages={"required": "Ticket date is mandatory"})
+    seats = ma.List(ma.Int(validate=Range(
+        min=0,
+        max=MAX_SEAT_NUMBER,
+        error="Seat numbers must be between {min} and {max}")),
+                    required=True,
+                    validate=Length(min=1, max=MAX_SEATS_PER_HOLD),
+                    error_messages={"required": "seats are mandatory"})
+
+
+class HoldSchema(ma.Schema):
+    hold_id = ma.Int(required=True,
+                     error_messages={"required": "hold id is mandatory"})
+
+
+user_credentials = UserCredentialsSchema()
+movie_query = MovieQuerySchema()
+show_query = ShowQuerySchema()
+nearby_cinemas_query = NearbyCinemasQuerySchema()
+seat_stream_query = SeatStreamQuerySchema()
+search_query = SearchQuerySchema()
+autocomplete_query = AutocompleteQuerySchema()
+ticket_history_query = TicketHistoryQuerySchema()
+ticket = TicketSchema()
+bulk_tickets = BulkTicketSchema()
+seat_hold = SeatHoldSchema()
+hold = HoldSchema()
+
+
+def parse(schema, location="json"):
+    """
+    Validates the request body (``json``) or query string (``args``) with
+    the given schema and returns the loaded data, aborting with a 400 when
+    any field is invalid.
+    """
+    if location == "args":
+        source = request.args.to_dict()
+    else:
+        source = request.get_json(silent=True)
+        if not isinstance(source, dict):
+            source = request.form.to_dict()
+    try:
+        return schema.load(source)
+    except ValidationError as err:
+        abort(400,
+              data={
+                  "error_message": "Invalid request",
+                  "errors": err.messages
+              })
@@ -0,0 +1,143 @@
+"""
+Fixtures for the tests, which run against a real Postgres.
+
+Every test is skipped unless ``DATABASE_URL`` is set. It must point at a
+scratch database: the schema is migrated to the latest revision and the
+tables are replaced with the synthetic dataset of benchmarks/datagen.py.
+
+    DATABASE_URL=postgresql://localhost/movie_tickets_test python -m pytest
+"""
+import os
+import random
+import uuid
+from argparse import Namespace
+from datetime import date
+
+import pytest
+
+# settings read when src/config.py is imported; no response cache, so
+# every request reaches the database, and inline password hashing
+os.environ.setdefault("SECRET_KEY", "test-secret")
+os.environ.setdefault("JWT_SECRET_KEY", "test-secret")
+os.environ.setdefault("CACHE_MAX_ENTRIES", "0")
+os.environ.setdefault("HASH_POOL_WORKERS", "0")
+os.environ.setdefault("DB_POOL_SIZE", "20")
+os.environ.setdefault("DB_MAX_OVERFLOW", "80")
+
+MIGRATIONS = os.path.join(os.path.dirname(os.path.dirname(__file__)),
+                          "migrations")
+
+# large enough for the planner to prefer the indexes it would in production
+DATASET = Namespace(cities=20,
+                    cinemas_per_city=25,
+                    movies=2000,
+                    movies_per_cinema=10,
+                    show_times=4,
+                    days=7,
+                    seats=200,
+                    premiere_seats=500,
+                    users=20000,
+                    tickets_per_user=5,
+                    seed=1)
+
+NEW_MOVIE = """
+    INSERT INTO movies (name, release_date) VALUES (:name, :release_date)
+    RETURNING id
+"""
+NEW_SHOW = """
+    INSERT INTO shows (movie_id, cinema_id, show_times, show_date,
+                       no_of_seats, seat_map)
+    VALUES (:movie_id, :cinema_id, :show_time, :show_date, :seats,
+            repeat('0', :seats)::varbit)
+"""
+DELETE_MOVIES = [
+    "DELETE FROM tickets WHERE movie = ANY(:movie_ids)",
+    "DELETE FROM seat_holds WHERE movie_id = ANY(:movie_ids)",
+    "DELETE FROM shows WHERE movie_id = ANY(:movie_ids)",
+    "DELETE FROM movies WHERE id = ANY(:movie_ids)"
+]
+
+
+@pytest.fixture(scope="session")
+def app():
+    if not os.environ.get("DATABASE_URL"):
+        pytest.skip("DATABASE_URL is not set")
+    from flask_migrate import upgrade
+    from src import app
+
+    with app.app_context():
+        upgrade(directory=MIGRATIONS)
+    return app
+
+
+@pytest.fixture(scope="session")
+def dataset(app):
+    """
+    Loads the synthetic dataset once per run and returns its manifest.
+    """
+    from benchmarks.datagen import generate, load
+
+    with app.app_context():
+        rows, manifest = generate(DATASET, random.Random(DATASET.seed),
+                                  date.today())
+        load(rows, reset=True)
+    return manifest
+
+
+@pytest.fixture
+def auth(app):
+    """
+    Returns the Authorization header of a user id.
+    """
+    from flask_jwt_extended import create_refresh_token
+
+    def header(user_id):
+        with app.app_context():
+            token = create_refresh_token({"id": user_id})
+        return {"Authorization": "Bearer {0}".format(token)}
+
+    return header
+
+
+@pytest.fixture
+def new_show(app, dataset):
+    """
+    Creates a show of a new movie today with the given number of seats and
+    returns it as booking request fields. The movies, their shows, holds
+    and tickets are deleted after the test.
+    """
+    from sqlalchemy import text
+    from src.main import db
+
+    movie_ids = []
+
+    def create(seats, cinema_id=1, show_time="10:00"):
+        today = date.today()
+        with app.app_context():
+            movie_id = db.session.execute(
+                text(NEW_MOVIE), {
+                    "name": "Test {0}".format(uuid.uuid4()),
+                    "release_date": today
+                }).scalar()
+            db.session.execute(
+                text(NEW_SHOW), {
+                    "movie_id": movie_id,
+                    "cinema_id": cinema_id,
+                    "show_time": show_time,
+                    "show_date": today,
+                    "seats": seats
+                })
+            db.session.commit()
+        movie_ids.append(movie_id)
+        return {
+            "movie_id": movie_id,
+            "cinema_id": cinema_id,
+            "show_time": show_time,
+            "ticket_date": today.strftime("%d-%m-%Y")
+        }
+
+    yield create
+    with app.app_context():
+        for statement in DELETE_MOVIES:
+            db.session.execute(text(statement), {"movie_ids": movie_ids})
+        db.session.commit()
@@ -0,0 +1,119 @@
+"""
+Hundreds of parallel bookings of one show never sell more seats than it
+has, whichever way they book.
+"""
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+CLIENTS = 100
+BOOKINGS = 400
+
+SHOW_STATE = """
+    SELECT no_of_seats,
+           length(replace(seat_map::text, '0', '')) AS taken_bits,
+           (SELECT coalesce(sum(no_of_seats), 0) FROM tickets
+            WHERE movie = shows.movie_id) AS booked,
+           (SELECT coalesce(sum(no_of_seats), 0) FROM seat_holds
+            WHERE movie_id = shows.movie_id) AS held
+    FROM shows WHERE movie_id = :movie_id
+"""
+
+
+def post_all(app, requests):
+    """
+    Sends (path, body, headers) POST requests from ``CLIENTS`` threads and
+    returns the response status codes.
+    """
+    def post(request):
+        path, body, headers = request
+        return app.test_client().post(path, json=body,
+                                      headers=headers).status_code
+
+    with ThreadPoolExecutor(CLIENTS) as pool:
+        return list(pool.map(post, requests))
+
+
+def show_state(app, show):
+    from sqlalchemy import text
+    from src.main import db
+
+    with app.app_context():
+        state = db.session.execute(text(SHOW_STATE), {
+            "movie_id": show["movie_id"]
+        }).first()
+        db.session.rollback()
+    return state
+
+
+def assert_not_oversold(state, capacity):
+    assert state.no_of_seats >= 0
+    # every seat is sold, held or still counted as available exactly once
+    assert state.booked + state.held + state.no_of_seats == capacity
+    # and the seat map marks exactly the seats sold or held
+    assert state.taken_bits == capacity - state.no_of_seats
+
+
+def test_count_bookings_never_oversell(app, auth, new_show):
+    capacity = 150
+    show = new_show(capacity)
+    rng = random.Random(1)
+    requests = []
+    for user_id in range(1, BOOKINGS + 1):
+        ticket = dict(show, no_of_seats=rng.randint(1, 4))
+        if user_id % 4:
+            requests.append(("/tickets/", ticket, auth(user_id)))
+        else:
+            requests.append(("/tickets/bulk/", {
+                "tickets": [ticket]
+            }, auth(user_id)))
+
+    statuses = post_all(app, requests)
+
+    assert set(statuses) <= {200, 201, 404, 503}
+    state = show_state(app, show)
+    assert_not_oversold(state, capacity)
+    assert state.held == 0
+    # far more seats were asked for than the show has, so it sold out
+    # apart from fewer seats than the largest request
+    assert state.no_of_seats < 4
+
+
+def test_holds_and_count_bookings_never_oversell(app, auth, new_show):
+    capacity = 80
+    show = new_show(capacity)
+    rng = random.Random(2)
+    requests = []
+    for user_id in range(1, BOOKINGS + 1):
+        if user_id % 2:
+            requests.append(("/tickets/",
+                             dict(show, no_of_seats=rng.randint(1, 3)),
+                             auth(user_id)))
+        else:
+            requests.append(("/tickets/holds/",
+                             dict(show,
+                                  seats=rng.sample(range(capacity),
+                                                   rng.randint(1, 3))),
+                             auth(user_id)))
+
+    statuses = post_all(app, requests)
+
+    assert set(statuses) <= {200, 201, 404, 409, 503}
+    assert_not_oversold(show_state(app, show), capacity)
+
+
+def test_holds_fail_once_count_bookings_sold_out(app, auth, new_show):
+    capacity = 20
+    show = new_show(capacity)
+
+    statuses = post_all(app, [("/tickets/", dict(show, no_of_seats=1),
+                               auth(user_id))
+                              for user_id in range(1, capacity + 1)])
+    assert statuses == [200] * capacity
+
+    response = app.test_client().post("/tickets/holds/",
+                                      json=dict(show, seats=[0]),
+                                      headers=auth(capacity + 1))
+    assert response.status_code == 409
+    state = show_state(app, show)
+    assert state.no_of_seats == 0
+    assert_not_oversold(state, capacity)
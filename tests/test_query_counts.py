@@ -0,0 +1,103 @@
+"""
+/movies/ issues the same number of SQL statements however many cinemas a
+city has.
+"""
+from datetime import date, timedelta
+
+NEW_CITY = "INSERT INTO cities (city_name) VALUES ('Test city') RETURNING id"
+NEW_CINEMAS = """
+    INSERT INTO cinemas (name, show_times, city, latitude, longitude)
+    SELECT 'Test cinema ' || n, '{10:00}', :city_id, 0, 0
+    FROM generate_series(1, :count) AS n
+"""
+# every cinema of the city plays the same few movies
+NEW_SHOWS = """
+    INSERT INTO shows (movie_id, cinema_id, show_times, show_date,
+                       no_of_seats, seat_map)
+    SELECT movies.id, cinemas.id, '10:00', :show_date, 100,
+           repeat('0', 100)::varbit
+    FROM cinemas, (SELECT id FROM movies ORDER BY id LIMIT 5) AS movies
+    WHERE cinemas.city = :city_id
+    AND NOT EXISTS (SELECT 1 FROM shows WHERE shows.cinema_id = cinemas.id)
+"""
+DELETE_CITY = [
+    "DELETE FROM shows WHERE cinema_id IN "
+    "(SELECT id FROM cinemas WHERE city = :city_id)",
+    "DELETE FROM cinemas WHERE city = :city_id",
+    "DELETE FROM cities WHERE id = :city_id"
+]
+
+
+class StatementCounter:
+    """
+    Counts the statements sent to any engine while installed.
+    """
+    def __init__(self):
+        self.count = 0
+
+    def __enter__(self):
+        from sqlalchemy import event
+        from sqlalchemy.engine import Engine
+
+        self.count = 0
+        event.listen(Engine, "before_cursor_execute", self._count)
+        return self
+
+    def __exit__(self, *exc_info):
+        from sqlalchemy import event
+        from sqlalchemy.engine import Engine
+
+        event.remove(Engine, "before_cursor_execute", self._count)
+
+    def _count(self, *args):
+        self.count += 1
+
+
+def test_movies_statements_do_not_grow_with_cinemas(app, dataset):
+    from sqlalchemy import text
+    from src.main import db
+
+    # past the timetable's window, so every request reaches the database
+    show_date = date.today() + timedelta(days=dataset["days"] - 1)
+    client = app.test_client()
+
+    def add_cinemas(city_id, count):
+        with app.app_context():
+            db.session.execute(text(NEW_CINEMAS), {
+                "city_id": city_id,
+                "count": count
+            })
+            db.session.execute(text(NEW_SHOWS), {
+                "city_id": city_id,
+                "show_date": show_date
+            })
+            db.session.commit()
+
+    def get_movies(query):
+        with StatementCounter() as counter:
+            response = client.get("/movies/", query_string=query)
+        assert response.status_code == 200
+        movies = [movie["id"] for movie in response.get_json()["data"]]
+        # a movie playing in several cinemas is listed once
+        assert len(movies) == len(set(movies)) == 5
+        return counter.count
+
+    with app.app_context():
+        city_id = db.session.execute(text(NEW_CITY)).scalar()
+        db.session.commit()
+    queries = [
+        {"city_id": city_id},
+        {"city_id": city_id, "limit": 10},
+        {"city_id": city_id, "show_date": show_date.strftime("%d-%m-%Y")},
+    ]
+    try:
+        add_cinemas(city_id, 1)
+        counts = [get_movies(query) for query in queries]
+        add_cinemas(city_id, 300)
+        assert [get_movies(query) for query in queries] == counts
+        assert max(counts) <= 2
+    finally:
+        with app.app_context():
+            for statement in DELETE_CITY:
+                db.session.execute(text(statement), {"city_id": city_id})
+            db.session.commit()
@@ -0,0 +1,114 @@
+"""
+Plan regression checks: every query the resources issue is planned with
+``EXPLAIN (FORMAT JSON)`` against the seeded dataset and must neither scan
+a large table sequentially nor exceed its cost budget.
+
+Only the timetable's full window load is left out, it reads every show of
+the window and is meant to scan.
+"""
+from datetime import date, datetime, timedelta
+
+# a sequential scan of a table estimated to hold more rows fails the test
+SEQ_SCAN_MAX_ROWS = 10000
+
+ESTIMATED_ROWS = "SELECT reltuples FROM pg_class WHERE relname = %(name)s"
+
+
+def plan_nodes(plan):
+    yield plan
+    for child in plan.get("Plans", ()):
+        yield from plan_nodes(child)
+
+
+def explain(connection, statement):
+    compiled = statement.compile(dialect=connection.dialect)
+    return connection.execute("EXPLAIN (FORMAT JSON) " + str(compiled),
+                              compiled.params).scalar()[0]["Plan"]
+
+
+def planned_queries(dataset):
+    """
+    Returns (name, cost budget, statement) of the queries behind each
+    resource, with realistic parameters for the seeded dataset.
+    """
+    from src import seats
+    from src.models import Cinema, Movie, Show, Ticket, User
+    from benchmarks import phone_number
+
+    today = datetime.combine(date.today(), datetime.min.time())
+    lat, lon = dataset["city_centres"][0]
+    show = {
+        "movie_id": 1,
+        "cinema_id": 1,
+        "show_time": dataset["show_times"][0],
+        "show_date": today
+    }
+    return [
+        ("login", 20,
+         User.query.filter_by(phone_number=phone_number(1)).statement),
+        ("movies playing in a city", 5000,
+         Movie.playing_in_city(1, today, limit=20).statement),
+        ("movies playing in a city, next page", 5000,
+         Movie.playing_in_city(1, today, after=100, limit=20).statement),
+        ("movie schedule on a date", 500,
+         Show.schedule(1, show_date=today).statement),
+        ("movie schedule at a cinema", 300,
+         Show.schedule(1, cinema_id=1, from_date=today).statement),
+        ("movie schedule near a location", 1000,
+         Show.schedule(1, show_date=today, lat=lat, lon=lon,
+                       radius=10).statement),
+        ("timetable of a city day", 5000,
+         Show.timetable(today, today + timedelta(days=1),
+                        city_id=1).statement),
+        ("movie search in a city", 3000,
+         Movie.search("Movie 1", city_id=1).statement),
+        ("cinema search in a city", 200,
+         Cinema.search("Cinema 1", city_id=1).statement),
+        ("nearest cinemas", 200,
+         Cinema.nearest(lat, lon, 10, city_id=1).statement),
+        ("ticket history", 500, Ticket.history(1).statement),
+        ("ticket history, next page", 500,
+         Ticket.history(1, before=(today.date(), 10)).statement),
+        ("reserve seats", 20,
+         Show.reserve_seats_statement(1, 1, show["show_time"], today, 2)),
+        ("seat map width", 20, seats.SEAT_MAP_WIDTH.bindparams(**show)),
+        ("hold seats", 50,
+         seats.HOLD_SEATS.bindparams(mask="011",
+                                     width=3,
+                                     count=2,
+                                     user_id=1,
+                                     ttl=600,
+                                     **show)),
+        ("confirm hold", 50,
+         seats.CONFIRM_HOLD.bindparams(hold_id=1,
+                                       user_id=1,
+                                       transaction_id="plan",
+                                       transaction_date=today.date())),
+        ("release hold", 50,
+         seats.RELEASE_HOLD.bindparams(hold_id=1, user_id=1)),
+    ]
+
+
+def test_query_plans(app, dataset):
+    from src.main import db
+
+    regressions = []
+    with app.app_context():
+        connection = db.session.connection()
+        for name, budget, statement in planned_queries(dataset):
+            plan = explain(connection, statement)
+            for node in plan_nodes(plan):
+                if node["Node Type"] != "Seq Scan":
+                    continue
+                rows = connection.execute(ESTIMATED_ROWS, {
+                    "name": node["Relation Name"]
+                }).scalar()
+                if rows > SEQ_SCAN_MAX_ROWS:
+                    regressions.append(
+                        "{0}: sequential scan of {1} ({2:.0f} rows)".format(
+                            name, node["Relation Name"], rows))
+            if plan["Total Cost"] > budget:
+                regressions.append("{0}: cost {1} over budget {2}".format(
+                    name, plan["Total Cost"], budget))
+        db.session.rollback()
+    assert not regressions, "\n".join(regressions)
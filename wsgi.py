@@ -1,6 +1,18 @@
 # callable application is imported so that we can pass it to wsgi server.
 
 from src import app
+from src.main import evict_catalog, seat_events, timetable
+from src.models import Show
+from src.seats import start_hold_sweeper
+
+if app.config['SEAT_HOLD_SWEEP_INTERVAL'] > 0:
+    start_hold_sweeper(app, app.config['SEAT_HOLD_SWEEP_INTERVAL'],
+                       app.config['SEAT_HOLD_SWEEP_BATCH'])
+
+seat_events.add_listener(evict_catalog)
+
+if app.config['TIMETABLE_DAYS'] > 0:
+    timetable.start(app, Show.timetable, seat_events)
 
 if __name__ == '__main__':
     app.run('0.0.0.0', '7000', debug=True)